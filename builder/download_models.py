@@ -5,13 +5,53 @@ Downloads Wan 2.1 models and LoRA files for ComfyUI
 """
 
 import os
+import re
 import sys
+import json
+import random
+import hashlib
+import inspect
+import argparse
+import threading
 import urllib.request
 import urllib.error
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import time
 
+SRC_PATH = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_PATH if SRC_PATH.exists() else "/workspace/src"))
+
+import model_manifest
+from model_manifest import IntegrityError
+
+MODELS_PATH = Path(os.environ.get("MODELS_PATH", "/workspace/ComfyUI/models"))
+
+# Ranged downloads: files are split into segments fetched over parallel connections
+DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", "8"))
+SEGMENT_SIZE = int(os.environ.get("DOWNLOAD_SEGMENT_MB", "64")) * 1024 * 1024
+SEGMENT_RETRIES = 5
+CHUNK_SIZE = 1024 * 1024
+USER_AGENT = "AI-Avatarka/1.0"
+
+# LoRAs are small, so their phase is latency-bound: fetch several at once
+LORA_CONNECTIONS = int(os.environ.get("LORA_CONNECTIONS", "4"))
+LORA_RETRIES = 4
+LORA_TIMEOUT = float(os.environ.get("LORA_TIMEOUT", "60"))
+RETRY_BASE_DELAY = float(os.environ.get("DOWNLOAD_RETRY_DELAY", "2"))
+GDRIVE_URL = os.environ.get("GDRIVE_URL", "https://drive.google.com/uc?id={file_id}")
+
+# Hugging Face publishes the size and SHA-256 of every LFS file; used to pin base models
+HF_API_URL = os.environ.get("HF_API_URL", "https://huggingface.co/api")
+HF_RESOLVE = re.compile(r"https://huggingface\.co/(?P<repo>[^/]+/[^/]+)/resolve/(?P<rev>[^/]+)/(?P<path>.+)")
+
+# Exit codes: a required base model is missing/corrupt, or some effects have no LoRA
+EXIT_FAILED = 1
+EXIT_MISSING_LORAS = 2
+
+EFFECTS_CONFIG = Path(os.environ.get("EFFECTS_CONFIG", Path(__file__).resolve().parent.parent / "prompts" / "effects.json"))
+
 # CORRECTED MODEL CONFIGURATION - using the exact URL you specified
 MODELS_CONFIG = {
     "diffusion_models": {
@@ -95,7 +135,7 @@ def install_gdown():
 
 def create_directories():
     """Create necessary model directories"""
-    base_path = Path("/workspace/ComfyUI/models")
+    base_path = MODELS_PATH
     
     directories = [
         "diffusion_models",
@@ -110,92 +150,318 @@ def create_directories():
         dir_path.mkdir(parents=True, exist_ok=True)
         print_info(f"Created directory: {dir_path}")
 
-def download_with_progress(url, filepath, expected_size_gb=None):
-    """Download file with progress bar and retries"""
+def open_url(url, start=None, end=None, timeout=30):
+    """GET url, optionally only bytes start..end (inclusive)"""
+    req = urllib.request.Request(url)
+    req.add_header("User-Agent", USER_AGENT)
+    if start is not None:
+        req.add_header("Range", f"bytes={start}-{'' if end is None else end}")
+    return urllib.request.urlopen(req, timeout=timeout)
+
+def probe(url):
+    """(total size, ranges supported) - a one-byte range request answers both"""
+    with open_url(url, 0, 0) as response:
+        content_range = response.headers.get("Content-Range", "")
+        match = re.match(r"bytes 0-0/(\d+)", content_range)
+        if response.status == 206 and match:
+            return int(match.group(1)), True
+        return int(response.headers.get("Content-Length", 0)) or None, False
+
+def hub_pin(url):
+    """{"size", "sha256"} Hugging Face lists for a resolve URL, or None if unavailable"""
+    match = HF_RESOLVE.match(url)
+    if not match:
+        return None
+    folder = match["path"].rpartition("/")[0]
+    try:
+        with open_url(f"{HF_API_URL}/models/{match['repo']}/tree/{match['rev']}/{folder}") as response:
+            entries = json.load(response)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        print_warning(f"Could not read Hugging Face metadata for {match['path']}: {e}")
+        return None
+    for entry in entries:
+        if entry.get("path") == match["path"] and entry.get("lfs"):
+            return {"size": entry["lfs"]["size"], "sha256": entry["lfs"]["oid"]}
+    return None
+
+class SegmentState:
+    """Sidecar <file>.part.json listing finished segments, so an interrupted download resumes"""
+
+    def __init__(self, path, url, size, segment_size):
+        self.path = path
+        self.key = {"url": url, "size": size, "segment_size": segment_size}
+        self.done = set()
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Finished segments from an earlier attempt at the same file, or False"""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if {key: saved.get(key) for key in self.key} != self.key:
+            return False
+        self.done = set(saved.get("done", []))
+        return True
+
+    def mark_done(self, index):
+        with self.lock:
+            self.done.add(index)
+            temp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(temp_path, "w") as f:
+                json.dump({**self.key, "done": sorted(self.done)}, f)
+            os.replace(temp_path, self.path)
+
+class PrefixHasher:
+    """SHA-256 of a segmented download, advanced over the finished prefix as segments land.
+    
+    The bytes are read back right after being written, so they come from the page cache
+    and verification costs no second pass over the disk.
+    """
+
+    def __init__(self, part_path, size, segment_size):
+        self.part_path = part_path
+        self.size = size
+        self.segment_size = segment_size
+        self.digest = hashlib.sha256()
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def advance(self, done):
+        with self.lock:
+            with open(self.part_path, "rb") as f:
+                while self.next_index in done:
+                    f.seek(self.next_index * self.segment_size)
+                    remaining = min(self.segment_size, self.size - self.next_index * self.segment_size)
+                    while remaining:
+                        block = f.read(min(CHUNK_SIZE * 8, remaining))
+                        if not block:
+                            raise IOError("segment shorter than expected")
+                        self.digest.update(block)
+                        remaining -= len(block)
+                    self.next_index += 1
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+def preallocate(path, size):
+    """Create the full-size output file up front; segments are written in place"""
+    with open(path, "wb") as f:
+        if hasattr(os, "posix_fallocate") and size:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f.truncate(size)
+
+def fetch_segment(url, part_path, start, end):
+    """Fetch bytes start..end into part_path at their offset, retrying on failure"""
+    for attempt in range(SEGMENT_RETRIES):
+        offset = start
+        try:
+            with open_url(url, start, end) as response, open(part_path, "r+b") as f:
+                if response.status != 206:
+                    raise IOError(f"server ignored range request (HTTP {response.status})")
+                f.seek(start)
+                while offset <= end:
+                    chunk = response.read(min(CHUNK_SIZE, end - offset + 1))
+                    if not chunk:
+                        raise IOError(f"connection closed at byte {offset}")
+                    f.write(chunk)
+                    offset += len(chunk)
+            return
+        except Exception as e:
+            if attempt == SEGMENT_RETRIES - 1:
+                raise
+            print_warning(f"Segment {start}-{end} failed at byte {offset} ({e}), retrying")
+            time.sleep(2 ** attempt)
+
+def download_stream(url, part_path):
+    """Single-connection fallback for servers without range support; returns the SHA-256"""
+    digest = hashlib.sha256()
+    with open_url(url, timeout=30) as response, open(part_path, "wb") as f:
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+def download_ranged(url, part_path, size):
+    """Fetch missing segments over DOWNLOAD_CONNECTIONS connections into a preallocated file.
+    
+    Returns the SHA-256 of the whole file, computed while the segments arrive.
+    """
+    state = SegmentState(part_path.with_name(part_path.name + ".json"), url, size, SEGMENT_SIZE)
+    if part_path.exists() and state.load():
+        print_info(f"Resuming {part_path.name}: {len(state.done)} segments already done")
+    else:
+        preallocate(part_path, size)
+    
+    segments = [
+        (index, start, min(start + SEGMENT_SIZE, size) - 1)
+        for index, start in enumerate(range(0, size, SEGMENT_SIZE))
+        if index not in state.done
+    ]
+    total_segments = -(-size // SEGMENT_SIZE)
+    progress_step = max(1, total_segments // 20)
+    hasher = PrefixHasher(part_path, size, SEGMENT_SIZE)
+    # Segments kept from an interrupted run are hashed up front
+    hasher.advance(state.done)
+    
+    def run(segment):
+        index, start, end = segment
+        fetch_segment(url, part_path, start, end)
+        state.mark_done(index)
+        hasher.advance(state.done)
+        finished = len(state.done)
+        if finished % progress_step == 0 or finished == total_segments:
+            print_info(f"Progress: {finished / total_segments * 100:.1f}% "
+                       f"({min(finished * SEGMENT_SIZE, size) / (1024**3):.2f}GB / {size / (1024**3):.2f}GB)")
+    
+    with ThreadPoolExecutor(max_workers=max(1, DOWNLOAD_CONNECTIONS), thread_name_prefix="segment") as pool:
+        # list() re-raises the first segment that ran out of retries
+        list(pool.map(run, segments))
+    state.path.unlink(missing_ok=True)
+    return hasher.hexdigest()
+
+def download_with_progress(url, filepath, name=None, expected=None):
+    """Download file with parallel ranged segments; interrupted downloads resume from <file>.part.
+    
+    The streamed SHA-256 is checked against the manifest entry and recorded as verified.
+    """
+    part_path = filepath.with_name(filepath.name + ".part")
     max_retries = 3
     
     for attempt in range(max_retries):
         try:
             print_info(f"Downloading: {filepath.name} (attempt {attempt + 1}/{max_retries})")
+            size, ranged = probe(url)
+            start_time = time.time()
             
-            req = urllib.request.Request(url)
-            req.add_header('User-Agent', 'AI-Avatarka/1.0')
-            
-            with urllib.request.urlopen(req, timeout=30) as response:
-                total_size = int(response.headers.get('Content-Length', 0))
-                downloaded = 0
-                chunk_size = 1024 * 1024  # 1MB chunks for better progress
-                
-                with open(filepath, 'wb') as f:
-                    while True:
-                        chunk = response.read(chunk_size)
-                        if not chunk:
-                            break
-                        
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        # Progress reporting every 500MB
-                        if downloaded % (500 * 1024 * 1024) == 0:
-                            if total_size > 0:
-                                progress = (downloaded / total_size) * 100
-                                print_info(f"Progress: {progress:.1f}% ({downloaded / (1024**3):.2f}GB / {total_size / (1024**3):.2f}GB)")
-                            else:
-                                print_info(f"Downloaded: {downloaded / (1024**3):.2f}GB")
+            if ranged and size:
+                sha256 = download_ranged(url, part_path, size)
+            else:
+                print_warning(f"{filepath.name}: server does not support ranges, using one connection")
+                sha256 = download_stream(url, part_path)
             
-            # Verify file size
-            actual_size = filepath.stat().st_size
-            print_info(f"Downloaded successfully: {filepath.name} ({actual_size/(1024**3):.2f}GB)")
+            # Verify file size and hash
+            actual_size = part_path.stat().st_size
+            if size and actual_size != size:
+                raise IOError(f"size mismatch: {actual_size} != {size}")
+            try:
+                model_manifest.check_expected(filepath.name, actual_size, sha256, expected)
+            except IntegrityError:
+                part_path.unlink(missing_ok=True)
+                raise
+            os.replace(part_path, filepath)
+            if name:
+                model_manifest.record_verified(MODELS_PATH, name, sha256)
+            elapsed = max(time.time() - start_time, 1e-6)
+            print_info(f"Downloaded successfully: {filepath.name} ({actual_size/(1024**3):.2f}GB, "
+                       f"{actual_size / elapsed / (1024**2):.1f}MB/s)")
             return True
             
         except Exception as e:
             print_error(f"Attempt {attempt + 1} failed for {filepath.name}: {e}")
-            if filepath.exists():
-                filepath.unlink()  # Remove partial download
+            # Ranged progress stays in <file>.part(.json) for the next attempt or build
             
             if attempt < max_retries - 1:
-                print_info("Retrying in 10 seconds...")
-                time.sleep(10)
+                delay = backoff_delay(attempt)
+                print_info(f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
     
     return False
 
-def download_from_gdrive(file_id, destination, filename):
-    """Download file from Google Drive using gdown with retries"""
-    gdown = install_gdown()
-    
-    print_info(f"Downloading {filename} from Google Drive...")
+def backoff_delay(attempt):
+    """Exponential backoff with jitter: ~2s, 4s, 8s... capped at a minute"""
+    return min(60.0, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.75, 1.25)
+
+def download_from_gdrive(file_id, destination, filename, expected=None):
+    """Download file from Google Drive using gdown with retries, then verify and record it.
     
-    url = f"https://drive.google.com/uc?id={file_id}"
+    Returns None on success, else the last error.
+    """
+    gdown = install_gdown()
+    url = GDRIVE_URL.format(file_id=file_id)
+    # Without a timeout a stalled transfer hangs the build; older gdown has no such option
+    options = {"timeout": LORA_TIMEOUT} if "timeout" in inspect.signature(gdown.download).parameters else {}
+    error = None
     
-    max_retries = 3
-    for attempt in range(max_retries):
+    for attempt in range(LORA_RETRIES):
         try:
-            # Try gdown download with fuzzy matching for large files
-            success = gdown.download(url, str(destination), quiet=False, fuzzy=True)
+            # Progress bars of parallel downloads would interleave, so gdown stays quiet
+            gdown.download(url, str(destination), quiet=True, **options)
             
             if destination.exists() and destination.stat().st_size > 1024:  # At least 1KB
-                size_mb = destination.stat().st_size / (1024 * 1024)
-                print_info(f"Downloaded successfully: {filename} ({size_mb:.1f} MB)")
-                return True
-            else:
-                print_error(f"Download failed or file too small: {filename}")
-                if destination.exists():
-                    destination.unlink()
+                # gdown owns the stream, so the hash is one read-back (still in page cache)
+                model_manifest.verify_file(MODELS_PATH, f"loras/{filename}", expected, {})
+                return None
+            error = "download failed or file too small"
                 
         except Exception as e:
-            print_error(f"Attempt {attempt + 1} failed for {filename}: {str(e)}")
-            if destination.exists():
-                destination.unlink()
+            error = str(e)
         
-        if attempt < max_retries - 1:
-            print_info("Retrying in 5 seconds...")
-            time.sleep(5)
+        if destination.exists():
+            destination.unlink()
+        if attempt < LORA_RETRIES - 1:
+            delay = backoff_delay(attempt)
+            print_warning(f"{filename}: attempt {attempt + 1} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
     
-    return False
+    return error
+
+def download_loras(manifest, record):
+    """Fetch missing LoRAs through a bounded pool; returns {filename: error} for failures"""
+    lora_path = MODELS_PATH / "loras"
+    pending = [
+        (filename, file_id) for filename, file_id in LORA_FILES.items()
+        if not verify_existing(f"loras/{filename}", manifest.get(f"loras/{filename}"), record)
+    ]
+    failed = {}
+    if not pending:
+        return failed
+    
+    print_info(f"Fetching {len(pending)} LoRA files over {LORA_CONNECTIONS} connections...")
+    start_time = time.time()
+    
+    def fetch(item):
+        filename, file_id = item
+        return filename, download_from_gdrive(file_id, lora_path / filename, filename, manifest.get(f"loras/{filename}"))
+    
+    with ThreadPoolExecutor(max_workers=max(1, LORA_CONNECTIONS), thread_name_prefix="lora") as pool:
+        futures = [pool.submit(fetch, item) for item in pending]
+        for finished, future in enumerate(as_completed(futures), 1):
+            filename, error = future.result()
+            if error:
+                failed[filename] = error
+                print_error(f"[{finished}/{len(pending)}] ❌ {filename}: {error}")
+            else:
+                size_mb = (lora_path / filename).stat().st_size / (1024 * 1024)
+                print_info(f"[{finished}/{len(pending)}] ✅ {filename} ({size_mb:.1f} MB)")
+    
+    print_info(f"LoRA phase took {time.time() - start_time:.1f}s")
+    return failed
+
+def effects_missing_lora(problems):
+    """Effects in effects.json whose LoRA file is missing or failed verification"""
+    try:
+        with open(EFFECTS_CONFIG, "r") as f:
+            effects = json.load(f)["effects"]
+    except (OSError, ValueError, KeyError) as e:
+        print_warning(f"Could not read {EFFECTS_CONFIG}: {e}")
+        return {}
+    return {
+        effect: config["lora"] for effect, config in sorted(effects.items())
+        if f"loras/{config['lora']}" in problems or not (MODELS_PATH / "loras" / config["lora"]).exists()
+    }
 
 def check_existing_models():
     """Check what models already exist (useful for hearmeman base image)"""
-    base_path = Path("/workspace/ComfyUI/models")
+    base_path = MODELS_PATH
     print_info("Checking existing models...")
     
     found_models = []
@@ -216,8 +482,67 @@ def check_existing_models():
     
     return found_models
 
+def verify_existing(name, expected, record):
+    """True if a file already on disk checks out (hashing it only if it changed since last run)"""
+    filepath = MODELS_PATH / name
+    if not filepath.exists():
+        return False
+    try:
+        how = model_manifest.verify_file(MODELS_PATH, name, expected, record)
+    except IntegrityError as e:
+        print_warning(f"Re-downloading {name} ({e})")
+        filepath.unlink()
+        return False
+    
+    existing_size = filepath.stat().st_size / (1024**3)
+    print_info(f"Skipping {name} (already exists, {existing_size:.2f}GB, {how})")
+    return True
+
+def update_manifest(from_hub=False):
+    """Pin the sizes and hashes of the verified files (or of the hub's base models) into the manifest"""
+    manifest = model_manifest.load_manifest()
+    if from_hub:
+        pins = {f"{category}/{filename}": hub_pin(info["url"])
+                for category, models in MODELS_CONFIG.items() for filename, info in models.items()}
+    else:
+        pins = model_manifest.load_record(MODELS_PATH)
+    pinned = 0
+    for name in manifest:
+        entry = pins.get(name)
+        if entry:
+            manifest[name] = {**manifest[name], "size": entry["size"], "sha256": entry["sha256"]}
+            pinned += 1
+    with open(model_manifest.MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    print_info(f"Pinned {pinned}/{len(manifest)} files in {model_manifest.MANIFEST_PATH}")
+
 def main():
-    """Main download function"""
+    """Main download function; returns the process exit code"""
+    parser = argparse.ArgumentParser(description="Download and verify AI-Avatarka models")
+    parser.add_argument("--verify-only", action="store_true", help="Check files against the manifest, download nothing")
+    parser.add_argument("--update-manifest", action="store_true",
+                        help="Write sizes and hashes of verified files into the manifest")
+    parser.add_argument("--pin-from-hub", action="store_true",
+                        help="Write the sizes and SHA-256 Hugging Face publishes for the base models into the manifest")
+    parser.add_argument("--allow-missing-loras", action="store_true",
+                        help="Exit 0 even if some effects lost their LoRA")
+    parser.add_argument("--skip-loras", action="store_true",
+                        help="Base models only; the worker fetches LoRAs on first use (see src/model_store.py)")
+    args = parser.parse_args()
+    
+    if args.update_manifest or args.pin_from_hub:
+        update_manifest(from_hub=args.pin_from_hub)
+        return 0
+    
+    manifest = model_manifest.load_manifest()
+    if args.verify_only:
+        problems = model_manifest.verify_models(MODELS_PATH, manifest)
+        for problem in problems.values():
+            print_error(f"❌ {problem}")
+        print_info(f"{len(manifest) - len(problems)}/{len(manifest)} files verified")
+        return EXIT_FAILED if problems else 0
+    
     print_info("AI-Avatarka Model Download Script - CORRECTED VERSION")
     print_info("===================================================")
     
@@ -227,30 +552,28 @@ def main():
         
         # Check existing models
         existing = check_existing_models()
+        record = model_manifest.load_record(MODELS_PATH)
         
         # Download base models from HuggingFace
         print_info("\n🔄 Phase 1: Downloading base models from HuggingFace...")
-        base_path = Path("/workspace/ComfyUI/models")
+        base_path = MODELS_PATH
         
         for category, models in MODELS_CONFIG.items():
             category_path = base_path / category
             for filename, model_info in models.items():
                 filepath = category_path / filename
+                name = f"{category}/{filename}"
                 
-                if filepath.exists():
-                    existing_size = filepath.stat().st_size / (1024**3)
-                    expected_size = model_info["size_gb"]
-                    
-                    # Check if size is reasonable (within 10% of expected)
-                    if abs(existing_size - expected_size) / expected_size < 0.1:
-                        print_info(f"Skipping {filename} (already exists, {existing_size:.2f}GB)")
-                        continue
-                    else:
-                        print_warning(f"Re-downloading {filename} (size mismatch)")
-                        filepath.unlink()
+                if verify_existing(name, manifest.get(name), record):
+                    continue
+                
+                expected = manifest.get(name) or {}
+                if not expected.get("sha256"):
+                    # Not pinned in the repo yet: check against what the hub publishes
+                    expected = {**expected, **(hub_pin(model_info["url"]) or {})}
                 
                 print_info(f"Downloading {filename} ({model_info['size_gb']}GB expected)...")
-                if download_with_progress(model_info["url"], filepath, model_info["size_gb"]):
+                if download_with_progress(model_info["url"], filepath, name, expected):
                     print_info(f"✅ {filename} downloaded successfully")
                 else:
                     print_error(f"❌ Failed to download {filename}")
@@ -258,63 +581,60 @@ def main():
                         print_error("This is a required model - build may fail")
         
         # Download LoRA files from Google Drive
-        print_info("\n🎭 Phase 2: Downloading LoRA files from Google Drive...")
-        lora_path = base_path / "loras"
-        success_count = 0
-        failed_count = 0
-        
-        for filename, file_id in LORA_FILES.items():
-            filepath = lora_path / filename
-            
-            if filepath.exists() and filepath.stat().st_size > 1024 * 1024:  # > 1MB
-                size_mb = filepath.stat().st_size / (1024 * 1024)
-                print_info(f"Skipping {filename} (already exists, {size_mb:.1f}MB)")
-                continue
+        if args.skip_loras:
+            print_info("\n🎭 Phase 2: Skipped - LoRAs are fetched by the worker on first use")
+            manifest = {name: entry for name, entry in manifest.items() if not name.startswith("loras/")}
+        else:
+            print_info("\n🎭 Phase 2: Downloading LoRA files from Google Drive...")
+            failed = download_loras(manifest, record)
             
-            if download_from_gdrive(file_id, filepath, filename):
-                success_count += 1
-            else:
-                failed_count += 1
+            print_info(f"\n🎉 Download Summary:")
+            print_info(f"LoRA files available: {len(LORA_FILES) - len(failed)}/{len(LORA_FILES)}")
+            print_info(f"LoRA files failed: {len(failed)}")
         
-        print_info(f"\n🎉 Download Summary:")
-        print_info(f"LoRA files successful: {success_count}/{len(LORA_FILES)}")
-        print_info(f"LoRA files failed: {failed_count}")
-        
-        # Final verification
+        # Final verification - everything was hashed above, so this only reads the record
         print_info("\n🔍 Phase 3: Final verification...")
+        problems = model_manifest.verify_models(MODELS_PATH, manifest)
         
         # Check required base models
         missing_required = []
         for category, models in MODELS_CONFIG.items():
-            category_path = base_path / category
             for filename, model_info in models.items():
-                if model_info["required"]:
-                    filepath = category_path / filename
-                    if not filepath.exists():
-                        missing_required.append(f"{category}/{filename}")
+                if model_info["required"] and f"{category}/{filename}" in problems:
+                    missing_required.append(problems[f"{category}/{filename}"])
         
         if missing_required:
-            print_error("Missing required base models:")
+            print_error("Missing or corrupt required base models:")
             for model in missing_required:
                 print_error(f"  ❌ {model}")
-            return False
+            return EXIT_FAILED
         else:
-            print_info("✅ All required base models present")
+            print_info("✅ All required base models present and verified")
+        
+        if args.skip_loras:
+            print_info("\n🎉 Download completed successfully!")
+            return 0
         
-        # Check LoRA files
-        lora_count = sum(1 for f in LORA_FILES.keys() if (lora_path / f).exists())
-        print_info(f"✅ {lora_count}/{len(LORA_FILES)} LoRA files present")
+        # Check LoRA files against the effects that use them
+        lora_count = sum(1 for f in LORA_FILES.keys() if f"loras/{f}" not in problems)
+        print_info(f"✅ {lora_count}/{len(LORA_FILES)} LoRA files present and verified")
+        broken_effects = effects_missing_lora(problems)
+        if broken_effects:
+            print_error(f"{len(broken_effects)} effects lost their LoRA:")
+            for effect, lora in broken_effects.items():
+                print_error(f"  ❌ {effect} ({lora})")
+            if not args.allow_missing_loras:
+                return EXIT_MISSING_LORAS
         
         print_info("\n🎉 Download completed successfully!")
-        return True
+        return 0
         
     except KeyboardInterrupt:
         print_error("Download interrupted by user")
-        return False
+        return EXIT_FAILED
     except Exception as e:
         print_error(f"Unexpected error: {e}")
-        return False
+        return EXIT_FAILED
 
 if __name__ == "__main__":
-    if not main():
-        sys.exit(1)
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+AI-Avatarka Text Embedding Precompute Script
+Encodes every stock effect prompt pair with T5 once and stores the embeddings as
+safetensors (via the AvatarkaSaveTextEmbeds node), so jobs using stock prompts
+never load or run the T5 encoder.
+
+Needs a running ComfyUI with the avatarka_text_embeds custom nodes (or --start).
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import subprocess
+import urllib.request
+from pathlib import Path
+
+SRC_PATH = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_PATH if SRC_PATH.exists() else "/workspace/src"))
+
+from workflow_template import load_compiled_workflow
+import text_embeds
+
+COMFYUI_PATH = os.environ.get("COMFYUI_PATH", "/workspace/ComfyUI")
+EFFECTS_CONFIG = os.environ.get("EFFECTS_CONFIG", "/workspace/prompts/effects.json")
+WORKFLOW_PATH = os.environ.get("WORKFLOW_PATH", f"{COMFYUI_PATH}/workflow/universal_i2v.json")
+
+def print_info(message):
+    """Print info message with timestamp"""
+    print(f"[INFO] {message}")
+
+def print_error(message):
+    """Print error message with timestamp"""
+    print(f"[ERROR] {message}")
+
+def api(server, path, payload=None):
+    """Small JSON helper for the ComfyUI API"""
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(f"http://{server}{path}", data=data,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return json.loads(response.read() or b"{}")
+
+def wait_for_server(server, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            api(server, "/system_stats")
+            return True
+        except Exception:
+            time.sleep(1)
+    return False
+
+def encode_graph(template, positive, negative, name):
+    """T5 loader -> WanVideoTextEncode -> AvatarkaSaveTextEmbeds, taken from the real workflow"""
+    encode_id = template.bindings["prompt"][0][0]
+    encode_node = template.nodes[encode_id]
+    graph = {}
+    for value in encode_node["inputs"].values():
+        if isinstance(value, list):
+            graph[value[0]] = template.nodes[value[0]]
+    graph[encode_id] = {
+        **encode_node,
+        "inputs": {**encode_node["inputs"], "positive_prompt": positive, "negative_prompt": negative}
+    }
+    graph["save"] = {
+        "class_type": text_embeds.SAVER_NODE,
+        "inputs": {"text_embeds": [encode_id, 0], "embeds_name": name}
+    }
+    return graph
+
+def run_prompt(server, graph, timeout=600):
+    prompt_id = api(server, "/prompt", {"prompt": graph, "client_id": str(uuid.uuid4())})["prompt_id"]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        entry = api(server, f"/history/{prompt_id}").get(prompt_id)
+        if entry:
+            status = entry.get("status", {})
+            if status.get("status_str") == "error":
+                print_error(f"Encode failed: {status.get('messages')}")
+                return False
+            if status.get("completed"):
+                return True
+        time.sleep(1)
+    print_error("Timed out waiting for encode")
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute T5 embeddings for stock effect prompts")
+    parser.add_argument("--server", default="127.0.0.1:8188")
+    parser.add_argument("--start", action="store_true", help="Launch ComfyUI for the duration of the run")
+    parser.add_argument("--force", action="store_true", help="Re-encode embeddings that already exist")
+    args = parser.parse_args()
+
+    with open(EFFECTS_CONFIG, "r") as f:
+        effects = json.load(f)["effects"]
+    template = load_compiled_workflow(WORKFLOW_PATH)
+    encoder = text_embeds.encoder_signature(template.nodes)
+    names = text_embeds.stock_names(effects, encoder)
+
+    todo = names if args.force else {
+        effect: name for effect, name in names.items()
+        if not (Path(text_embeds.TEXT_EMBEDS_DIR) / name).exists()
+    }
+    if not todo:
+        print_info(f"All {len(names)} stock prompt embeddings already present")
+        return True
+
+    process = None
+    if args.start:
+        print_info("Starting ComfyUI...")
+        process = subprocess.Popen([sys.executable, "main.py", "--listen", "127.0.0.1",
+                                    "--port", args.server.rsplit(":", 1)[1], "--disable-auto-launch"],
+                                   cwd=COMFYUI_PATH)
+    try:
+        if not wait_for_server(args.server):
+            print_error("ComfyUI did not become ready")
+            return False
+
+        failed = []
+        for effect, name in todo.items():
+            config = effects[effect]
+            print_info(f"Encoding {effect} -> {name}")
+            graph = encode_graph(template, config["prompt"], config["negative_prompt"], name)
+            if not run_prompt(args.server, graph):
+                failed.append(effect)
+
+        print_info(f"✅ Encoded {len(todo) - len(failed)}/{len(todo)} stock prompts")
+        if failed:
+            print_error(f"Failed effects: {', '.join(failed)}")
+        return not failed
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=60)
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
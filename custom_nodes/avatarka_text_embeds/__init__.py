@@ -0,0 +1,103 @@
+"""
+AI-Avatarka text embedding cache nodes for ComfyUI
+Saves WanVideoTextEncode output to safetensors and loads it back, so stock effect
+prompts never need the T5 encoder at runtime.
+"""
+
+import os
+import json
+import time
+import torch
+import folder_paths
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+EMBEDS_DIR = os.environ.get("TEXT_EMBEDS_DIR", os.path.join(folder_paths.models_dir, "text_embeds"))
+
+def flatten_embeds(embeds):
+    """Split a text_embeds dict into tensors plus a JSON layout for everything else"""
+    tensors = {}
+    layout = {}
+    for key, value in embeds.items():
+        if torch.is_tensor(value):
+            tensors[key] = value.detach().to("cpu").contiguous()
+            layout[key] = ["tensor"]
+        elif isinstance(value, (list, tuple)) and value and all(torch.is_tensor(v) for v in value):
+            for index, tensor in enumerate(value):
+                tensors[f"{key}.{index}"] = tensor.detach().to("cpu").contiguous()
+            layout[key] = ["list", len(value)]
+        else:
+            try:
+                json.dumps(value)
+                layout[key] = ["value", value]
+            except TypeError:
+                print(f"[avatarka_text_embeds] Skipping non-serializable entry: {key}")
+    return tensors, {"layout": json.dumps(layout)}
+
+def unflatten_embeds(tensors, metadata):
+    layout = json.loads(metadata["layout"])
+    embeds = {}
+    for key, spec in layout.items():
+        if spec[0] == "tensor":
+            embeds[key] = tensors[key]
+        elif spec[0] == "list":
+            embeds[key] = [tensors[f"{key}.{index}"] for index in range(spec[1])]
+        else:
+            embeds[key] = spec[1]
+    return embeds
+
+class AvatarkaSaveTextEmbeds:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {
+            "text_embeds": ("WANVIDEOTEXTEMBEDS",),
+            "embeds_name": ("STRING", {"default": ""}),
+        }}
+
+    RETURN_TYPES = ()
+    FUNCTION = "save"
+    OUTPUT_NODE = True
+    CATEGORY = "AI-Avatarka"
+
+    def save(self, text_embeds, embeds_name):
+        os.makedirs(EMBEDS_DIR, exist_ok=True)
+        path = os.path.join(EMBEDS_DIR, os.path.basename(embeds_name))
+        tensors, metadata = flatten_embeds(text_embeds)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        save_file(tensors, temp_path, metadata=metadata)
+        os.replace(temp_path, path)
+        return {}
+
+class AvatarkaLoadTextEmbeds:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {
+            "embeds_name": ("STRING", {"default": ""}),
+        }}
+
+    RETURN_TYPES = ("WANVIDEOTEXTEMBEDS",)
+    RETURN_NAMES = ("text_embeds",)
+    FUNCTION = "load"
+    CATEGORY = "AI-Avatarka"
+
+    def load(self, embeds_name):
+        path = os.path.join(EMBEDS_DIR, os.path.basename(embeds_name))
+        tensors = {}
+        with safe_open(path, framework="pt", device="cpu") as f:
+            metadata = f.metadata()
+            for key in f.keys():
+                tensors[key] = f.get_tensor(key)
+        # Access time drives the worker's LRU eviction of custom-prompt entries
+        now = time.time()
+        os.utime(path, (now, now))
+        return (unflatten_embeds(tensors, metadata),)
+
+NODE_CLASS_MAPPINGS = {
+    "AvatarkaSaveTextEmbeds": AvatarkaSaveTextEmbeds,
+    "AvatarkaLoadTextEmbeds": AvatarkaLoadTextEmbeds,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "AvatarkaSaveTextEmbeds": "Save Text Embeds (AI-Avatarka)",
+    "AvatarkaLoadTextEmbeds": "Load Text Embeds (AI-Avatarka)",
+}
@@ -0,0 +1,164 @@
+"""
+Shared HTTP client for handler <-> ComfyUI traffic
+One keep-alive session with bounded pooling, per-endpoint timeouts and jittered retries.
+"""
+
+import os
+import random
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+COMFYUI_SERVER = os.environ.get("COMFYUI_SERVER", "127.0.0.1:8188")
+BASE_URL = f"http://{COMFYUI_SERVER}"
+
+POOL_MAXSIZE = int(os.environ.get("COMFYUI_POOL_MAXSIZE", "8"))
+
+# (connect, read) timeouts per endpoint - first path segment, "/" for the root
+ENDPOINT_TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    "/": (2, 5),
+    "system_stats": (2, 5),
+    "prompt": (5, 30),
+    "history": (5, 10),
+    "queue": (5, 10),
+    "interrupt": (5, 10),
+    "upload": (5, 60),
+}
+DEFAULT_TIMEOUT = (5, 30)
+
+# Retry policy for transient failures (connection errors, 502/503/504)
+MAX_RETRIES = int(os.environ.get("COMFYUI_MAX_RETRIES", "3"))
+RETRY_BACKOFF = 0.25
+RETRY_BACKOFF_MAX = 4.0
+RETRY_STATUSES = {502, 503, 504}
+
+# Endpoints that must not be replayed after the request may have reached ComfyUI
+NON_IDEMPOTENT = {"prompt", "upload"}
+
+class AlreadyApplied(requests.exceptions.ConnectionError):
+    """The response was lost, but the request's applied() check found it took effect"""
+
+# Called as hook(method, endpoint, status_code or None, elapsed_seconds) after every request
+latency_hooks: List[Callable[[str, str, Optional[int], float], None]] = []
+
+_session = None
+_session_lock = threading.Lock()
+
+def endpoint_of(path: str) -> str:
+    """Map a request path to its endpoint key"""
+    segment = path.lstrip("/").split("/", 1)[0].split("?", 1)[0]
+    return segment or "/"
+
+def get_session() -> requests.Session:
+    """Return the process-wide keep-alive session"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are handled here (with jitter), not by urllib3
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE,
+                                      max_retries=0, pool_block=True)
+                session.mount("http://", adapter)
+                session.headers.update({"User-Agent": "AI-Avatarka-Worker/1.0"})
+                _session = session
+    return _session
+
+def close_session():
+    """Close pooled connections (e.g. on worker shutdown)"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * (2 ** attempt)))
+
+def _observe(method: str, endpoint: str, status: Optional[int], elapsed: float):
+    logger.debug(f"ComfyUI {method} {endpoint} -> {status} in {elapsed * 1000:.1f}ms")
+    for hook in latency_hooks:
+        try:
+            hook(method, endpoint, status, elapsed)
+        except Exception:
+            pass
+
+def never_sent(error: requests.exceptions.RequestException) -> bool:
+    """Whether a failure happened while connecting, before any byte of the request went out"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+def request(method: str, path: str, retries: Optional[int] = None,
+            applied: Optional[Callable[[], bool]] = None, **kwargs) -> requests.Response:
+    """Send a request to ComfyUI through the shared session, retrying transient errors.
+    
+    Non-idempotent endpoints are replayed after connect failures only. After a lost
+    response they are replayed once applied() confirms ComfyUI never took the request
+    (AlreadyApplied is raised if it did); without applied() the error is raised.
+    """
+    endpoint = endpoint_of(path)
+    kwargs.setdefault("timeout", ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT))
+    if retries is None:
+        retries = MAX_RETRIES
+    replay_safe = endpoint not in NON_IDEMPOTENT
+    session = get_session()
+
+    attempt = 0
+    while True:
+        start = time.monotonic()
+        try:
+            response = session.request(method, f"{BASE_URL}{path}", **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            # Connect failures never reached ComfyUI; a dropped connection (RemoteDisconnected,
+            # "Connection aborted") may have come after the body was accepted
+            _observe(method, endpoint, None, time.monotonic() - start)
+            if attempt >= retries:
+                raise
+            if not replay_safe and not never_sent(e) and not _confirmed_not_applied(method, path, applied, e):
+                raise
+        except requests.exceptions.Timeout:
+            # A read timeout on a non-idempotent call may have been processed - surface it instead
+            _observe(method, endpoint, None, time.monotonic() - start)
+            if attempt >= retries or not replay_safe:
+                raise
+        else:
+            _observe(method, endpoint, response.status_code, time.monotonic() - start)
+            if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                return response
+
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
+
+def _confirmed_not_applied(method: str, path: str, applied: Optional[Callable[[], bool]],
+                           error: Exception) -> bool:
+    """Ask applied() whether a request whose response was lost took effect"""
+    if applied is None:
+        return False
+    try:
+        took_effect = applied()
+    except Exception as e:
+        logger.warning(f"⚠️ Could not check whether {method} {path} reached ComfyUI: {str(e)}")
+        return False
+    if took_effect:
+        raise AlreadyApplied(f"{method} {path} lost its response but was applied") from error
+    logger.warning(f"⚠️ {method} {path} lost its response and was not applied, resending")
+    return True
+
+def get(path: str, **kwargs) -> requests.Response:
+    return request("GET", path, **kwargs)
+
+def post(path: str, **kwargs) -> requests.Response:
+    return request("POST", path, **kwargs)
+
+def ws_url(client_id: str) -> str:
+    """Websocket URL for job events"""
+    return f"ws://{COMFYUI_SERVER}/ws?clientId={client_id}"
@@ -0,0 +1,192 @@
+"""
+Disk lifecycle for job files
+Every job gets its own output subfolder (ComfyUI writes the MP4 and the VHS first-frame
+PNG there) and a scratch directory, on tmpfs when available. Both are reference counted,
+so coalesced jobs can share them, and are removed when the last job using them ends, on
+every exit path. Leftovers in the output directory (warm-up, crashed runs) are kept under
+OUTPUT_QUOTA_BYTES by oldest-first eviction.
+"""
+
+import os
+import re
+import time
+import uuid
+import shutil
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from image_input import SCRATCH_DIR
+
+logger = logging.getLogger(__name__)
+
+COMFYUI_PATH = os.environ.get("COMFYUI_PATH", "/workspace/ComfyUI")
+OUTPUT_DIR = f"{COMFYUI_PATH}/output"
+JOB_OUTPUT_SUBDIR = "jobs"
+OUTPUT_PREFIX = "ai-avatarka"
+
+# Per-job scratch root; tmpfs (/dev/shm) unless JOB_SCRATCH_DIR says otherwise
+SCRATCH_ROOT = os.environ.get("JOB_SCRATCH_DIR", os.path.join(SCRATCH_DIR or "/tmp", "avatarka-jobs"))
+
+# Budget for files left in the output dir outside active job folders
+OUTPUT_QUOTA_BYTES = int(os.environ.get("OUTPUT_QUOTA_BYTES", str(2 * 1024 ** 3)))
+SWEEP_INTERVAL = float(os.environ.get("DISK_SWEEP_INTERVAL", "60"))
+
+_lock = threading.Lock()
+_refs: Dict[Path, int] = {}
+_last_sweep = 0.0
+
+def acquire(path: Path, count: int = 1):
+    """Add references to a job directory"""
+    with _lock:
+        _refs[path] = _refs.get(path, 0) + count
+
+def release(path: Path):
+    """Drop one reference; the directory is deleted with the last one"""
+    with _lock:
+        count = _refs.get(path, 0) - 1
+        if count > 0:
+            _refs[path] = count
+            return
+        _refs.pop(path, None)
+    remove_tree(path)
+
+def remove_tree(path: Path) -> int:
+    """Delete a directory tree, returning the bytes freed"""
+    freed = directory_bytes(path)
+    shutil.rmtree(path, ignore_errors=True)
+    if freed:
+        metrics.incr("disk_freed_bytes", freed)
+    return freed
+
+class JobFiles:
+    """A job's output subfolder and scratch directory, released by close()"""
+
+    def __init__(self, job_id: Optional[str] = None):
+        safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", job_id or "job")[:48]
+        self.key = f"{safe_id}-{uuid.uuid4().hex[:8]}"
+        self.output_dir = Path(OUTPUT_DIR) / JOB_OUTPUT_SUBDIR / self.key
+        self._scratch: Optional[Path] = None
+        self._held: List[Path] = [self.output_dir]
+        acquire(self.output_dir)
+
+    @property
+    def output_prefix(self) -> str:
+        """VHS_VideoCombine filename_prefix that writes into this job's folder"""
+        return f"{JOB_OUTPUT_SUBDIR}/{self.key}/{OUTPUT_PREFIX}"
+
+    @property
+    def scratch_dir(self) -> str:
+        if self._scratch is None:
+            self._scratch = Path(SCRATCH_ROOT) / self.key
+            # Referenced before it exists so a concurrent sweep never sees it as orphaned
+            acquire(self._scratch)
+            self._held.append(self._scratch)
+            self._scratch.mkdir(parents=True, exist_ok=True)
+        return str(self._scratch)
+
+    def share(self, followers: int):
+        """Keep the output folder alive for coalesced jobs that deliver the same video"""
+        if followers:
+            acquire(self.output_dir, followers)
+
+    def inherit(self, output_dir: Path):
+        """Adopt a reference taken on this job's behalf by the job it followed"""
+        self._held.append(output_dir)
+
+    def close(self):
+        held, self._held = self._held, []
+        for path in held:
+            release(path)
+        sweep()
+
+def _unlink(path: Path) -> bool:
+    path.unlink(missing_ok=True)
+    return True
+
+def evict_lru(paths: Iterable[Path], max_bytes: int, remove: Callable[[Path], bool] = _unlink,
+              label: Optional[str] = None) -> List[Tuple[Path, int]]:
+    """Delete least recently used files (by mtime) until the rest fit in max_bytes.
+
+    remove(path) deletes one file (and anything that belongs to it) and returns False
+    to keep it instead; evictions are logged as "label" when given. Returns (path, size)
+    of every evicted file.
+    """
+    entries = []
+    total = 0
+    for path in paths:
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    evicted = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if not remove(path):
+            continue
+        total -= size
+        evicted.append((path, size))
+        if label:
+            logger.info(f"🧹 Evicted {label} {path.name} ({size / (1024 * 1024):.1f}MB)")
+    return evicted
+
+def directory_bytes(path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def sweep(force: bool = False):
+    """Evict oldest unowned output files above the quota and publish disk gauges"""
+    global _last_sweep
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_sweep < SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+        active = set(_refs)
+
+    def unowned_files():
+        for root, dirs, files in os.walk(OUTPUT_DIR):
+            root_path = Path(root)
+            if root_path in active:
+                dirs[:] = []
+                continue
+            for name in files:
+                yield root_path / name
+
+    def remove_unowned(path: Path) -> bool:
+        # Re-checked under the lock: the job folder may have been created after the snapshot
+        with _lock:
+            if any(parent in _refs for parent in path.parents):
+                return False
+            path.unlink(missing_ok=True)
+        return True
+
+    evicted = evict_lru(unowned_files(), OUTPUT_QUOTA_BYTES, remove_unowned)
+    if evicted:
+        metrics.incr("disk_evicted_files", len(evicted))
+        metrics.incr("disk_freed_bytes", sum(size for _, size in evicted))
+        logger.info(f"🧹 Evicted {len(evicted)} old output files (output dir over quota)")
+
+    # Job folders whose owners are gone (e.g. after a crash) are always removed; checked
+    # and removed under the lock, so a job cannot take a reference in between
+    for parent in (Path(OUTPUT_DIR) / JOB_OUTPUT_SUBDIR, Path(SCRATCH_ROOT)):
+        if parent.is_dir():
+            for job_dir in parent.iterdir():
+                with _lock:
+                    if job_dir not in _refs:
+                        remove_tree(job_dir)
+
+    metrics.set_gauge("output_dir_bytes", directory_bytes(OUTPUT_DIR))
+    metrics.set_gauge("scratch_dir_bytes", directory_bytes(SCRATCH_ROOT))
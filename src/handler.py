@@ -4,34 +4,100 @@ Transforms images into videos using Wan 2.1 with different effects.
 """
 
 import runpod
+import asyncio
 import json
 import os
 import sys
 import subprocess
-import base64
-import io
 import time
 import uuid
+import random
+import hashlib
+import queue
 import logging
-import requests
+import threading
+import websocket
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 from PIL import Image
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, Optional, Tuple
+
+import comfy_client
+import disk
+import metrics
+import model_manifest
+import model_store
+import prefetch
+import profiles
+import progress
+import readiness
+import result_cache
+import scheduler
+import singleflight
+import text_embeds
+from image_fetch import FetchError, fetch_image
+from image_input import (COMFYUI_INPUT_DIR, DEFAULT_TARGET_WIDTH, ImageRejected, IngestedImage, ingest_image,
+                         ingest_image_file, input_cache_stats, release_image)
+from video_output import MAX_RESPONSE_BYTES, deliver_video, encode_file_base64
+from workflow_template import (
+    CompiledWorkflow, load_compiled_workflow, build_effect_variants,
+    with_cached_text_embeds, with_text_embeds_saver
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Constants
-COMFYUI_PATH = "/workspace/ComfyUI"
-COMFYUI_SERVER = "127.0.0.1:8188"
-EFFECTS_CONFIG = "/workspace/prompts/effects.json"
-WORKFLOW_PATH = "/workspace/ComfyUI/workflow/universal_i2v.json"
+COMFYUI_PATH = os.environ.get("COMFYUI_PATH", "/workspace/ComfyUI")
+EFFECTS_CONFIG = os.environ.get("EFFECTS_CONFIG", "/workspace/prompts/effects.json")
+WORKFLOW_PATH = os.environ.get("WORKFLOW_PATH", f"{COMFYUI_PATH}/workflow/universal_i2v.json")
+COMFYUI_START_TIMEOUT = float(os.environ.get("COMFYUI_START_TIMEOUT", "180"))
+BOOT_WAIT_TIMEOUT = float(os.environ.get("BOOT_WAIT_TIMEOUT", "900"))
+
+# Warm-up prompt run at boot so the Wan model, T5, CLIP vision and VAE are resident
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "1") == "1"
+WARMUP_EFFECT = os.environ.get("WARMUP_EFFECT", "ghostrider")
+WARMUP_STEPS = int(os.environ.get("WARMUP_STEPS", "1"))
+WARMUP_FRAMES = int(os.environ.get("WARMUP_FRAMES", "5"))
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "600"))
+
+# Boot-time model integrity check: "fast" trusts the verified record (else size only),
+# "full" rehashes files the record does not cover, "off" skips the check
+MODEL_VERIFY = os.environ.get("MODEL_VERIFY", "fast")
+
+# Multi-effect jobs: effects x seeds combinations allowed in one job
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", "8"))
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", "600"))
 
-# Global state
+# Jobs in flight per worker (RunPod concurrency modifier); >1 overlaps one job's image
+# ingest and video encode with another job's sampling
+MAX_CONCURRENCY = max(1, int(os.environ.get("MAX_CONCURRENCY", "1")))
+
+# Identical in-flight requests share one ComfyUI prompt. Random-seed (-1) requests ask for
+# a fresh video each, so they are only coalesced with COALESCE_RANDOM_SEEDS=1
+COALESCE_REQUESTS = os.environ.get("COALESCE_REQUESTS", "1") == "1"
+COALESCE_RANDOM_SEEDS = os.environ.get("COALESCE_RANDOM_SEEDS", "0") == "1"
+
+# Streaming: serve stream_handler (progress events) instead of handler
+STREAM_PROGRESS = os.environ.get("STREAM_PROGRESS", "0") == "1"
+# ComfyUI latent preview method for streamed previews (none, latent2rgb, taesd, auto)
+COMFYUI_PREVIEW_METHOD = os.environ.get("COMFYUI_PREVIEW_METHOD", "none")
+
+# Worker-wide state - written during boot only, read-only while jobs run
 comfyui_process = None
 comfyui_initialized = False
 effects_data = None
+workflow_template: Optional[CompiledWorkflow] = None
+effect_workflows: Dict[str, CompiledWorkflow] = {}
+# Hash of the compiled workflow; part of every result cache key
+workflow_signature: Optional[str] = None
+
+# Cached T5 embeddings: loader variants (no T5) and encode+save variants per effect
+text_embeds_encoder: Optional[str] = None
+embed_workflows: Dict[str, CompiledWorkflow] = {}
+encode_save_workflows: Dict[str, CompiledWorkflow] = {}
 
 def load_effects_config():
     """Load effects configuration"""
@@ -45,165 +111,396 @@ def load_effects_config():
         logger.error(f"❌ Failed to load effects config: {str(e)}")
         return False
 
-def start_comfyui():
-    """Start ComfyUI server"""
-    global comfyui_process, comfyui_initialized
+def launch_comfyui() -> bool:
+    """Spawn the ComfyUI server process (does not wait for it)"""
+    global comfyui_process
     
-    if comfyui_initialized:
+    if comfyui_process is not None and comfyui_process.poll() is None:
         return True
     
     try:
         logger.info("🚀 Starting ComfyUI server...")
-        
-        # Change to ComfyUI directory
-        os.chdir(COMFYUI_PATH)
-        
-        # Start server process
-        comfyui_process = subprocess.Popen([
+        command = [
             sys.executable, "main.py",
             "--listen", "127.0.0.1",
             "--port", "8188",
             "--disable-auto-launch",
             "--disable-metadata"
-        ], cwd=COMFYUI_PATH)
-        
-        # Wait for server to be ready
-        for i in range(120):  # Wait up to 2 minutes
-            try:
-                response = requests.get(f"http://{COMFYUI_SERVER}/", timeout=5)
-                if response.status_code == 200:
-                    comfyui_initialized = True
-                    logger.info("✅ ComfyUI server started successfully")
-                    return True
-            except:
-                time.sleep(1)
-        
-        logger.error("❌ Failed to start ComfyUI server - timeout")
-        return False
+        ]
+        # Inputs may live on tmpfs instead of the container disk
+        if Path(COMFYUI_INPUT_DIR) != Path(COMFYUI_PATH) / "input":
+            Path(COMFYUI_INPUT_DIR).mkdir(parents=True, exist_ok=True)
+            command += ["--input-directory", COMFYUI_INPUT_DIR]
+        if COMFYUI_PREVIEW_METHOD != "none":
+            command += ["--preview-method", COMFYUI_PREVIEW_METHOD]
+        comfyui_process = subprocess.Popen(command, cwd=COMFYUI_PATH)
+        return True
         
     except Exception as e:
         logger.error(f"❌ Error starting ComfyUI server: {str(e)}")
         return False
 
-def load_workflow():
-    """Load universal workflow template"""
+def comfyui_responding() -> bool:
+    """Single readiness probe against /system_stats"""
     try:
-        with open(WORKFLOW_PATH, "r") as f:
-            workflow = json.load(f)
-        logger.info("✅ Universal workflow loaded")
-        return workflow
+        return comfy_client.get("/system_stats", retries=0).status_code == 200
+    except Exception:
+        return False
+
+def wait_for_comfyui(timeout: float = COMFYUI_START_TIMEOUT) -> bool:
+    """Probe /system_stats with fast exponential backoff until ComfyUI answers"""
+    global comfyui_initialized
+    
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    
+    while time.monotonic() < deadline:
+        if comfyui_process is not None and comfyui_process.poll() is not None:
+            logger.error(f"❌ ComfyUI exited during startup (code {comfyui_process.returncode})")
+            return False
+        if comfyui_responding():
+            comfyui_initialized = True
+            logger.info("✅ ComfyUI server started successfully")
+            return True
+        time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        delay = min(delay * 2, 1.0)
+    
+    logger.error("❌ Failed to start ComfyUI server - timeout")
+    return False
+
+def verify_models() -> bool:
+    """Check model files against the manifest; only base model problems fail the boot"""
+    if MODEL_VERIFY == "off":
+        return True
+    problems = model_manifest.verify_models(Path(COMFYUI_PATH) / "models", rehash=MODEL_VERIFY == "full")
+    for name, problem in problems.items():
+        if name.startswith("loras/") and model_store.has_remote_tiers():
+            logger.warning(f"⚠️ Model check: {problem} - will be fetched on first use")
+        else:
+            logger.error(f"❌ Model check: {problem}")
+    base_problems = [name for name in problems if not name.startswith("loras/")]
+    if not problems:
+        logger.info("✅ Model files verified")
+    return not base_problems
+
+def start_comfyui() -> bool:
+    """Start ComfyUI server and wait until it accepts requests"""
+    global comfyui_initialized
+    if comfyui_initialized:
+        return True
+    
+    # An already running server (externally managed, or a dev stand-in) is reused
+    if comfyui_responding():
+        comfyui_initialized = True
+        logger.info("✅ ComfyUI server already running")
+        return True
+    
+    return launch_comfyui() and wait_for_comfyui()
+
+def compile_workflow_template() -> bool:
+    """Parse and index the universal workflow (independent of effects config)"""
+    global workflow_template, workflow_signature
+    if workflow_template is not None:
+        return True
+    try:
+        workflow_template = load_compiled_workflow(WORKFLOW_PATH)
+        workflow_signature = result_cache.fingerprint(workflow_template.nodes)
+        logger.info("✅ Universal workflow compiled")
+        return True
     except Exception as e:
         logger.error(f"❌ Failed to load workflow: {str(e)}")
-        return None
+        return False
 
-def process_input_image(image_data: str) -> Optional[str]:
-    """Process and save input image"""
+def load_workflow() -> bool:
+    """Compile universal workflow template and pre-build per-effect variants (once)"""
+    global effect_workflows
+    if effect_workflows:
+        return True
+    if not compile_workflow_template():
+        return False
     try:
-        # Handle data URL format
-        if image_data.startswith("data:image"):
-            image_data = image_data.split(",")[1]
-        
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
+        effect_workflows = build_effect_variants(workflow_template, effects_data["effects"])
+        return True
+    except Exception as e:
+        logger.error(f"❌ Failed to build effect workflows: {str(e)}")
+        return False
+
+def setup_text_embeds() -> bool:
+    """Enable cached T5 embeddings if ComfyUI has the Avatarka embeds nodes"""
+    global text_embeds_encoder, embed_workflows, encode_save_workflows
+    if not text_embeds.TEXT_EMBEDS_ENABLED:
+        return False
+    if not text_embeds.nodes_available():
+        logger.warning("⚠️ Text embeds nodes not installed - prompts will be encoded with T5 every job")
+        return False
+    
+    encoder = text_embeds.encoder_signature(workflow_template.nodes)
+    stock = text_embeds.stock_names(effects_data["effects"], encoder)
+    text_embeds.pin(stock.values())
+    missing = text_embeds.missing(stock.values())
+    if missing:
+        logger.warning(f"⚠️ {len(missing)}/{len(stock)} stock prompt embeddings missing - they will be saved on first use")
+    
+    embed_workflows = build_effect_variants(
+        with_cached_text_embeds(workflow_template, text_embeds.LOADER_NODE), effects_data["effects"])
+    encode_save_workflows = build_effect_variants(
+        with_text_embeds_saver(workflow_template, text_embeds.SAVER_NODE), effects_data["effects"])
+    text_embeds_encoder = encoder
+    logger.info(f"✅ Cached text embeddings enabled ({len(stock) - len(missing)}/{len(stock)} stock prompts ready)")
+    return True
+
+def run_warmup() -> bool:
+    """Run a tiny prompt so model weights are loaded before the first real job"""
+    try:
+        input_dir = Path(COMFYUI_INPUT_DIR)
+        input_dir.mkdir(parents=True, exist_ok=True)
+        image_filename = "avatarka_warmup.jpg"
+        Image.new("RGB", (512, 512), (128, 128, 128)).save(input_dir / image_filename, "JPEG")
         
-        # Convert to RGB if necessary
-        if image.mode != "RGB":
-            image = image.convert("RGB")
+        if fetch_loras({lora_file(WARMUP_EFFECT)}):
+            return False
+        workflow = customize_workflow({
+            "image_filename": image_filename,
+            "effect": WARMUP_EFFECT,
+            "steps": WARMUP_STEPS,
+            "frames": WARMUP_FRAMES,
+            "seed": 0
+        })
+        if not workflow:
+            return False
         
-        # Save to ComfyUI input directory
-        input_dir = Path(COMFYUI_PATH) / "input"
-        input_dir.mkdir(exist_ok=True)
+        client_id = str(uuid.uuid4())
+        ws = connect_event_socket(client_id)
+        prompt_id = submit_workflow(workflow, client_id)
+        if not prompt_id:
+            if ws:
+                ws.close()
+            return False
         
-        filename = f"{uuid.uuid4()}.jpg"
-        image_path = input_dir / filename
+        video_path = wait_for_completion(prompt_id, ws, timeout=WARMUP_TIMEOUT)
+        if video_path:
+            Path(video_path).unlink(missing_ok=True)
+            scheduler.set_applied(lora_key(WARMUP_EFFECT))
+        return video_path is not None
         
-        image.save(image_path, "JPEG", quality=95)
-        logger.info(f"✅ Input image saved: {filename}")
+    except Exception as e:
+        logger.error(f"❌ Warm-up failed: {str(e)}")
+        return False
+
+def boot() -> bool:
+    """Cold start: launch ComfyUI, load effects and compile workflow in parallel, then warm up"""
+    if not readiness.begin_boot():
+        return readiness.wait(BOOT_WAIT_TIMEOUT)
+    
+    logger.info("🚀 Booting AI-Avatarka worker...")
+    comfy_client.latency_hooks.append(metrics.observe_http)
+    metrics.start_reporter()
+    
+    def timed(name, fn):
+        with readiness.phase(name):
+            return fn()
+    
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix="boot") as pool:
+        comfyui_ready = pool.submit(timed, "comfyui_start", start_comfyui)
+        effects_loaded = pool.submit(timed, "effects_config", load_effects_config)
+        template_compiled = pool.submit(timed, "workflow_compile", compile_workflow_template)
+        models_verified = pool.submit(timed, "model_check", verify_models)
         
-        return filename
+        if not effects_loaded.result() or not template_compiled.result() or not load_workflow():
+            readiness.set_state(readiness.FAILED, "Failed to load effects or workflow")
+            return False
+        # Pull model weights into the page cache while ComfyUI is still starting
+        prefetch.start(Path(COMFYUI_PATH) / "models", workflow_template.nodes, effects_data["effects"],
+                       first_effects=[WARMUP_EFFECT] * WARMUP_ENABLED + prefetch.POPULAR_EFFECTS)
+        if not models_verified.result():
+            readiness.set_state(readiness.FAILED, "Model files missing or corrupt")
+            return False
+        if not comfyui_ready.result():
+            readiness.set_state(readiness.FAILED, "Failed to start ComfyUI")
+            return False
+    
+    with readiness.phase("text_embeds"):
+        setup_text_embeds()
+    
+    if WARMUP_ENABLED:
+        readiness.set_state(readiness.WARMING)
+        logger.info("🔥 Running warm-up prompt...")
+        with readiness.phase("warmup"):
+            warmed = run_warmup()
+        # A failed warm-up only means the first job pays model loading itself
+        if warmed:
+            logger.info("✅ Warm-up complete - models resident")
+        else:
+            logger.warning("⚠️ Warm-up failed, continuing without it")
+    
+    # Reclaim outputs left by earlier runs of this container
+    disk.sweep(force=True)
+    
+    readiness.set_state(readiness.READY)
+    logger.info(f"✅ Worker ready: {readiness.snapshot()}")
+    return True
+
+def ensure_ready() -> bool:
+    """Wait for the boot started by start.py, or boot inline if nobody did"""
+    if readiness.is_ready():
+        return True
+    if not readiness.boot_started():
+        return boot()
+    return readiness.wait(BOOT_WAIT_TIMEOUT)
+
+def process_input_image(image_data: str, target_width: int = DEFAULT_TARGET_WIDTH,
+                        scratch_dir: Optional[str] = None) -> Optional[IngestedImage]:
+    """Process and save input image"""
+    try:
+        image = ingest_image(image_data, target_width, scratch_dir)
+        metrics.incr("input_cache_hits" if image.reused else "input_cache_misses")
+        logger.info(f"✅ Input image {'reused' if image.reused else 'saved'}: {image.filename}")
+        return image
         
+    except ImageRejected as e:
+        logger.error(f"❌ Input image rejected: {str(e)}")
+        return None
     except Exception as e:
         logger.error(f"❌ Failed to process input image: {str(e)}")
         return None
 
-def customize_workflow(workflow: Dict, params: Dict) -> Dict:
-    """Customize workflow with user parameters"""
+def process_input_image_url(image_url: str, target_width: int = DEFAULT_TARGET_WIDTH,
+                            scratch_dir: Optional[str] = None) -> Optional[IngestedImage]:
+    """Fetch (or reuse cached) image from a URL and save it for ComfyUI"""
+    try:
+        image_path = fetch_image(image_url)
+        image = ingest_image_file(str(image_path), target_width, scratch_dir)
+        metrics.incr("input_cache_hits" if image.reused else "input_cache_misses")
+        logger.info(f"✅ Input image {'reused' if image.reused else 'saved'}: {image.filename}")
+        return image
+        
+    except (FetchError, ImageRejected) as e:
+        logger.error(f"❌ Input image rejected: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"❌ Failed to process input image URL: {str(e)}")
+        return None
+
+def lora_file(effect: str) -> str:
+    if effect not in effect_workflows:
+        effect = "ghostrider"
+    return effects_data["effects"][effect]["lora"]
+
+def job_loras(job_input: Dict) -> set:
+    """LoRA files a job's effect(s) apply"""
+    if "effects" in job_input:
+        effects = [effect for effect, _ in expand_batch(job_input) or []
+                   if isinstance(effect, str) and effect in effect_workflows]
+    else:
+        effects = [job_input.get("effect", "ghostrider")]
+    return {lora_file(effect) for effect in effects}
+
+def fetch_loras(filenames) -> Optional[str]:
+    """Make LoRA files available to ComfyUI (fetching missing ones); returns an error message"""
+    for filename in sorted(filenames):
+        try:
+            model_store.ensure_lora(filename)
+        except model_store.StoreError as e:
+            logger.error(f"❌ {str(e)}")
+            return f"LoRA unavailable: {str(e)}"
+    return None
+
+def lora_key(effect: str) -> str:
+    """Identity of the LoRA patch an effect applies to the Wan model"""
+    if effect not in effect_workflows:
+        effect = "ghostrider"
+    effect_config = effects_data["effects"][effect]
+    return f"{effect_config['lora']}@{effect_config.get('lora_strength', 1.0)}"
+
+def customize_workflow(params: Dict) -> Optional[Dict]:
+    """Instantiate the pre-built effect workflow with user parameters"""
     try:
         effect = params.get("effect", "ghostrider")
-        effect_config = effects_data["effects"].get(effect, effects_data["effects"]["ghostrider"])
+        if effect not in effect_workflows:
+            effect = "ghostrider"
+        effect_config = effects_data["effects"][effect]
+        variant = effect_workflows[effect]
         
-        # Work with API format: {node_id: {inputs: {}, class_type: ""}}
-        for node_id, node_data in workflow.items():
-            if not isinstance(node_data, dict):
-                continue
-                
-            class_type = node_data.get("class_type", "")
-            inputs = node_data.get("inputs", {})
-            
-            # Update LoadImage node (Node 18) - replace PLACEHOLDER_IMAGE
-            if class_type == "LoadImage":
-                if inputs.get("image") == "PLACEHOLDER_IMAGE":
-                    inputs["image"] = params["image_filename"]
-                    logger.info(f"✅ Updated LoadImage with: {params['image_filename']}")
-            
-            # Update WanVideoTextEncode (Node 16) - replace prompts
-            elif class_type == "WanVideoTextEncode":
-                if inputs.get("positive_prompt") == "PLACEHOLDER_PROMPT":
-                    inputs["positive_prompt"] = params.get("prompt", effect_config["prompt"])
-                    logger.info(f"✅ Updated positive prompt for effect: {effect}")
-                
-                if inputs.get("negative_prompt") == "PLACEHOLDER_NEGATIVE_PROMPT":
-                    inputs["negative_prompt"] = params.get("negative_prompt", effect_config["negative_prompt"])
-                    logger.info(f"✅ Updated negative prompt for effect: {effect}")
-            
-            # Update WanVideoLoraSelect (Node 41) - replace PLACEHOLDER_LORA
-            elif class_type == "WanVideoLoraSelect":
-                if inputs.get("lora_name") == "PLACEHOLDER_LORA":
-                    inputs["lora_name"] = effect_config["lora"]
-                    inputs["strength"] = effect_config.get("lora_strength", 1.0)
-                    logger.info(f"✅ Updated LoRA: {effect_config['lora']} (strength: {inputs['strength']})")
-            
-            # Update WanVideoSampler (Node 27) - handle seed properly
-            elif class_type == "WanVideoSampler":
-                # Handle seed - use random if -1
-                seed_value = params.get("seed", -1)
-                if seed_value == -1:
-                    seed_value = int(time.time() * 1000) % (2**31)  # Generate random seed
-                inputs["seed"] = seed_value
-                logger.info(f"✅ Updated seed: {seed_value}")
-                
-                # Update other sampler parameters if provided
-                if "steps" in params and params["steps"] != 10:
-                    inputs["steps"] = params["steps"]
-                    
-                if "cfg" in params and params["cfg"] != 6:
-                    inputs["cfg"] = params["cfg"]
-                    
-                if "frames" in params and params["frames"] != 85:
-                    inputs["frames"] = params["frames"]
+        values = {"image": params["image_filename"]}
+        
+        # Stock prompts are already baked into the variant
+        positive = params.get("prompt") or effect_config["prompt"]
+        negative = params.get("negative_prompt") or effect_config["negative_prompt"]
+        if params.get("prompt"):
+            values["prompt"] = positive
+        if params.get("negative_prompt"):
+            values["negative_prompt"] = negative
+        
+        # Load cached T5 embeddings when present, otherwise encode and save them
+        if text_embeds_encoder is not None:
+            embeds_name = text_embeds.embeds_name(positive, negative, text_embeds_encoder)
+            if text_embeds.lookup(embeds_name):
+                metrics.incr("text_embeds_hits")
+                variant = embed_workflows[effect]
+                values = {"image": values["image"], "text_embeds": embeds_name}
+                logger.info(f"✅ Using cached text embeddings: {embeds_name}")
+            else:
+                metrics.incr("text_embeds_misses")
+                variant = encode_save_workflows[effect]
+                values["text_embeds_save"] = embeds_name
+                text_embeds.evict()
+        
+        # Handle seed - use random if -1
+        seed_value = params.get("seed", -1)
+        if seed_value == -1:
+            seed_value = random.randrange(2**31)  # Generate random seed (unique across concurrent jobs)
+        values["seed"] = seed_value
         
-        logger.info(f"✅ Workflow customized for effect: {effect}")
+        for key in (*profiles.SETTING_KEYS, "output_prefix"):
+            if params.get(key) is not None:
+                values[key] = params[key]
+        
+        workflow = variant.instantiate(values)
+        logger.info(f"✅ Workflow customized for effect: {effect} (seed: {seed_value})")
         return workflow
         
     except Exception as e:
         logger.error(f"❌ Error customizing workflow: {str(e)}")
-        return workflow
+        return None
+
+def connect_event_socket(client_id: str) -> Optional[websocket.WebSocket]:
+    """Open ComfyUI websocket for job events (must happen before submit)"""
+    try:
+        ws = websocket.create_connection(comfy_client.ws_url(client_id), timeout=10)
+        logger.info(f"✅ Event socket connected: {client_id}")
+        return ws
+    except Exception as e:
+        logger.warning(f"⚠️ Event socket unavailable, falling back to polling: {str(e)}")
+        return None
+
+def prompt_known(prompt_id: str) -> bool:
+    """Whether ComfyUI has queued, is running or has run prompt_id"""
+    response = comfy_client.get("/queue")
+    response.raise_for_status()
+    queue = response.json()
+    for item in queue.get("queue_running", []) + queue.get("queue_pending", []):
+        if len(item) > 1 and item[1] == prompt_id:
+            return True
+    response = comfy_client.get(f"/history/{prompt_id}")
+    response.raise_for_status()
+    return prompt_id in response.json()
 
-def submit_workflow(workflow: Dict) -> Optional[str]:
+def submit_workflow(workflow: Dict, client_id: Optional[str] = None) -> Optional[str]:
     """Submit workflow to ComfyUI"""
+    # Chosen here so a submission whose response is lost can be looked up before resending
+    prompt_id = str(uuid.uuid4())
     try:
-        client_id = str(uuid.uuid4())
         prompt_data = {
             "prompt": workflow,
-            "client_id": client_id
+            "client_id": client_id or str(uuid.uuid4()),
+            "prompt_id": prompt_id
         }
         
-        response = requests.post(
-            f"http://{COMFYUI_SERVER}/prompt",
-            json=prompt_data,
-            timeout=30
-        )
+        try:
+            response = comfy_client.post("/prompt", json=prompt_data, applied=lambda: prompt_known(prompt_id))
+        except comfy_client.AlreadyApplied:
+            logger.warning(f"⚠️ Lost the /prompt response, but ComfyUI queued {prompt_id}")
+            return prompt_id
         
         if response.status_code == 200:
             result = response.json()
@@ -219,63 +516,191 @@ def submit_workflow(workflow: Dict) -> Optional[str]:
         logger.error(f"❌ Error submitting workflow: {str(e)}")
         return None
 
-def wait_for_completion(prompt_id: str, timeout: int = 600) -> Optional[str]:
-    """Wait for workflow completion"""
+def find_video_output(outputs: Dict) -> Optional[str]:
+    """Resolve the video file from node outputs (history or executed events)"""
+    # VHS_VideoCombine (Node 30) reports its file under "gifs", core nodes under "videos"
+    for node_id, output in outputs.items():
+        videos = output.get("videos") or output.get("gifs") or []
+        if videos:
+            video_info = videos[0]
+            filename = video_info.get("filename")
+            subfolder = video_info.get("subfolder", "")
+            
+            # Construct full path
+            output_dir = Path(COMFYUI_PATH) / "output"
+            if subfolder:
+                output_dir = output_dir / subfolder
+            
+            video_path = output_dir / filename
+            if video_path.exists():
+                logger.info(f"✅ Video generated: {filename}")
+                return str(video_path)
+    return None
+
+def fetch_history(prompt_id: str) -> Optional[Dict]:
+    """Fetch a single prompt's history entry"""
     try:
-        start_time = time.time()
+        response = comfy_client.get(f"/history/{prompt_id}")
+        if response.status_code == 200:
+            return response.json().get(prompt_id)
+    except Exception as e:
+        logger.warning(f"⚠️ History fetch failed for {prompt_id}: {str(e)}")
+    return None
+
+def new_prompt_status() -> Dict:
+    return {"outputs": {}, "video_path": None, "error": None,
+            "submitted": time.monotonic(), "started": None, "finished": None, "done": False}
+
+def finish_prompt(prompt_id: str, status: Dict, error: Optional[str] = None):
+    """Mark a prompt done and resolve its video file"""
+    status["done"] = True
+    status["finished"] = time.monotonic()
+    if error:
+        status["error"] = error
+        logger.error(f"❌ {error} ({prompt_id})")
+        return
+    
+    video_path = find_video_output(status["outputs"])
+    if not video_path:
+        # Outputs may be cached (no executed event) - one history fetch resolves them
+        entry = fetch_history(prompt_id)
+        video_path = find_video_output(entry.get("outputs", {})) if entry else None
+    if video_path:
+        status["video_path"] = video_path
+    else:
+        status["error"] = "Workflow finished without video output"
+        logger.error(f"❌ Workflow finished without video output: {prompt_id}")
+
+def poll_prompts(statuses: Dict[str, Dict], timeout: float):
+    """Fallback: poll /history until every prompt finishes"""
+    deadline = time.monotonic() + timeout
+    
+    while time.monotonic() < deadline:
+        for prompt_id, status in statuses.items():
+            if status["done"]:
+                continue
+            entry = fetch_history(prompt_id)
+            if not entry:
+                continue
+            
+            status["outputs"] = entry.get("outputs", {})
+            history_status = entry.get("status", {})
+            if history_status.get("status_str") == "error":
+                finish_prompt(prompt_id, status, f"Workflow execution failed: {history_status.get('messages', [])}")
+            elif history_status.get("completed") or find_video_output(status["outputs"]):
+                finish_prompt(prompt_id, status)
         
-        while time.time() - start_time < timeout:
-            response = requests.get(f"http://{COMFYUI_SERVER}/history/{prompt_id}", timeout=10)
+        if all(status["done"] for status in statuses.values()):
+            return
+        time.sleep(3)
+    
+    for prompt_id, status in statuses.items():
+        if not status["done"]:
+            finish_prompt(prompt_id, status, "Timeout waiting for completion")
+
+def track_prompts(prompt_ids, ws: Optional[websocket.WebSocket] = None,
+                  timeout: float = 600, on_event: Optional[Callable] = None) -> Dict[str, Dict]:
+    """Follow one or more queued prompts on a single event socket (polling if no socket).
+    
+    on_event(prompt_id, event_type, data) sees the prompts' websocket events; binary
+    preview frames are passed as event type "preview" for the running prompt.
+    """
+    statuses = {prompt_id: new_prompt_status() for prompt_id in prompt_ids}
+    running = None
+    if ws is None:
+        poll_prompts(statuses, timeout)
+        return statuses
+    
+    deadline = time.monotonic() + timeout
+    
+    try:
+        while not all(status["done"] for status in statuses.values()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise websocket.WebSocketTimeoutException()
             
-            if response.status_code == 200:
-                history = response.json()
-                
-                if prompt_id in history:
-                    outputs = history[prompt_id].get("outputs", {})
-                    
-                    # Look for video output from VHS_VideoCombine node (Node 30)
-                    for node_id, output in outputs.items():
-                        if "videos" in output:
-                            videos = output["videos"]
-                            if videos:
-                                video_info = videos[0]
-                                filename = video_info.get("filename")
-                                subfolder = video_info.get("subfolder", "")
-                                
-                                # Construct full path
-                                output_dir = Path(COMFYUI_PATH) / "output"
-                                if subfolder:
-                                    output_dir = output_dir / subfolder
-                                
-                                video_path = output_dir / filename
-                                if video_path.exists():
-                                    logger.info(f"✅ Video generated: {filename}")
-                                    return str(video_path)
-                    
-                    # Check if execution failed
-                    status = history[prompt_id].get("status", {})
-                    if status.get("status_str") == "error":
-                        error_messages = status.get("messages", [])
-                        logger.error(f"❌ Workflow execution failed: {error_messages}")
-                        return None
+            ws.settimeout(remaining)
+            message = ws.recv()
             
-            time.sleep(3)
-        
-        logger.error(f"❌ Timeout waiting for completion: {prompt_id}")
-        return None
+            # Binary frames are latent previews of the running prompt
+            if not isinstance(message, str):
+                if on_event and running:
+                    on_event(running, "preview", message)
+                continue
+            
+            event = json.loads(message)
+            event_type = event.get("type")
+            data = event.get("data", {})
+            
+            status = statuses.get(data.get("prompt_id"))
+            if status is None or status["done"]:
+                continue
+            prompt_id = data["prompt_id"]
+            if on_event:
+                on_event(prompt_id, event_type, data)
+            
+            if event_type == "execution_start":
+                status["started"] = time.monotonic()
+                running = prompt_id
+            
+            elif event_type == "executed":
+                status["outputs"][data.get("node")] = data.get("output") or {}
+            
+            elif event_type == "execution_error":
+                finish_prompt(prompt_id, status,
+                              f"Workflow execution failed at node {data.get('node_id')} "
+                              f"({data.get('node_type')}): {data.get('exception_message')}")
+            
+            elif event_type == "execution_interrupted":
+                finish_prompt(prompt_id, status, "Workflow execution interrupted")
+            
+            elif event_type == "execution_success" or (
+                    event_type == "executing" and data.get("node") is None):
+                finish_prompt(prompt_id, status)
         
+    except websocket.WebSocketTimeoutException:
+        for prompt_id, status in statuses.items():
+            if not status["done"]:
+                finish_prompt(prompt_id, status, "Timeout waiting for completion")
     except Exception as e:
-        logger.error(f"❌ Error waiting for completion: {str(e)}")
-        return None
+        logger.warning(f"⚠️ Event socket lost ({str(e)}), falling back to polling")
+        pending = {prompt_id: status for prompt_id, status in statuses.items() if not status["done"]}
+        poll_prompts(pending, max(deadline - time.monotonic(), 0))
+    finally:
+        try:
+            ws.close()
+        except Exception:
+            pass
+    
+    return statuses
+
+def wait_for_completion(prompt_id: str, ws: Optional[websocket.WebSocket] = None,
+                        timeout: int = 600) -> Optional[str]:
+    """Wait for workflow completion via websocket events, polling if no socket"""
+    return track_prompts([prompt_id], ws, timeout)[prompt_id]["video_path"]
+
+def prompt_timings(status: Dict) -> Dict[str, Optional[float]]:
+    """Queue wait and execution seconds for a tracked prompt (also fed to the histograms)"""
+    started = status["started"] or status["submitted"]
+    finished = status["finished"] or time.monotonic()
+    metrics.observe("queue_wait", started - status["submitted"])
+    metrics.observe("execution", finished - started)
+    return {
+        "queue_wait": round(started - status["submitted"], 3),
+        "execution": round(finished - started, 3)
+    }
+
+def record_lora(effect: str, execution_seconds: float) -> bool:
+    """Scheduler accounting for an executed prompt; True if the LoRA was swapped"""
+    swapped = scheduler.record(lora_key(effect), execution_seconds)
+    metrics.incr("lora_swaps" if swapped else "lora_hits")
+    return swapped
 
 def encode_video_to_base64(video_path: str) -> Optional[str]:
-    """Convert video file to base64"""
+    """Convert video file to base64 (streamed, capped at MAX_RESPONSE_BYTES)"""
     try:
-        with open(video_path, "rb") as f:
-            video_bytes = f.read()
-        
-        video_base64 = base64.b64encode(video_bytes).decode("utf-8")
-        video_size_mb = len(video_bytes) / (1024 * 1024)
+        video_base64 = encode_file_base64(video_path)
+        video_size_mb = os.path.getsize(video_path) / (1024 * 1024)
         logger.info(f"✅ Video encoded to base64 ({video_size_mb:.2f}MB)")
         return video_base64
         
@@ -283,101 +708,537 @@ def encode_video_to_base64(video_path: str) -> Optional[str]:
         logger.error(f"❌ Failed to encode video: {str(e)}")
         return None
 
-def handler(job):
-    """Main handler function - entry point for RunPod jobs"""
+def cleanup_input_image(image_filename: str):
+    """Release the job's reference on its input image (kept a while for resubmissions)"""
     try:
-        logger.info("🎬 Starting AI-Avatarka job processing")
-        
-        # Get job input
-        job_input = job.get("input", {})
-        
-        # Validate required inputs
-        if not job_input.get("image"):
-            return {"error": "No image provided"}
-        
-        # Initialize ComfyUI if needed
-        if not comfyui_initialized:
-            if not start_comfyui():
-                return {"error": "Failed to start ComfyUI"}
-        
-        # Load effects config if needed
-        if effects_data is None:
-            if not load_effects_config():
-                return {"error": "Failed to load effects configuration"}
-        
-        # Process input image
-        image_filename = process_input_image(job_input["image"])
-        if not image_filename:
-            return {"error": "Failed to process input image"}
+        release_image(image_filename)
+    except Exception:
+        pass
+
+@dataclass
+class JobContext:
+    """Per-job state, passed explicitly so concurrent jobs never share any of it"""
+    job: Dict
+    reporter: progress.ProgressReporter = field(default_factory=progress.ProgressReporter)
+    timings: Dict[str, float] = field(default_factory=dict)
+    image_filename: Optional[str] = None
+    image_size: Optional[Tuple[int, int]] = None
+    cache_key: Optional[str] = None
+    flight: Optional[Tuple[str, singleflight.Flight]] = None
+    files: Optional[disk.JobFiles] = None
+    
+    @property
+    def input(self) -> Dict:
+        return self.job.get("input", {})
+
+def expand_batch(job_input: Dict) -> Optional[list]:
+    """(effect, seed) pairs for a multi-effect job: every effect with every seed"""
+    effects = job_input.get("effects") or []
+    seeds = job_input.get("seeds") or [job_input.get("seed", -1)]
+    if not isinstance(effects, list) or not isinstance(seeds, list):
+        return None
+    return [(effect, seed) for effect in effects for seed in seeds]
+
+def handle_batch(ctx: JobContext) -> Dict:
+    """Several effects on one portrait, queued back-to-back on one event socket.
+    
+    Every prompt shares identical LoadImage / ImageResize+ / WanVideoImageClipEncode
+    and loader nodes, so ComfyUI's execution cache computes the image embedding once
+    and only the LoRA, text encode and sampling branch runs per effect.
+    """
+    job_input = ctx.input
+    reporter = ctx.reporter
+    items = expand_batch(job_input)
+    if not items:
+        return {"error": "effects must be a non-empty list"}
+    if len(items) > MAX_BATCH_ITEMS:
+        return {"error": f"Too many effect/seed combinations ({len(items)} > {MAX_BATCH_ITEMS})"}
+    unknown = sorted({effect for effect, _ in items if effect not in effect_workflows})
+    if unknown:
+        return {"error": f"Unknown effects: {', '.join(unknown)}"}
+    
+    # Consecutive prompts with the same effect also keep the patched model resident;
+    # the LoRA already applied goes first
+    applied = scheduler.current()
+    items.sort(key=lambda item: (lora_key(item[0]) != applied, item[0]))
+    
+    with scheduler.slot(lora_key(items[0][0])):
+        client_id = str(uuid.uuid4())
+        ws = connect_event_socket(client_id)
+        submitted = []
+        for effect, seed in items:
+            with metrics.timed(ctx.timings, "workflow"):
+                workflow = customize_workflow({
+                    **job_params(job_input, ctx.image_filename, ctx.image_size),
+                    "effect": effect,
+                    # Custom positive prompts are effect-specific, so batches use stock prompts
+                    "prompt": None,
+                    "seed": seed,
+                    "output_prefix": ctx.files.output_prefix
+                })
+            with metrics.timed(ctx.timings, "submit"):
+                prompt_id = submit_workflow(workflow, client_id) if workflow else None
+            submitted.append((effect, seed, prompt_id))
+            if prompt_id:
+                reporter.label(prompt_id, effect=effect, seed=seed)
+                reporter.emit("queued", **reporter.labels[prompt_id])
         
-        # Load workflow
-        workflow = load_workflow()
+        prompt_ids = [prompt_id for _, _, prompt_id in submitted if prompt_id]
+        on_event = reporter.on_event if reporter.active else None
+        statuses = track_prompts(prompt_ids, ws, JOB_TIMEOUT * len(prompt_ids), on_event) if prompt_ids else {}
+        if not prompt_ids and ws:
+            ws.close()
+    
+    results = []
+    response_budget = MAX_RESPONSE_BYTES
+    for effect, seed, prompt_id in submitted:
+        result = {"effect": effect, "seed": seed, "prompt_id": prompt_id}
+        status = statuses.get(prompt_id)
+        if status is None:
+            result["error"] = "Failed to submit workflow"
+        elif status["error"] or not status["video_path"]:
+            result["error"] = status["error"] or "Video generation failed or timed out"
+            result["timings"] = prompt_timings(status)
+        else:
+            item_timings = prompt_timings(status)
+            result["lora_swap"] = record_lora(effect, item_timings["execution"])
+            reporter.emit("encoding", **reporter.labels[prompt_id])
+            with metrics.timed(item_timings, "encode"):
+                delivery = deliver_video(status["video_path"], ctx.job.get("id"), max(response_budget, 0))
+            response_budget -= len(delivery.get("video", ""))
+            result.update(delivery)
+            result["filename"] = Path(status["video_path"]).name
+            result["timings"] = item_timings
+        results.append(result)
+    
+    succeeded = sum(1 for result in results if "error" not in result)
+    logger.info(f"✅ Batch finished: {succeeded}/{len(results)} effects succeeded")
+    response = {
+        "results": results,
+        "input_cache": input_cache_stats(),
+        "worker": readiness.snapshot()
+    }
+    if not succeeded:
+        response["error"] = "All effects in the batch failed"
+    return response
+
+def job_params(job_input: Dict, image_filename: Optional[str],
+               image_size: Optional[Tuple[int, int]] = None) -> Dict:
+    """Single-effect parameters: render profile settings plus the job's own values.
+    
+    With the ingested image size, width/height become its aspect-ratio bucket.
+    """
+    settings = profiles.resolve(effects_data["default_settings"], job_input)
+    settings["width"], settings["height"] = profiles.generation_size(settings, job_input, image_size)
+    return {
+        "image_filename": image_filename,
+        "effect": job_input.get("effect", "ghostrider"),
+        "prompt": job_input.get("prompt"),
+        "negative_prompt": job_input.get("negative_prompt"),
+        **settings,
+        "seed": job_input.get("seed", -1)
+    }
+
+def image_digest(job_input: Dict) -> Optional[str]:
+    """Hash of the raw input image bytes (base64 payload or fetched URL content)"""
+    if job_input.get("image"):
+        payload = job_input["image"]
+        if payload.startswith("data:"):
+            payload = payload.split(",", 1)[-1]
+        return hashlib.sha256(payload.strip().encode()).hexdigest()
+    try:
+        digest = hashlib.sha256()
+        with open(fetch_image(job_input["image_url"]), "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    except Exception:
+        return None
+
+def request_fingerprint(job_input: Dict) -> Optional[str]:
+    """Canonical hash of everything that determines a single-effect output (None for batches)"""
+    if "effects" in job_input:
+        return None
+    params = job_params(job_input, None)
+    digest = image_digest(job_input)
+    if digest is None:
+        return None
+    
+    effect = params["effect"] if params["effect"] in effect_workflows else "ghostrider"
+    effect_config = effects_data["effects"][effect]
+    params.update(
+        image_filename=digest,
+        effect=effect,
+        prompt=params["prompt"] or effect_config["prompt"],
+        negative_prompt=params["negative_prompt"] or effect_config["negative_prompt"],
+        lora=effect_config["lora"],
+        lora_strength=effect_config.get("lora_strength", 1.0),
+        # The bucket itself follows from the image, which the digest already covers
+        aspect_bucket=profiles.bucketed(job_input),
+        workflow=workflow_signature
+    )
+    return result_cache.fingerprint(params)
+
+def serve_cached(ctx: JobContext, video_path: Path) -> Dict:
+    """Response for a result cache hit - no ComfyUI involved"""
+    effect = ctx.input.get("effect", "ghostrider")
+    logger.info(f"✅ Result served from cache: {video_path.name}")
+    with metrics.timed(ctx.timings, "encode"):
+        delivery = deliver_video(str(video_path), ctx.job.get("id"))
+    if "error" in delivery:
+        return delivery
+    return {
+        **delivery,
+        "effect": effect,
+        "filename": video_path.name,
+        "cached": True,
+        "worker": readiness.snapshot()
+    }
+
+def follow_flight(ctx: JobContext, flight: singleflight.Flight) -> Dict:
+    """Wait for the identical in-flight job's prompt and deliver its video"""
+    logger.info("🔗 Identical request already in flight - waiting for its result")
+    metrics.incr("coalesced")
+    ctx.reporter.emit("coalesced")
+    with metrics.timed(ctx.timings, "coalesced_wait"):
+        outcome = flight.wait(2 * JOB_TIMEOUT)
+    if outcome is None:
+        return {"error": "Timed out waiting for identical in-flight request"}
+    if "error" in outcome:
+        return {"error": outcome["error"], "coalesced": True}
+    ctx.files.inherit(Path(outcome["video_path"]).parent)
+    
+    ctx.reporter.emit("encoding", prompt_id=outcome["prompt_id"])
+    with metrics.timed(ctx.timings, "encode"):
+        delivery = deliver_video(outcome["video_path"], ctx.job.get("id"))
+    if "error" in delivery:
+        return {**delivery, "prompt_id": outcome["prompt_id"]}
+    return {
+        **delivery,
+        "effect": outcome["effect"],
+        "prompt_id": outcome["prompt_id"],
+        "filename": Path(outcome["video_path"]).name,
+        "cached": False,
+        "coalesced": True,
+        "worker": readiness.snapshot()
+    }
+
+def run_job(ctx: JobContext) -> Dict:
+    """Generate the requested effect(s) for an already ingested input image"""
+    job_input = ctx.input
+    reporter = ctx.reporter
+    timings = ctx.timings
+    
+    # Multi-effect job sharing one image encode
+    if "effects" in job_input:
+        return handle_batch(ctx)
+    
+    # Prepare parameters; outputs land in the job's own folder
+    params = job_params(job_input, ctx.image_filename, ctx.image_size)
+    params["output_prefix"] = ctx.files.output_prefix
+    
+    logger.info(f"🎭 Processing effect: {params['effect']}")
+    
+    # Queue behind other jobs, preferring ones that reuse the applied LoRA
+    with scheduler.slot(lora_key(params["effect"])):
+        # Customize workflow
+        with metrics.timed(timings, "workflow"):
+            workflow = customize_workflow(params)
         if not workflow:
-            return {"error": "Failed to load workflow"}
-        
-        # Prepare parameters
-        params = {
-            "image_filename": image_filename,
-            "effect": job_input.get("effect", "ghostrider"),
-            "prompt": job_input.get("prompt"),
-            "negative_prompt": job_input.get("negative_prompt"),
-            "steps": job_input.get("steps", 10),
-            "cfg": job_input.get("cfg", 6),
-            "frames": job_input.get("frames", 85),
-            "fps": job_input.get("fps", 16),
-            "width": job_input.get("width", 720),
-            "height": job_input.get("height", 720),
-            "seed": job_input.get("seed", -1)
-        }
+            return {"error": "Failed to build workflow"}
         
-        logger.info(f"🎭 Processing effect: {params['effect']}")
-        
-        # Customize workflow
-        workflow = customize_workflow(workflow, params)
+        # Subscribe to job events before submitting so none are missed
+        client_id = str(uuid.uuid4())
+        ws = connect_event_socket(client_id)
         
         # Submit workflow
-        prompt_id = submit_workflow(workflow)
+        with metrics.timed(timings, "submit"):
+            prompt_id = submit_workflow(workflow, client_id)
         if not prompt_id:
+            if ws:
+                ws.close()
             return {"error": "Failed to submit workflow"}
+        reporter.label(prompt_id, effect=params["effect"])
+        reporter.emit("queued", **reporter.labels[prompt_id])
         
         # Wait for completion
-        video_path = wait_for_completion(prompt_id)
+        on_event = reporter.on_event if reporter.active else None
+        status = track_prompts([prompt_id], ws, JOB_TIMEOUT, on_event)[prompt_id]
+        video_path = status["video_path"]
         if not video_path:
             return {"error": "Video generation failed or timed out"}
+        timings.update(prompt_timings(status))
+        lora_swap = record_lora(params["effect"], timings["execution"])
+    
+    if ctx.flight:
+        # Followers deliver from this job's output folder, so they hold it open too
+        singleflight.finish(*ctx.flight, {"video_path": video_path, "prompt_id": prompt_id, "effect": params["effect"]},
+                            on_publish=ctx.files.share)
+    if ctx.cache_key:
+        result_cache.store(ctx.cache_key, video_path, {"effect": params["effect"], "prompt_id": prompt_id})
+    
+    # Encode video to base64 (or upload / structured error when oversized)
+    reporter.emit("encoding", **reporter.labels[prompt_id])
+    with metrics.timed(timings, "encode"):
+        delivery = deliver_video(video_path, ctx.job.get("id"))
+    
+    if "error" in delivery:
+        return {**delivery, "prompt_id": prompt_id}
+    
+    # Return success response
+    return {
+        **delivery,
+        "effect": params["effect"],
+        "profile": params["profile"],
+        "resolution": f"{params['width']}x{params['height']}",
+        "prompt_id": prompt_id,
+        "filename": Path(video_path).name,
+        "lora_swap": lora_swap,
+        "cached": False,
+        "coalesced": False,
+        "input_cache": input_cache_stats(),
+        "worker": readiness.snapshot()
+    }
+
+def execute_job(ctx: JobContext) -> Dict:
+    """Validate, ingest and run one job"""
+    job_input = ctx.input
+    
+    # Validate required inputs
+    if not job_input.get("image") and not job_input.get("image_url"):
+        return {"error": "No image provided"}
+    
+    # Boot normally happened in start.py before jobs were accepted
+    if not ensure_ready():
+        return {"error": "Worker failed to start", "worker": readiness.snapshot()}
+    
+    # Reject settings the model cannot render before doing any work
+    try:
+        settings = profiles.resolve(effects_data["default_settings"], job_input)
+    except profiles.InvalidSettings as e:
+        return {"error": str(e)}
+    # Inputs are kept at least as wide as any generation size, so one ingest serves every
+    # profile and aspect bucket without upscaling
+    target_width = max(DEFAULT_TARGET_WIDTH, profiles.max_bucket_width(settings["width"], settings["height"]))
+    
+    # Identical reproducible requests are answered from the result cache
+    reproducible = job_input.get("seed", -1) not in (-1, None)
+    with metrics.timed(ctx.timings, "cache_lookup"):
+        fingerprint = None
+        if result_cache.RESULT_CACHE_ENABLED or COALESCE_REQUESTS:
+            fingerprint = request_fingerprint(job_input)
+        if fingerprint and reproducible and result_cache.RESULT_CACHE_ENABLED:
+            ctx.cache_key = fingerprint
+        cached = result_cache.lookup(ctx.cache_key) if ctx.cache_key else None
+    if ctx.cache_key:
+        metrics.incr("result_cache_hits" if cached else "result_cache_misses")
+    if cached:
+        return serve_cached(ctx, cached)
+    
+    # An identical request already generating on this worker shares its prompt
+    if fingerprint and COALESCE_REQUESTS and (reproducible or COALESCE_RANDOM_SEEDS):
+        flight, leader = singleflight.begin(fingerprint)
+        if not leader:
+            return follow_flight(ctx, flight)
+        ctx.flight = (fingerprint, flight)
+    
+    response = {"error": "Processing failed"}
+    try:
+        # Process input image
+        with metrics.timed(ctx.timings, "image"):
+            if job_input.get("image"):
+                image = process_input_image(job_input["image"], target_width, ctx.files.scratch_dir)
+            else:
+                image = process_input_image_url(job_input["image_url"], target_width, ctx.files.scratch_dir)
+        if not image:
+            response = {"error": "Failed to process input image"}
+            return response
+        ctx.image_filename, ctx.image_size = image.filename, image.size
         
-        # Encode video to base64
-        video_base64 = encode_video_to_base64(video_path)
-        if not video_base64:
-            return {"error": "Failed to encode output video"}
+        # Missing LoRAs are fetched before queueing for the GPU, so a download never holds
+        # a slot; they stay out of store eviction until the job's prompts are done
+        loras = job_loras(job_input)
+        with model_store.pinned(loras):
+            with metrics.timed(ctx.timings, "lora_fetch"):
+                error = fetch_loras(loras)
+            if error:
+                response = {"error": error}
+                return response
+            response = run_job(ctx)
+        return response
+    finally:
+        # Followers get the failure if the job ended without publishing a video
+        if ctx.flight:
+            singleflight.finish(*ctx.flight, {"error": response.get("error", "Processing failed")})
+        # Every exit path drops the job's reference on the input image
+        if ctx.image_filename:
+            cleanup_input_image(ctx.image_filename)
+
+def process_job(job: Dict, reporter: Optional[progress.ProgressReporter] = None) -> Dict:
+    """Run one job and attach its stage timings; progress goes to the reporter when streaming"""
+    job_start = time.monotonic()
+    ctx = JobContext(job, reporter or progress.ProgressReporter())
+    try:
+        logger.info("🎬 Starting AI-Avatarka job processing")
         
-        # Clean up input image
-        try:
-            input_path = Path(COMFYUI_PATH) / "input" / image_filename
-            if input_path.exists():
-                input_path.unlink()
-                logger.info("✅ Cleaned up input image")
-        except:
-            pass
+        # Get job input
+        job_input = job.get("input", {})
         
-        # Return success response
-        return {
-            "video": video_base64,
-            "effect": params["effect"],
-            "prompt_id": prompt_id,
-            "filename": Path(video_path).name,
-            "processing_time": time.time()
-        }
+        # Health probe - report readiness and metrics without running a job
+        if job_input.get("health_check"):
+            if job_input.get("metrics") == "prometheus":
+                return {"prometheus": metrics.render_prometheus()}
+            return {"worker": readiness.snapshot(), "scheduler": scheduler.snapshot(),
+                    "coalescing": singleflight.snapshot(), "metrics": metrics.snapshot()}
+        
+        ctx.files = disk.JobFiles(job.get("id"))
+        response = execute_job(ctx)
         
     except Exception as e:
         logger.error(f"❌ Handler error: {str(e)}")
-        return {"error": f"Processing failed: {str(e)}"}
+        response = {"error": f"Processing failed: {str(e)}"}
+    finally:
+        # Every exit path removes the job's output folder and scratch files
+        if ctx.files:
+            ctx.files.close()
+    
+    total = time.monotonic() - job_start
+    metrics.observe("total", total)
+    metrics.incr("jobs")
+    if "error" in response:
+        metrics.incr("failures")
+    metrics.sample_rss()
+    
+    ctx.timings["total"] = round(total, 3)
+    response["timings"] = ctx.timings
+    response["processing_time"] = ctx.timings["total"]
+    return response
+
+def handler(job):
+    """Main handler function - entry point for RunPod jobs"""
+    return process_job(job)
+
+# Published after a streamed job's last progress event
+STREAM_FINISHED = object()
+
+def start_streamed_job(job, publish: Callable) -> Tuple[progress.ProgressReporter, threading.Thread, Dict]:
+    """Run a job on its own thread; publish(event) gets its progress events, then STREAM_FINISHED"""
+    job_input = job.get("input", {})
+    reporter = progress.ProgressReporter(
+        publish,
+        node_classes={node_id: node["class_type"] for node_id, node in workflow_template.nodes.items()}
+        if workflow_template else {},
+        previews=bool(job_input.get("previews"))
+    )
+    outcome = {}
+    
+    def run():
+        try:
+            outcome["result"] = process_job(job, reporter)
+        finally:
+            publish(STREAM_FINISHED)
+    
+    worker = threading.Thread(target=run, name="avatarka-job", daemon=True)
+    worker.start()
+    return reporter, worker, outcome
+
+def cancel_streamed_job(reporter: progress.ProgressReporter, worker: threading.Thread):
+    """Client went away - stop the GPU work instead of finishing an unwanted video"""
+    if worker.is_alive():
+        logger.warning("⚠️ Stream closed early, cancelling the job's prompts")
+        cancel_prompts(list(reporter.labels))
+
+def final_stream_event(reporter: progress.ProgressReporter, outcome: Dict) -> Dict:
+    result = outcome.get("result") or {"error": "Processing failed"}
+    return {"stage": "failed" if "error" in result else "completed",
+            "elapsed": round(time.monotonic() - reporter.started, 3), "result": result}
+
+def stream_handler(job):
+    """Streaming entry point: yields progress events while the job runs, then the result.
+    
+    Events are {"stage", "elapsed", ...}: queued, started, per-node stages, sampling with
+    step/total, optional previews (input "previews": true), encoding; the last event is
+    {"stage": "completed" | "failed", "result": ...}. Closing the stream early interrupts
+    the running ComfyUI prompt.
+    """
+    events = queue.Queue()
+    reporter, worker, outcome = start_streamed_job(job, events.put)
+    try:
+        while True:
+            event = events.get()
+            if event is STREAM_FINISHED:
+                break
+            yield event
+    except GeneratorExit:
+        cancel_streamed_job(reporter, worker)
+        raise
+    
+    yield final_stream_event(reporter, outcome)
+
+def cancel_prompts(prompt_ids):
+    """Drop queued prompts and interrupt them if running (only these prompts, not other jobs')"""
+    if not prompt_ids:
+        return
+    try:
+        comfy_client.post("/queue", json={"delete": prompt_ids})
+        for prompt_id in prompt_ids:
+            comfy_client.post("/interrupt", json={"prompt_id": prompt_id})
+    except Exception as e:
+        logger.warning(f"⚠️ Could not cancel prompts: {str(e)}")
+
+async def async_handler(job):
+    """Concurrent entry point: the blocking handler runs on a thread so other jobs proceed"""
+    return await asyncio.to_thread(handler, job)
+
+async def async_stream_handler(job):
+    """Concurrent streaming entry point: the job thread hands events to the event loop.
+    
+    No thread blocks on the stream, so cancelling the task (or closing the generator)
+    only stops the wait here and then interrupts the job's prompts.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    
+    def publish(event):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+        except RuntimeError:
+            pass  # Event loop already closed
+    
+    reporter, worker, outcome = start_streamed_job(job, publish)
+    try:
+        while True:
+            event = await events.get()
+            if event is STREAM_FINISHED:
+                break
+            yield event
+    except (asyncio.CancelledError, GeneratorExit):
+        cancel_streamed_job(reporter, worker)
+        raise
+    
+    yield final_stream_event(reporter, outcome)
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    """One job until the worker is ready, then MAX_CONCURRENCY in flight"""
+    return MAX_CONCURRENCY if readiness.is_ready() else 1
+
+def serverless_config() -> Dict[str, Any]:
+    """runpod.serverless.start() config for the configured streaming / concurrency mode"""
+    if MAX_CONCURRENCY > 1:
+        config = {"handler": async_stream_handler if STREAM_PROGRESS else async_handler,
+                  "concurrency_modifier": concurrency_modifier}
+    else:
+        config = {"handler": stream_handler if STREAM_PROGRESS else handler}
+    if STREAM_PROGRESS:
+        config["return_aggregate_stream"] = True
+    return config
 
 # Initialize on startup
 if __name__ == "__main__":
     logger.info("🚀 Initializing AI-Avatarka Worker...")
     
-    # Load effects configuration
-    load_effects_config()
+    # Cold start before accepting jobs
+    boot()
     
     # Start the serverless worker
-    runpod.serverless.start({"handler": handler})
\ No newline at end of file
+    runpod.serverless.start(serverless_config())
\ No newline at end of file
@@ -0,0 +1,254 @@
+"""
+Image URL fetcher with an on-disk LRU cache
+Downloads are streamed with a size cap, timeouts and a content-type check, and only reach
+public addresses: every redirect hop is checked, and so is the address each connection
+actually lands on, whatever DNS answers in between. Entries are
+keyed by URL and revalidated with ETag / Last-Modified, so repeated avatars (the same
+user trying several effects) skip the transfer entirely.
+"""
+
+import os
+import json
+import time
+import socket
+import hashlib
+import logging
+import ipaddress
+import tempfile
+import threading
+import requests
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import urljoin, urlparse
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import disk
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "/tmp/avatarka-image-cache")
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Entries younger than this are served without revalidating against the origin
+IMAGE_CACHE_FRESH_SECONDS = float(os.environ.get("IMAGE_CACHE_FRESH_SECONDS", "300"))
+
+MAX_DOWNLOAD_BYTES = int(os.environ.get("MAX_INPUT_BYTES", str(40 * 1024 * 1024)))
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+TOTAL_TIMEOUT = float(os.environ.get("IMAGE_FETCH_TIMEOUT", "30"))
+DOWNLOAD_CHUNK = 256 * 1024
+
+ALLOWED_CONTENT_TYPES = ("image/",)
+ALLOWED_SCHEMES = ("http", "https")
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# Image URLs come from clients: loopback (ComfyUI itself), private, link-local (cloud
+# metadata at 169.254.169.254 / fd00:ec2::254) and other non-global addresses are refused
+ALLOW_PRIVATE_HOSTS = os.environ.get("IMAGE_FETCH_ALLOW_PRIVATE", "0") == "1"
+
+class FetchError(Exception):
+    """Image URL could not be fetched or is not acceptable"""
+
+class _PublicPeerOnly:
+    """Connection mixin: a socket whose peer is not public is closed before anything is sent.
+
+    validate_url resolves the host, but the connection resolves it again; a low-TTL name
+    could answer with a public address for the check and a private one for the connect.
+    """
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        peer = sock.getpeername()[0]
+        if not ALLOW_PRIVATE_HOSTS and not _is_public(peer):
+            sock.close()
+            raise FetchError(f"Image host is not a public address: {self.host} (connected to {peer})")
+        return sock
+
+class _PublicHTTPConnection(_PublicPeerOnly, HTTPConnection):
+    pass
+
+class _PublicHTTPSConnection(_PublicPeerOnly, HTTPSConnection):
+    pass
+
+class _PublicHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+class _PublicHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+class _PublicAdapter(requests.adapters.HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _PublicHTTPPool, "https": _PublicHTTPSPool}
+
+_session = requests.Session()
+_session.headers.update({"User-Agent": "AI-Avatarka-Worker/1.0"})
+for _scheme in ALLOWED_SCHEMES:
+    _session.mount(f"{_scheme}://", _PublicAdapter())
+
+# One download per URL at a time; concurrent requests for the same URL share it
+_url_locks: Dict[str, threading.Lock] = {}
+_url_locks_guard = threading.Lock()
+_evict_lock = threading.Lock()
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+def _paths(url: str):
+    base = Path(IMAGE_CACHE_DIR) / cache_key(url)
+    return base.with_suffix(".bin"), base.with_suffix(".json")
+
+def _url_lock(url: str) -> threading.Lock:
+    with _url_locks_guard:
+        return _url_locks.setdefault(url, threading.Lock())
+
+def _read_meta(meta_path: Path) -> Optional[Dict]:
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _touch(*paths: Path):
+    now = time.time()
+    for path in paths:
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+def validate_url(url: str):
+    """Raise FetchError unless url is http(s) and its host resolves only to public addresses"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ALLOWED_SCHEMES or not parsed.hostname:
+        raise FetchError(f"Unsupported image URL: {url[:100]}")
+    if ALLOW_PRIVATE_HOSTS:
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)}
+    except (socket.gaierror, UnicodeError, ValueError) as e:
+        raise FetchError(f"Image host cannot be resolved: {parsed.hostname} ({e})")
+    if not all(_is_public(address) for address in addresses):
+        raise FetchError(f"Image host is not a public address: {parsed.hostname}")
+
+def evict(max_bytes: int = IMAGE_CACHE_MAX_BYTES, keep: Optional[Path] = None):
+    """Drop least recently used entries until the cache fits its budget"""
+    def remove(data_path: Path) -> bool:
+        if data_path == keep:
+            return False
+        data_path.unlink(missing_ok=True)
+        data_path.with_suffix(".json").unlink(missing_ok=True)
+        return True
+
+    with _evict_lock:
+        disk.evict_lru(Path(IMAGE_CACHE_DIR).glob("*.bin"), max_bytes, remove, label="cached image")
+
+def _get(url: str, headers: Dict) -> requests.Response:
+    """GET url, following redirects by hand so each hop's host is validated"""
+    for _ in range(MAX_REDIRECTS + 1):
+        response = _session.get(url, headers=headers, stream=True, allow_redirects=False,
+                                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        location = response.headers.get("Location")
+        if response.status_code not in REDIRECT_CODES or not location:
+            return response
+        response.close()
+        url = urljoin(url, location)
+        validate_url(url)
+    raise FetchError(f"Image URL redirected more than {MAX_REDIRECTS} times")
+
+def _download(url: str, headers: Dict, data_path: Path, meta_path: Path) -> bool:
+    """Stream the body into the cache; returns False on 304 Not Modified"""
+    deadline = time.monotonic() + TOTAL_TIMEOUT
+    with _get(url, headers) as response:
+        if response.status_code == 304:
+            return False
+        if response.status_code != 200:
+            raise FetchError(f"Image URL returned HTTP {response.status_code}")
+
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if not content_type.startswith(ALLOWED_CONTENT_TYPES):
+            raise FetchError(f"Image URL has unsupported content type: {content_type or 'none'}")
+
+        declared = int(response.headers.get("Content-Length") or 0)
+        if declared > MAX_DOWNLOAD_BYTES:
+            raise FetchError(f"Image exceeds {MAX_DOWNLOAD_BYTES} bytes")
+
+        fd, temp_path = tempfile.mkstemp(dir=IMAGE_CACHE_DIR, suffix=".part")
+        try:
+            received = 0
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK):
+                    received += len(chunk)
+                    if received > MAX_DOWNLOAD_BYTES:
+                        raise FetchError(f"Image exceeds {MAX_DOWNLOAD_BYTES} bytes")
+                    if time.monotonic() > deadline:
+                        raise FetchError("Image download timed out")
+                    f.write(chunk)
+            os.replace(temp_path, data_path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": content_type,
+            "size": received,
+            "fetched_at": time.time()
+        }
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        logger.info(f"✅ Image downloaded ({received / 1024:.0f}KB)")
+        return True
+
+def fetch_image(url: str) -> Path:
+    """Return a local path for the image at url, using the cache when possible"""
+    validate_url(url)
+    Path(IMAGE_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    data_path, meta_path = _paths(url)
+
+    with _url_lock(url):
+        meta = _read_meta(meta_path) if data_path.exists() else None
+
+        if meta and time.time() - meta.get("fetched_at", 0) < IMAGE_CACHE_FRESH_SECONDS:
+            _touch(data_path, meta_path)
+            logger.info("✅ Image served from cache (fresh)")
+            return data_path
+
+        # Conditional only with both the body and its metadata at hand
+        headers = {}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            downloaded = _download(url, headers, data_path, meta_path)
+            if not downloaded and not (headers and data_path.exists()):
+                # 304 to an unconditional request, or the body was evicted meanwhile: fetch it whole
+                if not _download(url, {}, data_path, meta_path):
+                    raise FetchError("Image URL returned HTTP 304 with nothing cached")
+                downloaded = True
+        except requests.exceptions.RequestException as e:
+            raise FetchError(f"Image download failed: {str(e)}")
+
+        if not downloaded:
+            meta["fetched_at"] = time.time()
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+            _touch(data_path, meta_path)
+            logger.info("✅ Image served from cache (revalidated)")
+            return data_path
+
+    evict(keep=data_path)
+    return data_path
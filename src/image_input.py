@@ -0,0 +1,300 @@
+"""
+Bounded-memory input image ingestion
+Base64 is decoded in blocks into a spooled temp file, large photos are downscaled
+during decode (JPEG draft / reduce) straight to the generation width, and images
+that are already usable are handed to ComfyUI byte-for-byte without a re-encode.
+
+Files are named by a hash of their normalized pixels, so a resubmitted portrait maps
+to the same LoadImage input and ComfyUI's execution cache can reuse the encoder
+outputs. Inputs are reference counted per job; unreferenced ones are retained
+(most recent INPUT_RETAIN_COUNT) for later resubmissions instead of deleted outright.
+A file counts as available only once its delivery succeeded; jobs ingesting the same
+image meanwhile wait for that delivery instead of writing it again.
+"""
+
+import os
+import hashlib
+import logging
+import binascii
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Dict, NamedTuple, Optional, Set, Tuple
+from PIL import Image, ImageOps
+
+import comfy_client
+
+logger = logging.getLogger(__name__)
+
+COMFYUI_PATH = os.environ.get("COMFYUI_PATH", "/workspace/ComfyUI")
+
+# Where ComfyUI reads inputs from; point at tmpfs (e.g. /dev/shm/comfyui-input) to keep
+# uploads off the container disk - ComfyUI is then launched with --input-directory
+COMFYUI_INPUT_DIR = os.environ.get("COMFYUI_INPUT_DIR", f"{COMFYUI_PATH}/input")
+
+# "file" writes into COMFYUI_INPUT_DIR, "upload" goes through ComfyUI's /upload/image
+IMAGE_DELIVERY = os.environ.get("IMAGE_DELIVERY", "file")
+
+# Scratch space for decoded uploads before they are opened
+SCRATCH_DIR = os.environ.get("IMAGE_SCRATCH_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+DEFAULT_TARGET_WIDTH = 720
+MAX_INPUT_BYTES = int(os.environ.get("MAX_INPUT_BYTES", str(40 * 1024 * 1024)))
+MAX_INPUT_PIXELS = int(os.environ.get("MAX_INPUT_PIXELS", str(50_000_000)))
+
+# Decoded bytes kept in RAM before the temp file spills to SCRATCH_DIR
+SPOOL_MAX_MEMORY = 4 * 1024 * 1024
+
+# Characters decoded per block (multiple of 4)
+DECODE_BLOCK_CHARS = 4 * 64 * 1024
+
+JPEG_QUALITY = 95
+
+# Formats ComfyUI's LoadImage takes as-is
+PASSTHROUGH_FORMATS = {"JPEG": ".jpg", "PNG": ".png"}
+
+# Unreferenced inputs kept on disk for reuse by later jobs
+INPUT_RETAIN_COUNT = int(os.environ.get("INPUT_RETAIN_COUNT", "32"))
+
+class ImageRejected(Exception):
+    """Input is not an acceptable image"""
+
+class IngestedImage(NamedTuple):
+    filename: str
+    size: Tuple[int, int]
+    reused: bool
+
+_refs: Dict[str, int] = {}
+_retained: "OrderedDict[str, None]" = OrderedDict()
+# Inputs ComfyUI has, and inputs some job is delivering right now
+_available: Set[str] = set()
+_delivering: Dict[str, threading.Event] = {}
+_refs_lock = threading.Lock()
+_stats = {"ingested": 0, "reused": 0}
+
+def decode_base64_stream(data: str, out: BinaryIO, max_bytes: int = MAX_INPUT_BYTES) -> int:
+    """Decode base64 (optionally a data URL) block by block into a file object"""
+    start = data.find(",", 0, 256) + 1 if data.startswith("data:") else 0
+    if base64_decoded_size(len(data) - start) > max_bytes + 3:
+        raise ImageRejected(f"Image exceeds {max_bytes} bytes")
+
+    written = 0
+    carry = ""
+    position = start
+    while position < len(data):
+        block = carry + "".join(data[position:position + DECODE_BLOCK_CHARS].split())
+        position += DECODE_BLOCK_CHARS
+        usable = len(block) - len(block) % 4
+        carry = block[usable:]
+        if usable:
+            written += out.write(binascii.a2b_base64(block[:usable]))
+    if carry:
+        raise ImageRejected("Invalid base64 image data")
+    return written
+
+def base64_decoded_size(encoded_chars: int) -> int:
+    return encoded_chars * 3 // 4
+
+def open_checked(source: BinaryIO) -> Image.Image:
+    """Open an image lazily, rejecting decompression bombs before any pixel is decoded"""
+    try:
+        image = Image.open(source)
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(str(e))
+    except Exception:
+        raise ImageRejected("Unrecognized image format")
+
+    width, height = image.size
+    if width * height > MAX_INPUT_PIXELS:
+        raise ImageRejected(f"Image too large: {width}x{height} exceeds {MAX_INPUT_PIXELS} pixels")
+    return image
+
+def orientation(image: Image.Image) -> int:
+    try:
+        return image.getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+
+def can_pass_through(image: Image.Image, target_width: int) -> bool:
+    """Already an upright RGB JPEG/PNG no wider than the generation width - usable verbatim"""
+    return (
+        image.format in PASSTHROUGH_FORMATS
+        and image.mode == "RGB"
+        and image.size[0] <= target_width
+        and orientation(image) == 1
+    )
+
+def normalize(image: Image.Image, target_width: int) -> Image.Image:
+    """Downscale during decode to the generation width, apply EXIF rotation, convert to RGB"""
+    rotated = orientation(image) in (5, 6, 7, 8)
+    stored_width = image.size[1] if rotated else image.size[0]
+
+    if stored_width > target_width:
+        # thumbnail() uses JPEG draft decoding and reduce() before the final LANCZOS pass;
+        # the box is given in stored orientation so the displayed width ends up at target
+        box = (image.size[0], target_width) if rotated else (target_width, image.size[1])
+        image.thumbnail(box, Image.LANCZOS, reducing_gap=2.0)
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+def pixel_digest(image: Image.Image) -> str:
+    """Hash of the decoded pixels, independent of the container encoding"""
+    digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()[:32]
+
+def _acquire(filename: str) -> bool:
+    """Take a job reference on an input; True if the file is already with ComfyUI.
+
+    False means this job must deliver the file and report it with _delivered().
+    """
+    with _refs_lock:
+        _refs[filename] = _refs.get(filename, 0) + 1
+        _retained.pop(filename, None)
+        _stats["ingested"] += 1
+
+    while True:
+        with _refs_lock:
+            ready = _delivering.get(filename)
+            if ready is None:
+                known = filename in _available
+                if not known and IMAGE_DELIVERY != "upload":
+                    # Written atomically, so a file left by an earlier process is complete
+                    known = (Path(COMFYUI_INPUT_DIR) / filename).exists()
+                if known:
+                    _available.add(filename)
+                    _stats["reused"] += 1
+                    return True
+                _delivering[filename] = threading.Event()
+                return False
+        # Another job is delivering the same image; if that fails, this one takes over
+        ready.wait()
+
+def _delivered(filename: str, ok: bool):
+    """Finish a delivery claimed by _acquire() and wake jobs waiting for it"""
+    with _refs_lock:
+        if ok:
+            _available.add(filename)
+        _delivering.pop(filename).set()
+
+def release_image(filename: str):
+    """Drop a job reference; unreferenced inputs are retained, oldest deleted beyond the limit"""
+    expired = []
+    with _refs_lock:
+        count = _refs.get(filename, 0) - 1
+        if count > 0:
+            _refs[filename] = count
+            return
+        _refs.pop(filename, None)
+        if filename not in _available:
+            return
+        _retained[filename] = None
+        while len(_retained) > INPUT_RETAIN_COUNT:
+            name = _retained.popitem(last=False)[0]
+            _available.discard(name)
+            expired.append(name)
+
+    for name in expired:
+        try:
+            (Path(COMFYUI_INPUT_DIR) / name).unlink(missing_ok=True)
+            logger.info(f"🧹 Removed retained input image {name}")
+        except OSError:
+            pass
+
+def input_cache_stats() -> Dict:
+    with _refs_lock:
+        ingested = _stats["ingested"]
+        return {
+            "ingested": ingested,
+            "reused": _stats["reused"],
+            "hit_rate": round(_stats["reused"] / ingested, 3) if ingested else 0.0,
+            "retained": len(_retained),
+            "referenced": len(_refs)
+        }
+
+def deliver(source: BinaryIO, filename: str) -> str:
+    """Hand the encoded image to ComfyUI, returns the name LoadImage should use"""
+    source.seek(0)
+    if IMAGE_DELIVERY == "upload":
+        response = comfy_client.post(
+            "/upload/image",
+            files={"image": (filename, source, "application/octet-stream")},
+            data={"type": "input", "overwrite": "true"}
+        )
+        response.raise_for_status()
+        result = response.json()
+        return f"{result['subfolder']}/{result['name']}" if result.get("subfolder") else result["name"]
+
+    input_dir = Path(COMFYUI_INPUT_DIR)
+    input_dir.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=input_dir, prefix=f".{filename}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = source.read(1024 * 1024)
+                if not block:
+                    break
+                f.write(block)
+        os.replace(temp_path, input_dir / filename)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+    return filename
+
+def _deliver_claimed(write, filename: str) -> str:
+    """Run a delivery claimed by _acquire(); on failure the job's reference is dropped"""
+    try:
+        name = write()
+    except BaseException:
+        _delivered(filename, False)
+        release_image(filename)
+        raise
+    _delivered(filename, True)
+    return name
+
+def _ingest(raw: BinaryIO, target_width: int, scratch_dir: Optional[str] = None) -> IngestedImage:
+    """Normalize an encoded image file object and deliver it under its content name"""
+    image = open_checked(raw)
+
+    if can_pass_through(image, target_width):
+        filename = f"avatarka_{pixel_digest(image)}{PASSTHROUGH_FORMATS[image.format]}"
+        size = image.size
+        if _acquire(filename):
+            return IngestedImage(filename, size, True)
+        logger.info(f"✅ Input image passed through without re-encode ({size[0]}x{size[1]})")
+        return IngestedImage(_deliver_claimed(lambda: deliver(raw, filename), filename), size, False)
+
+    original_size = image.size
+    image = normalize(image, target_width)
+    size = image.size
+    filename = f"avatarka_{pixel_digest(image)}.jpg"
+    if _acquire(filename):
+        image.close()
+        return IngestedImage(filename, size, True)
+
+    def write():
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, dir=scratch_dir or SCRATCH_DIR) as encoded:
+            image.save(encoded, "JPEG", quality=JPEG_QUALITY)
+            image.close()
+            logger.info(f"✅ Input image normalized {original_size[0]}x{original_size[1]} -> {size[0]}x{size[1]}")
+            return deliver(encoded, filename)
+
+    return IngestedImage(_deliver_claimed(write, filename), size, False)
+
+def ingest_image(image_data: str, target_width: int = DEFAULT_TARGET_WIDTH,
+                 scratch_dir: Optional[str] = None) -> IngestedImage:
+    """Decode, normalize and deliver a base64 image; the caller must release_image() it"""
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, dir=scratch_dir or SCRATCH_DIR) as raw:
+        decode_base64_stream(image_data, raw)
+        raw.seek(0)
+        return _ingest(raw, target_width, scratch_dir)
+
+def ingest_image_file(path: str, target_width: int = DEFAULT_TARGET_WIDTH,
+                      scratch_dir: Optional[str] = None) -> IngestedImage:
+    """Normalize and deliver an image already on disk (e.g. a fetched URL)"""
+    with open(path, "rb") as raw:
+        return _ingest(raw, target_width, scratch_dir)
@@ -0,0 +1,156 @@
+"""
+Worker latency metrics
+Per-stage durations (monotonic clock) go into rolling windows for p50/p95/p99, next to
+lifetime counters and peak RSS. Available as a dict, as Prometheus text, and as a log
+line / textfile written every METRICS_LOG_INTERVAL seconds.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# Samples kept per stage for percentiles
+METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", "512"))
+# Seconds between metrics log lines (0 disables the reporter thread)
+METRICS_LOG_INTERVAL = float(os.environ.get("METRICS_LOG_INTERVAL", "300"))
+# Optional Prometheus textfile-collector path rewritten on the same interval
+METRICS_TEXTFILE = os.environ.get("METRICS_TEXTFILE")
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_windows: Dict[str, Deque[float]] = {}
+_sums: Dict[str, float] = {}
+_counts: Dict[str, int] = {}
+_counters: Dict[str, int] = {}
+_gauges: Dict[str, float] = {}
+_peak_rss = 0
+_reporter: Optional[threading.Thread] = None
+
+def observe(stage: str, seconds: float):
+    """Add one duration sample for a stage"""
+    with _lock:
+        window = _windows.get(stage)
+        if window is None:
+            window = _windows[stage] = deque(maxlen=METRICS_WINDOW)
+        window.append(seconds)
+        _sums[stage] = _sums.get(stage, 0.0) + seconds
+        _counts[stage] = _counts.get(stage, 0) + 1
+
+def incr(counter: str, amount: int = 1):
+    with _lock:
+        _counters[counter] = _counters.get(counter, 0) + amount
+
+def set_gauge(gauge: str, value: float):
+    """Record the latest value of a level (bytes on disk, queue depth, ...)"""
+    with _lock:
+        _gauges[gauge] = value
+
+@contextmanager
+def timed(timings: Dict[str, float], stage: str):
+    """Time a block into a job's timings dict (accumulating) and the stage histogram"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        timings[stage] = round(timings.get(stage, 0.0) + elapsed, 3)
+        observe(stage, elapsed)
+
+def sample_rss() -> int:
+    """Current RSS in bytes; also updates the recorded peak"""
+    global _peak_rss
+    if psutil is not None:
+        rss = psutil.Process().memory_info().rss
+    else:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    with _lock:
+        _peak_rss = max(_peak_rss, rss)
+    return rss
+
+def percentile(ordered, q: float) -> float:
+    """Nearest-rank percentile of a sorted, non-empty sequence"""
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def snapshot() -> Dict:
+    with _lock:
+        stages = {}
+        for stage, window in _windows.items():
+            ordered = sorted(window)
+            stages[stage] = {
+                "count": _counts[stage],
+                **{f"p{int(q * 100)}": round(percentile(ordered, q), 3) for q in QUANTILES}
+            }
+        return {"stages": stages, "counters": dict(_counters), "gauges": dict(_gauges), "peak_rss_bytes": _peak_rss}
+
+def render_prometheus() -> str:
+    """Prometheus text exposition: stage summaries, event counters, gauges, peak RSS"""
+    with _lock:
+        lines = ["# TYPE avatarka_stage_seconds summary"]
+        for stage, window in sorted(_windows.items()):
+            ordered = sorted(window)
+            for q in QUANTILES:
+                lines.append(f'avatarka_stage_seconds{{stage="{stage}",quantile="{q}"}} {percentile(ordered, q):.6f}')
+            lines.append(f'avatarka_stage_seconds_sum{{stage="{stage}"}} {_sums[stage]:.6f}')
+            lines.append(f'avatarka_stage_seconds_count{{stage="{stage}"}} {_counts[stage]}')
+        lines.append("# TYPE avatarka_events_total counter")
+        for counter, value in sorted(_counters.items()):
+            lines.append(f'avatarka_events_total{{event="{counter}"}} {value}')
+        if _gauges:
+            lines.append("# TYPE avatarka_gauge gauge")
+        for gauge, value in sorted(_gauges.items()):
+            lines.append(f'avatarka_gauge{{name="{gauge}"}} {value}')
+        lines.append("# TYPE avatarka_peak_rss_bytes gauge")
+        lines.append(f"avatarka_peak_rss_bytes {_peak_rss}")
+        return "\n".join(lines) + "\n"
+
+def log_line() -> str:
+    data = snapshot()
+    stages = " ".join(
+        f"{stage}={values['p50']}/{values['p95']}/{values['p99']}s"
+        for stage, values in sorted(data["stages"].items())
+    )
+    counters = " ".join(f"{name}={value}" for name, value in sorted(data["counters"].items()))
+    return f"📊 p50/p95/p99 {stages or '-'} | {counters or '-'} | peak_rss={data['peak_rss_bytes'] / 1024 ** 2:.0f}MB"
+
+def _report_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            sample_rss()
+            logger.info(log_line())
+            if METRICS_TEXTFILE:
+                temp_path = f"{METRICS_TEXTFILE}.tmp"
+                with open(temp_path, "w") as f:
+                    f.write(render_prometheus())
+                os.replace(temp_path, METRICS_TEXTFILE)
+        except Exception as e:
+            logger.warning(f"⚠️ Metrics report failed: {str(e)}")
+
+def start_reporter(interval: float = METRICS_LOG_INTERVAL):
+    """Start the periodic log/textfile reporter once"""
+    global _reporter
+    with _lock:
+        if _reporter is not None or interval <= 0:
+            return
+        _reporter = threading.Thread(target=_report_loop, args=(interval,), name="avatarka-metrics", daemon=True)
+        _reporter.start()
+
+def observe_http(method: str, endpoint: str, status: Optional[int], seconds: float):
+    """comfy_client latency hook"""
+    observe(f"http_{endpoint}", seconds)
+    if status is None or status >= 500:
+        incr(f"http_{endpoint}_errors")
@@ -0,0 +1,127 @@
+"""
+Model file integrity
+models_manifest.json pins the size and SHA-256 of every base model and LoRA, keyed by
+"category/filename" under the models directory; entries not pinned yet still carry an
+approximate "size_gb" that catches truncated or placeholder files. Downloads hash while
+they stream; the result goes into a verified record (.verified.json next to the models)
+keyed by size and mtime, so later runs and worker boot skip rehashing files that have not
+changed - and a recorded file whose size or hash changes afterwards fails verification.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = Path(os.environ.get("MODELS_MANIFEST", Path(__file__).resolve().parent / "models_manifest.json"))
+VERIFIED_RECORD = ".verified.json"
+HASH_BLOCK = 8 * 1024 * 1024
+# Files without a pinned size must reach this share of their approximate "size_gb"
+# (a floor only: the listed sizes are rough, truncated/placeholder files are far below)
+SIZE_FLOOR = 0.5
+
+_record_lock = threading.Lock()
+
+class IntegrityError(Exception):
+    """Model file does not match its manifest entry"""
+
+def load_manifest(path: Path = MANIFEST_PATH) -> Dict[str, Dict]:
+    """{"category/filename": {"size": int|None, "sha256": str|None, "size_gb": float (optional)}}"""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Model manifest unavailable: {str(e)}")
+        return {}
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _record_path(models_path: Path) -> Path:
+    return Path(models_path) / VERIFIED_RECORD
+
+def load_record(models_path: Path) -> Dict[str, Dict]:
+    try:
+        with open(_record_path(models_path), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def record_verified(models_path: Path, name: str, sha256: str):
+    """Remember that the file as it is now (size, mtime) hashes to sha256"""
+    stat = (Path(models_path) / name).stat()
+    with _record_lock:
+        record = load_record(models_path)
+        record[name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+        temp_path = _record_path(models_path).with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+        os.replace(temp_path, _record_path(models_path))
+
+def check_expected(name: str, size: int, sha256: Optional[str], expected: Optional[Dict]):
+    """Raise IntegrityError if a file's size/hash contradict its manifest entry"""
+    expected = expected or {}
+    if expected.get("size") is not None and size != expected["size"]:
+        raise IntegrityError(f"{name}: size {size} != manifest {expected['size']}")
+    size_gb = expected.get("size_gb")
+    if expected.get("size") is None and size_gb and size < size_gb * SIZE_FLOOR * 1024 ** 3:
+        raise IntegrityError(f"{name}: size {size / 1024 ** 3:.2f}GB, expected about {size_gb}GB")
+    if sha256 and expected.get("sha256") and sha256 != expected["sha256"]:
+        raise IntegrityError(f"{name}: sha256 {sha256[:12]} != manifest {expected['sha256'][:12]}")
+
+def verify_file(models_path: Path, name: str, expected: Optional[Dict], record: Dict, rehash: bool = True) -> str:
+    """Check one file; returns how ("recorded", "hashed", "size only"), raises IntegrityError"""
+    path = Path(models_path) / name
+    try:
+        stat = path.stat()
+    except OSError:
+        raise IntegrityError(f"{name}: missing")
+
+    known = record.get(name)
+    if known:
+        # A verified file may be touched, but never change content
+        if known["size"] != stat.st_size:
+            raise IntegrityError(f"{name}: size {stat.st_size} changed since verified ({known['size']})")
+        if known["mtime_ns"] == stat.st_mtime_ns:
+            check_expected(name, stat.st_size, known["sha256"], expected)
+            return "recorded"
+        sha256 = file_sha256(path)
+        if sha256 != known["sha256"]:
+            raise IntegrityError(f"{name}: sha256 {sha256[:12]} changed since verified ({known['sha256'][:12]})")
+        check_expected(name, stat.st_size, sha256, expected)
+        record_verified(models_path, name, sha256)
+        return "hashed"
+
+    if not rehash:
+        check_expected(name, stat.st_size, None, expected)
+        return "size only"
+
+    sha256 = file_sha256(path)
+    check_expected(name, stat.st_size, sha256, expected)
+    record_verified(models_path, name, sha256)
+    return "hashed"
+
+def verify_models(models_path: Path, manifest: Optional[Dict[str, Dict]] = None, rehash: bool = True) -> Dict[str, str]:
+    """Problems by file name for every manifest entry (empty when all files check out)"""
+    manifest = load_manifest() if manifest is None else manifest
+    record = load_record(models_path)
+    unpinned = [name for name, expected in manifest.items() if not (expected or {}).get("sha256")]
+    if unpinned:
+        logger.warning(f"⚠️ {len(unpinned)}/{len(manifest)} manifest entries have no pinned sha256 - "
+                       f"checked against the verified record and approximate sizes only")
+    problems = {}
+    for name, expected in manifest.items():
+        try:
+            verify_file(models_path, name, expected, record, rehash)
+        except IntegrityError as e:
+            problems[name] = str(e)
+    return problems
@@ -0,0 +1,222 @@
+"""
+Tiered LoRA store
+LoRAs are resolved on first use from, in order: the local cache directory (can sit on
+NVMe; a lost link into ComfyUI's loras folder is simply re-created), a shared network
+volume, and a remote origin URL. Fetches are single-flight per
+file and hashed while they stream (checked against models_manifest.json); files fetched
+from the origin are written through to the volume for other workers. The local cache is
+LRU-evicted above LORA_CACHE_MAX_BYTES, never touching LoRAs pinned by running jobs.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import disk
+import metrics
+import model_manifest
+
+logger = logging.getLogger(__name__)
+
+COMFYUI_PATH = os.environ.get("COMFYUI_PATH", "/workspace/ComfyUI")
+# Where ComfyUI looks for LoRAs; cache files elsewhere are symlinked in here
+COMFYUI_LORA_DIR = Path(COMFYUI_PATH) / "models" / "loras"
+LORA_CACHE_DIR = Path(os.environ.get("LORA_CACHE_DIR", str(COMFYUI_LORA_DIR)))
+# Shared tier, e.g. a RunPod network volume; ignored when the path does not exist
+MODEL_VOLUME_DIR = Path(os.environ.get("MODEL_VOLUME_DIR", "/runpod-volume/avatarka/loras"))
+# Last resort, e.g. https://huggingface.co/<org>/<repo>/resolve/main/{filename}
+LORA_ORIGIN_URL = os.environ.get("LORA_ORIGIN_URL")
+
+# 0 keeps every LoRA (images with baked-in LoRAs have no other tier to refetch from)
+LORA_CACHE_MAX_BYTES = int(os.environ.get("LORA_CACHE_MAX_BYTES", "0"))
+LORA_FETCH_TIMEOUT = float(os.environ.get("LORA_FETCH_TIMEOUT", "600"))
+COPY_CHUNK = 8 * 1024 * 1024
+
+_session = requests.Session()
+_session.headers.update({"User-Agent": "AI-Avatarka-Worker/1.0"})
+
+_guard = threading.Lock()
+_fetch_locks: Dict[str, threading.Lock] = {}
+_pins: Dict[str, int] = {}
+
+class StoreError(Exception):
+    """LoRA is not available from any tier"""
+
+def _volume_dir() -> Optional[Path]:
+    return MODEL_VOLUME_DIR if MODEL_VOLUME_DIR.is_dir() else None
+
+def has_remote_tiers() -> bool:
+    """Whether a missing LoRA can be fetched instead of failing the job"""
+    return _volume_dir() is not None or bool(LORA_ORIGIN_URL)
+
+def _local_path(filename: str) -> Path:
+    return LORA_CACHE_DIR / filename
+
+def _is_present(filename: str) -> bool:
+    return (COMFYUI_LORA_DIR / filename).exists()
+
+def _link(filename: str):
+    """Point ComfyUI's loras folder at the cached file"""
+    if LORA_CACHE_DIR != COMFYUI_LORA_DIR:
+        COMFYUI_LORA_DIR.mkdir(parents=True, exist_ok=True)
+        link = COMFYUI_LORA_DIR / filename
+        link.unlink(missing_ok=True)
+        link.symlink_to(_local_path(filename))
+
+def _relink_cached(filename: str) -> bool:
+    """Re-create a lost link to a LoRA still in the local cache (new container, cleaned folder)"""
+    path = _local_path(filename)
+    if LORA_CACHE_DIR == COMFYUI_LORA_DIR or not path.is_file():
+        return False
+    try:
+        expected = model_manifest.load_manifest().get(f"loras/{filename}")
+        model_manifest.check_expected(filename, path.stat().st_size, None, expected)
+    except (OSError, model_manifest.IntegrityError) as e:
+        logger.warning(f"⚠️ Cached LoRA {filename} not reused: {str(e)}")
+        return False
+    _link(filename)
+    _touch(path)
+    return True
+
+def _touch(path: Path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def _read_chunks(path: Path) -> Iterable[bytes]:
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(COPY_CHUNK), b"")
+
+def _stream_into(chunks: Iterable[bytes], filename: str, directory: Path) -> Path:
+    """Write a stream to directory/filename atomically, verifying its hash on the way"""
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{filename}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        expected = model_manifest.load_manifest().get(f"loras/{filename}")
+        model_manifest.check_expected(filename, size, digest.hexdigest(), expected)
+        os.replace(temp_path, directory / filename)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+    return directory / filename
+
+def _fetch_origin(filename: str) -> Path:
+    url = LORA_ORIGIN_URL.format(filename=filename)
+    with _session.get(url, stream=True, timeout=(5, 60)) as response:
+        if response.status_code != 200:
+            raise StoreError(f"origin returned HTTP {response.status_code} for {filename}")
+        path = _stream_into(response.iter_content(COPY_CHUNK), filename, LORA_CACHE_DIR)
+
+    # Write through so other workers find it on the shared tier
+    volume = _volume_dir()
+    if volume is not None:
+        try:
+            _stream_into(_read_chunks(path), filename, volume)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not write {filename} to the network volume: {str(e)}")
+    return path
+
+def _fetch(filename: str) -> str:
+    """Bring a LoRA into the local cache; returns the tier it came from"""
+    volume = _volume_dir()
+    if volume is not None and (volume / filename).exists():
+        _stream_into(_read_chunks(volume / filename), filename, LORA_CACHE_DIR)
+        tier = "volume"
+    elif LORA_ORIGIN_URL:
+        _fetch_origin(filename)
+        tier = "origin"
+    else:
+        raise StoreError(f"LoRA {filename} is not on the network volume and no origin is configured")
+
+    _link(filename)
+    return tier
+
+def ensure_lora(filename: str) -> Path:
+    """Local path of a LoRA, fetching it first if needed (one fetch per file at a time)"""
+    if _is_present(filename):
+        _touch(_local_path(filename))
+        return COMFYUI_LORA_DIR / filename
+
+    with _guard:
+        lock = _fetch_locks.setdefault(filename, threading.Lock())
+    if not lock.acquire(timeout=LORA_FETCH_TIMEOUT):
+        raise StoreError(f"Timed out waiting for LoRA {filename}")
+    try:
+        # Another job may have fetched it while this one waited
+        if _is_present(filename):
+            metrics.incr("lora_fetch_shared")
+            return COMFYUI_LORA_DIR / filename
+        # The local cache is a tier of its own: only its link may be missing
+        if _relink_cached(filename):
+            metrics.incr("lora_fetch_local")
+            logger.info(f"✅ LoRA {filename} relinked from the local cache")
+            return COMFYUI_LORA_DIR / filename
+        if not has_remote_tiers():
+            # Baked-in image: nothing to fetch from, ComfyUI reports the missing file itself
+            return COMFYUI_LORA_DIR / filename
+        start = time.monotonic()
+        try:
+            tier = _fetch(filename)
+        except StoreError:
+            raise
+        except Exception as e:
+            raise StoreError(f"Failed to fetch LoRA {filename}: {str(e)}")
+        elapsed = time.monotonic() - start
+        metrics.observe("lora_fetch", elapsed)
+        metrics.incr(f"lora_fetch_{tier}")
+        logger.info(f"✅ LoRA {filename} fetched from {tier} in {elapsed:.1f}s")
+    finally:
+        lock.release()
+
+    evict(keep=filename)
+    return COMFYUI_LORA_DIR / filename
+
+@contextmanager
+def pinned(filenames: Iterable[str]):
+    """Keep LoRAs out of eviction while a job uses them"""
+    names = list(filenames)
+    with _guard:
+        for name in names:
+            _pins[name] = _pins.get(name, 0) + 1
+    try:
+        yield
+    finally:
+        with _guard:
+            for name in names:
+                _pins[name] -= 1
+                if not _pins[name]:
+                    del _pins[name]
+
+def evict(max_bytes: int = LORA_CACHE_MAX_BYTES, keep: Optional[str] = None):
+    """Drop least recently used, unpinned LoRAs until the local cache fits its budget"""
+    if max_bytes <= 0 or not has_remote_tiers():
+        return
+
+    def remove(path: Path) -> bool:
+        with _guard:
+            if path.name == keep or _pins.get(path.name):
+                return False
+            path.unlink(missing_ok=True)
+            if LORA_CACHE_DIR != COMFYUI_LORA_DIR:
+                (COMFYUI_LORA_DIR / path.name).unlink(missing_ok=True)
+        return True
+
+    cached = (path for path in LORA_CACHE_DIR.glob("*.safetensors") if not path.is_symlink())
+    evicted = disk.evict_lru(cached, max_bytes, remove, label="LoRA")
+    if evicted:
+        metrics.incr("lora_evictions", len(evicted))
@@ -0,0 +1,164 @@
+"""
+Boot-time page-cache prefetch
+Model loading on ComfyUI's first prompt is bound by sequential reads from a cold disk.
+While ComfyUI starts, the weight files the workflow needs (its loader nodes plus the
+effects' LoRAs, most popular first) are read in segments by several concurrent readers,
+so the first load is served from the OS page cache. Files that would not fit in the
+available RAM are skipped, since reading them would only evict what was prefetched.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import metrics
+import readiness
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_READERS = max(1, int(os.environ.get("PREFETCH_READERS", "8")))
+PREFETCH_SEGMENT_BYTES = int(os.environ.get("PREFETCH_SEGMENT_MB", "64")) * 1024 * 1024
+# Share of MemAvailable the prefetched files may take
+PREFETCH_RAM_FRACTION = float(os.environ.get("PREFETCH_RAM_FRACTION", "0.8"))
+# Effects whose LoRAs are prefetched first, most requested first (comma separated)
+POPULAR_EFFECTS = [e.strip() for e in os.environ.get("POPULAR_EFFECTS", "").split(",") if e.strip()]
+
+MODEL_SUFFIXES = (".safetensors", ".pth", ".pt", ".ckpt", ".bin")
+READ_BLOCK = 4 * 1024 * 1024
+
+_thread: Optional[threading.Thread] = None
+
+def _locate(models_path: Path, filename: str) -> Optional[Path]:
+    """Model file under any category folder (ComfyUI resolves loader names the same way)"""
+    for path in sorted(models_path.glob(f"*/{filename}")):
+        if path.is_file():
+            return path
+    return None
+
+def model_files(models_path: Path, nodes: Dict, effects: Dict, first_effects: Sequence[str] = ()) -> List[Path]:
+    """Weight files in prefetch order: base models smallest first, then LoRAs by popularity"""
+    base = []
+    for node in nodes.values():
+        for value in node.get("inputs", {}).values():
+            if isinstance(value, str) and value.endswith(MODEL_SUFFIXES):
+                path = _locate(models_path, value)
+                if path is not None and path not in base:
+                    base.append(path)
+    base.sort(key=lambda path: path.stat().st_size)
+
+    ordered = [effect for effect in first_effects if effect in effects]
+    ordered += [effect for effect in effects if effect not in ordered]
+    loras = []
+    for effect in ordered:
+        path = models_path / "loras" / effects[effect]["lora"]
+        if path.is_file() and path not in loras:
+            loras.append(path)
+    return base + loras
+
+def available_memory() -> Optional[int]:
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _budgeted(paths: List[Path]) -> List[Tuple[Path, int]]:
+    """Files (with sizes) that fit in the RAM budget, keeping their order"""
+    available = available_memory()
+    budget = available * PREFETCH_RAM_FRACTION if available else float("inf")
+    chosen = []
+    for path in paths:
+        size = path.stat().st_size
+        if size > budget:
+            logger.warning(f"⚠️ Prefetch skips {path.name} ({size / 1024 ** 2:.0f}MB) - not enough free RAM")
+            continue
+        budget -= size
+        chosen.append((path, size))
+    return chosen
+
+def _reader(segments: queue.Queue, on_done):
+    buffer = bytearray(READ_BLOCK)
+    view = memoryview(buffer)
+    while True:
+        segment = segments.get()
+        if segment is None:
+            return
+        index, path, offset, length = segment
+        try:
+            with open(path, "rb", buffering=0) as f:
+                f.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    read = f.readinto(view[:min(READ_BLOCK, remaining)])
+                    if not read:
+                        break
+                    remaining -= read
+        except OSError as e:
+            logger.warning(f"⚠️ Prefetch read failed for {path.name}: {str(e)}")
+        on_done(index, length)
+
+def prefetch(files: List[Tuple[Path, int]], readers: int = PREFETCH_READERS):
+    """Read files into the page cache with concurrent segment readers; blocks until done"""
+    total = sum(size for _, size in files)
+    start = time.monotonic()
+    segments = queue.Queue()
+    pending = []
+    for index, (path, size) in enumerate(files):
+        offsets = range(0, size, PREFETCH_SEGMENT_BYTES)
+        pending.append(len(offsets))
+        for offset in offsets:
+            segments.put((index, path, offset, min(PREFETCH_SEGMENT_BYTES, size - offset)))
+
+    lock = threading.Lock()
+    progress = {"bytes": 0, "files": 0}
+    metrics.set_gauge("prefetch_total_bytes", total)
+
+    def on_done(index, length):
+        with lock:
+            progress["bytes"] += length
+            pending[index] -= 1
+            if pending[index]:
+                return
+            progress["files"] += 1
+            done_bytes, done_files = progress["bytes"], progress["files"]
+        metrics.set_gauge("prefetch_bytes", done_bytes)
+        logger.info(f"📥 Prefetched {files[index][0].name} "
+                    f"({done_files}/{len(files)} files, {done_bytes / 1024 ** 3:.1f}/{total / 1024 ** 3:.1f}GB)")
+
+    threads = [threading.Thread(target=_reader, args=(segments, on_done), daemon=True,
+                                name=f"prefetch-{i}") for i in range(readers)]
+    for thread in threads:
+        segments.put(None)
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - start
+    readiness.record_phase("prefetch", elapsed)
+    if files:
+        logger.info(f"✅ Prefetch complete: {total / 1024 ** 3:.1f}GB in {elapsed:.1f}s "
+                    f"({total / 1024 ** 2 / max(elapsed, 1e-6):.0f}MB/s)")
+
+def start(models_path: Path, nodes: Dict, effects: Dict, first_effects: Sequence[str] = ()) -> bool:
+    """Prefetch in the background (once per process); returns False if nothing was started"""
+    global _thread
+    if not PREFETCH_ENABLED or _thread is not None:
+        return False
+    try:
+        files = _budgeted(model_files(Path(models_path), nodes, effects, first_effects))
+    except OSError as e:
+        logger.warning(f"⚠️ Prefetch disabled: {str(e)}")
+        return False
+    if not files:
+        return False
+    _thread = threading.Thread(target=prefetch, args=(files,), daemon=True, name="prefetch")
+    _thread.start()
+    return True
@@ -0,0 +1,95 @@
+"""
+Speed/quality render profiles
+default_settings in effects.json holds base render settings plus named profiles
+(preview / standard / hq). A job picks one with "profile" and may still override single
+settings; the merged result is checked against Wan 2.1 constraints before anything runs.
+"""
+
+import os
+import math
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+# Settings a profile or a job may set; each is bound to workflow inputs by workflow_template
+SETTING_KEYS = ("width", "height", "frames", "steps", "cfg", "fps", "crf", "vae_tiling")
+
+# Wan's VAE works on 8x spatial / 4x temporal latents with 2x2 patches
+DIMENSION_MULTIPLE = 16
+MIN_DIMENSION, MAX_DIMENSION = 256, 1280
+MAX_FRAMES = 161
+
+# Pick a generation size matching the input's aspect ratio (same pixel budget as the profile)
+ASPECT_BUCKETS = os.environ.get("ASPECT_BUCKETS", "1") == "1"
+ASPECT_RATIOS = ((1, 1), (4, 5), (5, 4), (3, 4), (4, 3), (2, 3), (3, 2), (9, 16), (16, 9))
+
+class InvalidSettings(Exception):
+    """Requested profile or settings cannot be rendered"""
+
+def _int(settings: Dict, key: str, low: int, high: int) -> int:
+    value = settings[key]
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise InvalidSettings(f"{key} must be an integer between {low} and {high}, got {value!r}")
+    return value
+
+def validate(settings: Dict[str, Any]):
+    """Raise InvalidSettings unless the merged settings fit the model"""
+    for key in ("width", "height"):
+        if _int(settings, key, MIN_DIMENSION, MAX_DIMENSION) % DIMENSION_MULTIPLE:
+            raise InvalidSettings(f"{key} must be a multiple of {DIMENSION_MULTIPLE}, got {settings[key]}")
+    if _int(settings, "frames", 5, MAX_FRAMES) % 4 != 1:
+        raise InvalidSettings(f"frames must be 4n+1 (e.g. 33, 81, 85), got {settings['frames']}")
+    _int(settings, "steps", 1, 100)
+    _int(settings, "fps", 1, 60)
+    _int(settings, "crf", 0, 51)
+    cfg = settings["cfg"]
+    if isinstance(cfg, bool) or not isinstance(cfg, (int, float)) or not 0 < cfg <= 30:
+        raise InvalidSettings(f"cfg must be a number in (0, 30], got {cfg!r}")
+    if not isinstance(settings["vae_tiling"], bool):
+        raise InvalidSettings(f"vae_tiling must be true or false, got {settings['vae_tiling']!r}")
+
+def resolve(default_settings: Dict, job_input: Dict) -> Dict[str, Any]:
+    """Base settings, then the chosen profile, then the job's own values - validated"""
+    profiles = default_settings.get("profiles", {})
+    name = job_input.get("profile") or default_settings.get("profile", "standard")
+    if name not in profiles:
+        raise InvalidSettings(f"Unknown profile: {name} (available: {', '.join(sorted(profiles))})")
+
+    settings = {key: default_settings[key] for key in SETTING_KEYS if key in default_settings}
+    settings.update(profiles[name])
+    settings.update({key: job_input[key] for key in SETTING_KEYS if job_input.get(key) is not None})
+    missing = [key for key in SETTING_KEYS if key not in settings]
+    if missing:
+        raise InvalidSettings(f"Profile {name} does not define: {', '.join(missing)}")
+    validate(settings)
+    return {"profile": name, **settings}
+
+def _round(value: float) -> int:
+    side = int(round(value / DIMENSION_MULTIPLE)) * DIMENSION_MULTIPLE
+    return min(MAX_DIMENSION, max(MIN_DIMENSION, side))
+
+@lru_cache(maxsize=None)
+def buckets(width: int, height: int) -> Tuple[Tuple[int, int], ...]:
+    """Sizes for every aspect ratio with about width x height pixels, e.g. 624x832 / 832x624 for 720x720"""
+    budget = width * height
+    return tuple(
+        (_round(math.sqrt(budget * w / h)), _round(math.sqrt(budget * h / w)))
+        for w, h in ASPECT_RATIOS
+    )
+
+def bucket_size(width: int, height: int, image_size: Tuple[int, int]) -> Tuple[int, int]:
+    """Bucket whose aspect ratio is closest (in log space) to the input image's"""
+    target = math.log(image_size[0] / image_size[1])
+    return min(buckets(width, height), key=lambda size: abs(math.log(size[0] / size[1]) - target))
+
+def max_bucket_width(width: int, height: int) -> int:
+    return max(size[0] for size in buckets(width, height))
+
+def bucketed(job_input: Dict) -> bool:
+    """Whether the generation size follows the input's aspect ratio (no explicit size asked)"""
+    return ASPECT_BUCKETS and not job_input.get("width") and not job_input.get("height")
+
+def generation_size(settings: Dict, job_input: Dict, image_size: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    """Bucketed size for the input image, unless the job asked for an explicit size"""
+    if not image_size or not bucketed(job_input):
+        return settings["width"], settings["height"]
+    return bucket_size(settings["width"], settings["height"], image_size)
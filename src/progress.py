@@ -0,0 +1,90 @@
+"""
+Job progress events for the streaming handler
+Turns ComfyUI websocket events for a job's prompts into small structured events:
+stage changes, sampler step N/M and (optionally) throttled low-resolution previews.
+"""
+
+import os
+import time
+import base64
+import struct
+import logging
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between preview frames sent to the client
+PREVIEW_INTERVAL = float(os.environ.get("PREVIEW_INTERVAL", "2"))
+
+# ComfyUI binary websocket frame: event type, then image format, then the image
+PREVIEW_IMAGE = 1
+PREVIEW_FORMATS = {1: "image/jpeg", 2: "image/png"}
+
+# Workflow node class -> stage reported while it executes
+STAGES = {
+    "LoadImage": "preprocessing",
+    "ImageResize+": "preprocessing",
+    "WanVideoModelLoader": "loading_model",
+    "WanVideoTextEncode": "encoding_prompt",
+    "WanVideoImageClipEncode": "encoding_image",
+    "WanVideoSampler": "sampling",
+    "WanVideoDecode": "decoding",
+    "VHS_VideoCombine": "saving"
+}
+
+class ProgressReporter:
+    """Collects a job's progress; without an emit callback every call is a no-op"""
+
+    def __init__(self, emit: Optional[Callable[[Dict], None]] = None,
+                 node_classes: Optional[Dict[str, str]] = None, previews: bool = False):
+        self._emit = emit
+        self.node_classes = node_classes or {}
+        self.previews = previews
+        self.started = time.monotonic()
+        self.labels: Dict[str, Dict] = {}
+        self._stage: Dict[str, str] = {}
+        self._last_preview = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._emit is not None
+
+    def emit(self, stage: str, **fields):
+        if self._emit is None:
+            return
+        try:
+            self._emit({"stage": stage, "elapsed": round(time.monotonic() - self.started, 3), **fields})
+        except Exception as e:
+            logger.warning(f"⚠️ Dropped progress event: {str(e)}")
+
+    def label(self, prompt_id: str, **fields):
+        """Extra fields (e.g. effect) attached to every event of a prompt"""
+        self.labels[prompt_id] = {"prompt_id": prompt_id, **fields}
+
+    def on_event(self, prompt_id: str, event_type: str, data):
+        """track_prompts callback: websocket event for one of the job's prompts"""
+        label = self.labels.get(prompt_id, {"prompt_id": prompt_id})
+
+        if event_type == "execution_start":
+            self.emit("started", **label)
+
+        elif event_type == "executing":
+            stage = STAGES.get(self.node_classes.get(data.get("node")))
+            if stage and stage != self._stage.get(prompt_id):
+                self._stage[prompt_id] = stage
+                self.emit(stage, **label)
+
+        elif event_type == "progress":
+            stage = STAGES.get(self.node_classes.get(data.get("node")), self._stage.get(prompt_id, "progress"))
+            self.emit(stage, step=data.get("value"), total=data.get("max"), **label)
+
+        elif event_type == "preview" and self.previews:
+            now = time.monotonic()
+            if now - self._last_preview < PREVIEW_INTERVAL or len(data) <= 8:
+                return
+            kind, image_format = struct.unpack(">II", data[:8])
+            if kind != PREVIEW_IMAGE or image_format not in PREVIEW_FORMATS:
+                return
+            self._last_preview = now
+            image = base64.b64encode(data[8:]).decode("ascii")
+            self.emit("preview", image=f"data:{PREVIEW_FORMATS[image_format]};base64,{image}", **label)
@@ -0,0 +1,80 @@
+"""
+Worker readiness tracking
+Records boot state and per-phase cold-start durations so they can be reported
+separately from customer job latency.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+STARTING = "starting"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_state = STARTING
+_error: Optional[str] = None
+_phases: Dict[str, float] = {}
+_boot_started: Optional[float] = None
+_boot_finished: Optional[float] = None
+
+def begin_boot() -> bool:
+    """Claim the boot; returns False if another caller already started it"""
+    global _boot_started
+    with _lock:
+        if _boot_started is not None:
+            return False
+        _boot_started = time.monotonic()
+        return True
+
+def boot_started() -> bool:
+    return _boot_started is not None
+
+def set_state(state: str, error: Optional[str] = None):
+    """Move to a new state; READY and FAILED release waiters"""
+    global _state, _error, _boot_finished
+    with _lock:
+        _state = state
+        _error = error
+        if state in (READY, FAILED):
+            if _boot_started is not None and _boot_finished is None:
+                _boot_finished = time.monotonic()
+            _ready.set()
+
+def record_phase(name: str, seconds: float):
+    with _lock:
+        _phases[name] = round(seconds, 3)
+
+@contextmanager
+def phase(name: str):
+    """Time a boot phase with the monotonic clock"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record_phase(name, time.monotonic() - start)
+
+def is_ready() -> bool:
+    return _state == READY
+
+def wait(timeout: Optional[float] = None) -> bool:
+    """Block until boot finished; True only if the worker is ready"""
+    _ready.wait(timeout)
+    return is_ready()
+
+def snapshot() -> Dict:
+    """Current readiness for reporting in responses or health checks"""
+    with _lock:
+        boot_seconds = None
+        if _boot_started is not None:
+            boot_seconds = round((_boot_finished or time.monotonic()) - _boot_started, 3)
+        return {
+            "state": _state,
+            "error": _error,
+            "boot_seconds": boot_seconds,
+            "phases": dict(_phases),
+        }
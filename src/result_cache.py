@@ -0,0 +1,96 @@
+"""
+Persistent cache of generated videos keyed by request fingerprint
+A fingerprint is the SHA-256 of the canonical JSON of everything that determines the
+output: input image bytes, effect, prompts, sampling settings, explicit seed and the
+workflow/effect configuration. Entries are LRU-evicted by mtime above a byte budget
+and optionally expire after RESULT_CACHE_TTL seconds.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+import disk
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE", "1") == "1"
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "/tmp/avatarka-result-cache")
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(4 * 1024 ** 3)))
+# Seconds an entry stays valid (0 = until evicted)
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "0"))
+
+_evict_lock = threading.Lock()
+
+def fingerprint(parts: Dict) -> str:
+    """Canonical hash of the normalized request inputs"""
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _paths(key: str):
+    base = Path(RESULT_CACHE_DIR) / key
+    return base.with_suffix(".mp4"), base.with_suffix(".json")
+
+def lookup(key: str) -> Optional[Path]:
+    """Cached video for a fingerprint (marked recently used), or None"""
+    video_path, meta_path = _paths(key)
+    try:
+        stat = video_path.stat()
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if RESULT_CACHE_TTL and time.time() - meta.get("created", 0) > RESULT_CACHE_TTL:
+        video_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+        return None
+    if stat.st_size != meta.get("size"):
+        return None
+
+    now = time.time()
+    try:
+        os.utime(video_path, (now, now))
+    except OSError:
+        pass
+    return video_path
+
+def store(key: str, video_path: str, meta: Optional[Dict] = None) -> bool:
+    """Add a finished video; hard-linked when possible so it outlives output cleanup"""
+    cached_path, meta_path = _paths(key)
+    temp_path = cached_path.with_name(f"{cached_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        cached_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(video_path, temp_path)
+        except OSError:
+            shutil.copyfile(video_path, temp_path)
+        size = temp_path.stat().st_size
+        with open(meta_path, "w") as f:
+            json.dump({**(meta or {}), "created": time.time(), "size": size}, f)
+        os.replace(temp_path, cached_path)
+    except OSError as e:
+        temp_path.unlink(missing_ok=True)
+        logger.warning(f"⚠️ Could not cache result: {str(e)}")
+        return False
+
+    evict(keep=cached_path)
+    return True
+
+def evict(max_bytes: int = RESULT_CACHE_MAX_BYTES, keep: Optional[Path] = None):
+    """Drop least recently used entries until the cache fits its budget"""
+    def remove(video_path: Path) -> bool:
+        if video_path == keep:
+            return False
+        video_path.unlink(missing_ok=True)
+        video_path.with_suffix(".json").unlink(missing_ok=True)
+        return True
+
+    with _evict_lock:
+        disk.evict_lru(Path(RESULT_CACHE_DIR).glob("*.mp4"), max_bytes, remove, label="cached result")
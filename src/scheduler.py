@@ -0,0 +1,130 @@
+"""
+Effect-affinity GPU scheduling
+Jobs take a GPU slot here before queueing prompts. When several are pending, one whose
+LoRA matches the LoRA the resident Wan model will have patched next goes first, so
+WanVideoModelLoader only re-patches when the effect actually changes. Reordering looks at
+the oldest SCHEDULER_WINDOW waiters and never passes over a job more than
+SCHEDULER_MAX_SKIPS times or once it has waited SCHEDULER_MAX_WAIT seconds.
+
+SCHEDULER_DEPTH jobs may hold slots at once, so with concurrent jobs the next prompt is
+already queued in ComfyUI while the current one samples.
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+SCHEDULER_WINDOW = int(os.environ.get("SCHEDULER_WINDOW", "8"))
+SCHEDULER_MAX_SKIPS = int(os.environ.get("SCHEDULER_MAX_SKIPS", "3"))
+SCHEDULER_MAX_WAIT = float(os.environ.get("SCHEDULER_MAX_WAIT", "60"))
+SCHEDULER_DEPTH = int(os.environ.get("SCHEDULER_DEPTH", "2"))
+
+class _Waiter:
+    __slots__ = ("key", "arrived", "skips", "granted")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.arrived = time.monotonic()
+        self.skips = 0
+        self.granted = False
+
+_cond = threading.Condition()
+_active = 0
+_current: Optional[str] = None
+_tail: Optional[str] = None
+_waiting: List[_Waiter] = []
+_stats = {"runs": 0, "swaps": 0, "reordered": 0, "swap_seconds": 0.0, "hit_seconds": 0.0}
+
+def _pick() -> _Waiter:
+    """Oldest waiter, unless a waiter in the window matches the LoRA of the last granted
+    job (or the applied one when idle) and the oldest has not hit its fairness or deadline cap"""
+    head = _waiting[0]
+    if head.skips >= SCHEDULER_MAX_SKIPS or time.monotonic() - head.arrived >= SCHEDULER_MAX_WAIT:
+        return head
+    upcoming = _tail if _active else _current
+    for waiter in _waiting[:SCHEDULER_WINDOW]:
+        if waiter.key == upcoming:
+            return waiter
+    return head
+
+def _grant():
+    """Hand free slots to the next waiters (caller holds _cond)"""
+    while _active < SCHEDULER_DEPTH and _waiting:
+        _grant_one()
+    _cond.notify_all()
+
+def _grant_one():
+    """Grant one slot, counting skips for the waiters passed over"""
+    global _active, _tail
+    chosen = _pick()
+    index = _waiting.index(chosen)
+    for passed in _waiting[:index]:
+        passed.skips += 1
+    if index:
+        _stats["reordered"] += 1
+    del _waiting[index]
+    chosen.granted = True
+    _active += 1
+    _tail = chosen.key
+
+@contextmanager
+def slot(key: str):
+    """Hold a GPU slot for a job whose prompts use LoRA `key`"""
+    global _active
+    waiter = _Waiter(key)
+    with _cond:
+        _waiting.append(waiter)
+        _grant()
+        while not waiter.granted:
+            _cond.wait()
+    try:
+        yield
+    finally:
+        with _cond:
+            _active -= 1
+            _grant()
+
+def current() -> Optional[str]:
+    """LoRA key patched into the resident model by the last executed prompt"""
+    return _current
+
+def set_applied(key: Optional[str]):
+    """Note the applied LoRA without counting a job (warm-up)"""
+    global _current
+    with _cond:
+        _current = key
+
+def record(key: str, execution_seconds: float) -> bool:
+    """Account for an executed prompt; returns True if it had to swap the LoRA"""
+    global _current
+    with _cond:
+        swapped = key != _current
+        _current = key
+        _stats["runs"] += 1
+        if swapped:
+            _stats["swaps"] += 1
+        _stats["swap_seconds" if swapped else "hit_seconds"] += execution_seconds
+        return swapped
+
+def snapshot() -> Dict:
+    """Swap counts and the estimated cost of a swap (mean swap run minus mean hit run)"""
+    with _cond:
+        runs = _stats["runs"]
+        swaps = _stats["swaps"]
+        hits = runs - swaps
+        mean_swap = _stats["swap_seconds"] / swaps if swaps else None
+        mean_hit = _stats["hit_seconds"] / hits if hits else None
+        swap_cost = mean_swap - mean_hit if mean_swap is not None and mean_hit is not None else None
+        return {
+            "current_lora": _current,
+            "active": _active,
+            "waiting": len(_waiting),
+            "runs": runs,
+            "swaps": swaps,
+            "hits": hits,
+            "hit_rate": round(hits / runs, 3) if runs else 0.0,
+            "reordered": _stats["reordered"],
+            "swap_cost_seconds": round(swap_cost, 3) if swap_cost is not None else None
+        }
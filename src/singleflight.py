@@ -0,0 +1,58 @@
+"""
+Single-flight coalescing of identical in-flight requests
+The first job with a given fingerprint leads: it submits the ComfyUI prompt and
+publishes the outcome. Identical jobs arriving while it runs follow: they wait for that
+outcome instead of submitting another prompt, then deliver the same video themselves.
+"""
+
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+class Flight:
+    """One in-flight generation and the jobs waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.outcome: Optional[Dict] = None
+        self.followers = 0
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """Leader's outcome ({"video_path", "prompt_id"} or {"error"}), None on timeout"""
+        if not self.done.wait(timeout):
+            return None
+        return self.outcome
+
+_lock = threading.Lock()
+_flights: Dict[str, Flight] = {}
+_stats = {"leaders": 0, "coalesced": 0}
+
+def begin(key: str) -> Tuple[Flight, bool]:
+    """Join the flight for key; returns (flight, True) if this job must lead it"""
+    with _lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            flight.followers += 1
+            _stats["coalesced"] += 1
+            return flight, False
+        flight = _flights[key] = Flight()
+        _stats["leaders"] += 1
+        return flight, True
+
+def finish(key: str, flight: Flight, outcome: Dict, on_publish: Optional[Callable[[int], None]] = None):
+    """Publish the leader's outcome and close the flight (later calls are no-ops).
+    
+    on_publish gets the final follower count before any follower wakes up.
+    """
+    with _lock:
+        if flight.done.is_set():
+            return
+        if _flights.get(key) is flight:
+            del _flights[key]
+        if on_publish:
+            on_publish(flight.followers)
+        flight.outcome = outcome
+        flight.done.set()
+
+def snapshot() -> Dict:
+    with _lock:
+        return {**_stats, "in_flight": len(_flights)}
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+AI-Avatarka worker entry point
+Boots ComfyUI, config and workflow (plus warm-up) before accepting RunPod jobs.
+"""
+
+import sys
+sys.path.append("/workspace/src")
+
+import runpod
+from handler import boot, logger, serverless_config
+
+if __name__ == "__main__":
+    logger.info("🚀 Starting AI-Avatarka handler...")
+    
+    # Cold start happens here, outside the customer latency path;
+    # a failed boot is reported by the handler via its readiness state
+    boot()
+    
+    # Handler variant follows STREAM_PROGRESS and MAX_CONCURRENCY
+    runpod.serverless.start(serverless_config())
@@ -0,0 +1,80 @@
+"""
+Cached T5 text embeddings
+Stock effect prompts are encoded once (builder/precompute_text_embeds.py) and loaded
+from safetensors at runtime; custom prompts are saved on first use into an LRU cache.
+Entries are named by a hash of the encoder and prompt pair.
+"""
+
+import os
+import time
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
+
+import comfy_client
+import disk
+
+logger = logging.getLogger(__name__)
+
+COMFYUI_PATH = os.environ.get("COMFYUI_PATH", "/workspace/ComfyUI")
+TEXT_EMBEDS_DIR = os.environ.get("TEXT_EMBEDS_DIR", f"{COMFYUI_PATH}/models/text_embeds")
+TEXT_EMBEDS_ENABLED = os.environ.get("TEXT_EMBEDS_CACHE", "1") == "1"
+
+# Budget for custom-prompt entries; stock effect embeddings are pinned and never evicted
+TEXT_EMBEDS_CACHE_MAX_BYTES = int(os.environ.get("TEXT_EMBEDS_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+LOADER_NODE = "AvatarkaLoadTextEmbeds"
+SAVER_NODE = "AvatarkaSaveTextEmbeds"
+
+_pinned: Set[str] = set()
+
+def encoder_signature(nodes) -> str:
+    """Identify the T5 encoder setup so cached embeddings are invalidated when it changes"""
+    for node in nodes.values():
+        if node.get("class_type") == "LoadWanVideoT5TextEncoder":
+            inputs = node.get("inputs", {})
+            return f"{inputs.get('model_name')}:{inputs.get('precision')}"
+    return "unknown"
+
+def embeds_name(positive: str, negative: str, encoder: str) -> str:
+    digest = hashlib.sha256(f"{encoder}\0{positive}\0{negative}".encode()).hexdigest()
+    return f"{digest[:32]}.safetensors"
+
+def lookup(name: str) -> bool:
+    """True if the embedding file exists (and mark it recently used)"""
+    path = Path(TEXT_EMBEDS_DIR) / name
+    try:
+        now = time.time()
+        os.utime(path, (now, now))
+        return True
+    except OSError:
+        return False
+
+def pin(names: Iterable[str]):
+    """Exclude stock prompt embeddings from eviction"""
+    _pinned.update(names)
+
+def evict(max_bytes: int = TEXT_EMBEDS_CACHE_MAX_BYTES):
+    """Drop least recently used custom-prompt embeddings above the byte budget"""
+    custom = (path for path in Path(TEXT_EMBEDS_DIR).glob("*.safetensors") if path.name not in _pinned)
+    disk.evict_lru(custom, max_bytes, label="cached text embeds")
+
+def nodes_available() -> bool:
+    """Check that ComfyUI has the embedding load/save nodes installed"""
+    try:
+        response = comfy_client.get(f"/object_info/{LOADER_NODE}")
+        return response.status_code == 200 and LOADER_NODE in response.json()
+    except Exception as e:
+        logger.warning(f"⚠️ Could not query ComfyUI node info: {str(e)}")
+        return False
+
+def stock_names(effects: Dict, encoder: str) -> Dict[str, str]:
+    """effect -> embedding file name for its stock prompt pair"""
+    return {
+        effect: embeds_name(config["prompt"], config["negative_prompt"], encoder)
+        for effect, config in effects.items()
+    }
+
+def missing(names: Iterable[str]) -> List[str]:
+    return [name for name in names if not (Path(TEXT_EMBEDS_DIR) / name).exists()]
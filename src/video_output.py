@@ -0,0 +1,106 @@
+"""
+Bounded-memory delivery of the output video
+The MP4 is read in fixed-size blocks and base64-encoded into one preallocated buffer,
+so the raw video is never held in memory. Oversized results go to bucket storage
+(when configured) or come back as a structured error instead of a huge JSON string.
+"""
+
+import os
+import binascii
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Read size; a multiple of 3 so every block encodes to whole base64 quanta
+CHUNK_SIZE = 3 * 256 * 1024
+
+# Cap on the base64 payload placed in the job response (RunPod rejects very large outputs)
+MAX_RESPONSE_BYTES = int(os.environ.get("MAX_RESPONSE_BYTES", str(15 * 1024 * 1024)))
+
+# Bucket upload is used for oversized videos when RunPod bucket credentials are present
+BUCKET_UPLOAD_ENABLED = bool(os.environ.get("BUCKET_ENDPOINT_URL"))
+
+class ResponseTooLarge(Exception):
+    """Encoded video would exceed MAX_RESPONSE_BYTES"""
+
+    def __init__(self, video_bytes: int, encoded_bytes: int, limit: int):
+        super().__init__(f"Encoded video is {encoded_bytes} bytes, limit is {limit}")
+        self.video_bytes = video_bytes
+        self.encoded_bytes = encoded_bytes
+        self.limit = limit
+
+def base64_size(raw_bytes: int) -> int:
+    """Length of the padded base64 encoding of raw_bytes"""
+    return 4 * ((raw_bytes + 2) // 3)
+
+def encode_file_base64(path: str, max_bytes: Optional[int] = MAX_RESPONSE_BYTES,
+                       chunk_size: int = CHUNK_SIZE) -> str:
+    """Stream a file into a base64 string using one output buffer and one read buffer"""
+    video_bytes = os.path.getsize(path)
+    encoded_bytes = base64_size(video_bytes)
+    if max_bytes is not None and encoded_bytes > max_bytes:
+        raise ResponseTooLarge(video_bytes, encoded_bytes, max_bytes)
+
+    chunk_size -= chunk_size % 3
+    out = bytearray(encoded_bytes)
+    read_buffer = bytearray(chunk_size)
+    read_view = memoryview(read_buffer)
+    position = 0
+
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            count = f.readinto(read_buffer)
+            if not count:
+                break
+            # Short reads mid-file would break quantum alignment - top the block up
+            while count < chunk_size and count % 3:
+                extra = f.readinto(read_view[count:])
+                if not extra:
+                    break
+                count += extra
+            encoded = binascii.b2a_base64(read_view[:count], newline=False)
+            out[position:position + len(encoded)] = encoded
+            position += len(encoded)
+
+    if position != encoded_bytes:
+        raise IOError(f"File changed while encoding: {path}")
+
+    # Single ASCII decode into the response string; the buffer is released on return
+    return out.decode("ascii")
+
+def deliver_video(video_path: str, job_id: Optional[str] = None,
+                  max_bytes: Optional[int] = MAX_RESPONSE_BYTES) -> Dict:
+    """Return {"video": base64}, {"video_url": url} or a structured error for the response"""
+    try:
+        video_base64 = encode_file_base64(video_path, max_bytes)
+        logger.info(f"✅ Video encoded to base64 ({os.path.getsize(video_path) / (1024 * 1024):.2f}MB)")
+        return {"video": video_base64}
+
+    except ResponseTooLarge as e:
+        logger.warning(f"⚠️ {str(e)}")
+        if BUCKET_UPLOAD_ENABLED:
+            try:
+                from runpod.serverless.utils import rp_upload
+                url = rp_upload.upload_file_to_bucket(
+                    file_name=Path(video_path).name,
+                    file_location=video_path,
+                    prefix=job_id
+                )
+                logger.info("✅ Oversized video uploaded to bucket")
+                return {"video_url": url, "video_size_bytes": e.video_bytes}
+            except Exception as upload_error:
+                logger.error(f"❌ Bucket upload failed: {str(upload_error)}")
+
+        return {
+            "error": "Output video exceeds maximum response size",
+            "error_code": "response_too_large",
+            "video_size_bytes": e.video_bytes,
+            "encoded_size_bytes": e.encoded_bytes,
+            "max_response_bytes": e.limit
+        }
+
+    except Exception as e:
+        logger.error(f"❌ Failed to encode video: {str(e)}")
+        return {"error": "Failed to encode output video"}
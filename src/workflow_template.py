@@ -0,0 +1,146 @@
+"""
+Precompiled workflow templates
+The API-format workflow is parsed once; each parameter is bound to its (node, input) targets
+and per-effect variants are pre-built, so a job is one cheap copy plus direct assignments.
+"""
+
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# parameter -> [(class_type, input name, placeholder or None to bind unconditionally)]
+PARAM_BINDINGS = {
+    "image": [("LoadImage", "image", "PLACEHOLDER_IMAGE")],
+    "prompt": [("WanVideoTextEncode", "positive_prompt", "PLACEHOLDER_PROMPT")],
+    "negative_prompt": [("WanVideoTextEncode", "negative_prompt", "PLACEHOLDER_NEGATIVE_PROMPT")],
+    "lora": [("WanVideoLoraSelect", "lora_name", "PLACEHOLDER_LORA")],
+    "lora_strength": [("WanVideoLoraSelect", "strength", None)],
+    "seed": [("WanVideoSampler", "seed", None)],
+    "steps": [("WanVideoSampler", "steps", None)],
+    "cfg": [("WanVideoSampler", "cfg", None)],
+    # The image embeds decide the latent length, the sampler input must agree
+    "frames": [("WanVideoSampler", "frames", None), ("WanVideoImageClipEncode", "num_frames", None)],
+    # Render profile settings (see profiles.py)
+    # The resize node fills/crops to the generation size, so the encoder never stretches or pads
+    "width": [("WanVideoImageClipEncode", "generation_width", None), ("ImageResize+", "width", None)],
+    "height": [("WanVideoImageClipEncode", "generation_height", None), ("ImageResize+", "height", None)],
+    "fps": [("VHS_VideoCombine", "frame_rate", None)],
+    "crf": [("VHS_VideoCombine", "crf", None)],
+    "vae_tiling": [("WanVideoDecode", "enable_vae_tiling", None), ("WanVideoImageClipEncode", "use_tiling", None)],
+    "output_prefix": [("VHS_VideoCombine", "filename_prefix", None)],
+}
+
+REQUIRED_PARAMS = ("image", "prompt", "negative_prompt", "lora", "seed")
+
+Bindings = Dict[str, Tuple[Tuple[str, str], ...]]
+
+@dataclass(frozen=True)
+class CompiledWorkflow:
+    """Read-only workflow nodes plus the (node_id, input) targets of each parameter"""
+    nodes: Dict[str, Dict]
+    bindings: Bindings
+
+    def instantiate(self, values: Dict[str, Any]) -> Dict:
+        """Return a fresh API-format workflow with the given parameter values applied"""
+        # Two-level copy: node dicts and their inputs; link lists are never mutated
+        workflow = {
+            node_id: {**node, "inputs": dict(node["inputs"])}
+            for node_id, node in self.nodes.items()
+        }
+        for param, value in values.items():
+            for node_id, input_name in self.bindings.get(param, ()):
+                workflow[node_id]["inputs"][input_name] = value
+        return workflow
+
+    def specialize(self, values: Dict[str, Any]) -> "CompiledWorkflow":
+        """Pre-apply values, returning a new template with the same bindings"""
+        return CompiledWorkflow(self.instantiate(values), self.bindings)
+
+def compile_workflow(workflow: Dict) -> CompiledWorkflow:
+    """Index an API-format workflow's parameter targets"""
+    targets: Dict[str, List[Tuple[str, str]]] = {param: [] for param in PARAM_BINDINGS}
+    nodes = {}
+
+    for node_id, node_data in workflow.items():
+        if not isinstance(node_data, dict):
+            continue
+        nodes[node_id] = {**node_data, "inputs": dict(node_data.get("inputs", {}))}
+        class_type = node_data.get("class_type", "")
+        inputs = nodes[node_id]["inputs"]
+
+        for param, candidates in PARAM_BINDINGS.items():
+            for bound_class, input_name, placeholder in candidates:
+                if class_type != bound_class:
+                    continue
+                if placeholder is not None and inputs.get(input_name) != placeholder:
+                    continue
+                targets[param].append((node_id, input_name))
+
+    missing = [param for param in REQUIRED_PARAMS if not targets[param]]
+    if missing:
+        raise ValueError(f"Workflow has no target node for: {', '.join(missing)}")
+
+    bindings = {param: tuple(found) for param, found in targets.items() if found}
+    return CompiledWorkflow(nodes, bindings)
+
+def load_compiled_workflow(path: str) -> CompiledWorkflow:
+    """Read and compile a workflow file"""
+    with open(path, "r") as f:
+        return compile_workflow(json.load(f))
+
+def build_effect_variants(template: CompiledWorkflow, effects: Dict[str, Dict]) -> Dict[str, CompiledWorkflow]:
+    """Pre-apply each effect's LoRA and (where the template has prompt inputs) stock prompts"""
+    variants = {}
+    for effect, config in effects.items():
+        values = {
+            "lora": config["lora"],
+            "lora_strength": config.get("lora_strength", 1.0),
+        }
+        if "prompt" in template.bindings:
+            values["prompt"] = config["prompt"]
+            values["negative_prompt"] = config["negative_prompt"]
+        variants[effect] = template.specialize(values)
+    logger.info(f"✅ Pre-built {len(variants)} effect workflow variants")
+    return variants
+
+def with_cached_text_embeds(template: CompiledWorkflow, loader_class: str) -> CompiledWorkflow:
+    """Replace the text encoder with an embeddings loader and drop the now-unused T5 loader.
+    
+    The new "text_embeds" parameter is the embeddings file to load; prompt bindings go away.
+    """
+    encode_id = template.bindings["prompt"][0][0]
+    nodes = dict(template.nodes)
+    encoder_links = [value for value in nodes[encode_id]["inputs"].values() if isinstance(value, list)]
+    nodes[encode_id] = {"class_type": loader_class, "inputs": {"embeds_name": ""}}
+
+    # Remove encoder dependencies nothing else references
+    for source_id, _ in encoder_links:
+        still_used = any(
+            isinstance(value, list) and value[0] == source_id
+            for node in nodes.values() for value in node["inputs"].values()
+        )
+        if not still_used:
+            del nodes[source_id]
+
+    bindings = {
+        param: targets for param, targets in template.bindings.items()
+        if param not in ("prompt", "negative_prompt")
+    }
+    bindings["text_embeds"] = ((encode_id, "embeds_name"),)
+    return CompiledWorkflow(nodes, bindings)
+
+def with_text_embeds_saver(template: CompiledWorkflow, saver_class: str) -> CompiledWorkflow:
+    """Add an output node that stores the encoded prompts ("text_embeds_save" parameter)"""
+    encode_id = template.bindings["prompt"][0][0]
+    saver_id = "avatarka_save_text_embeds"
+    nodes = dict(template.nodes)
+    nodes[saver_id] = {
+        "class_type": saver_class,
+        "inputs": {"text_embeds": [encode_id, 0], "embeds_name": ""}
+    }
+    bindings = dict(template.bindings)
+    bindings["text_embeds_save"] = ((saver_id, "embeds_name"),)
+    return CompiledWorkflow(nodes, bindings)
@@ -0,0 +1,73 @@
+"""
+Shared test setup
+Modules read their settings from the environment at import, so the fake ComfyUI server
+and every path the handler writes to are configured here, before any test imports them.
+"""
+
+import http.server
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "src"), str(ROOT / "builder"), str(ROOT / "tools")]
+
+from fake_comfyui import start_server
+
+WORKDIR = Path(tempfile.mkdtemp(prefix="avatarka-tests-"))
+COMFYUI_PATH = WORKDIR / "ComfyUI"
+
+_server, _state = start_server(COMFYUI_PATH, step_delay=0.01)
+
+os.environ.update(
+    COMFYUI_PATH=str(COMFYUI_PATH),
+    COMFYUI_SERVER=f"127.0.0.1:{_server.server_address[1]}",
+    EFFECTS_CONFIG=str(ROOT / "prompts" / "effects.json"),
+    WORKFLOW_PATH=str(ROOT / "workflow" / "universal_i2v.json"),
+    MODEL_VERIFY="off",
+    PREFETCH_ENABLED="0",
+    JOB_SCRATCH_DIR=str(WORKDIR / "scratch"),
+    IMAGE_SCRATCH_DIR=str(WORKDIR),
+    IMAGE_CACHE_DIR=str(WORKDIR / "image-cache"),
+    RESULT_CACHE_DIR=str(WORKDIR / "result-cache"),
+)
+
+@pytest.fixture
+def comfyui():
+    """The fake ComfyUI state; per-test behaviour switches are reset afterwards"""
+    yield _state
+    _state.fail_node = None
+    _state.cache_outputs = False
+    _state.step_delay = 0.01
+    _state.drop_prompt_responses = 0
+
+@pytest.fixture
+def http_stub():
+    """serve(handle) starts a local HTTP server that answers every GET/POST with handle(request); returns its URL"""
+    servers = []
+
+    def serve(handle):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                handle(self)
+
+            do_POST = do_GET
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,50 @@
+"""Identical in-flight requests share a prompt, unless each asks for a random seed"""
+
+import base64
+import io
+import random
+import threading
+
+import pytest
+from PIL import Image
+
+import handler
+
+@pytest.fixture(autouse=True)
+def booted():
+    assert handler.ensure_ready()
+
+def run_together(seed, count=2):
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 320), (30, 160, 90)).save(buffer, "JPEG")
+    image = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+    responses = [None] * count
+
+    def run(index):
+        responses[index] = handler.handler({"id": f"coalesce-{index}",
+                                            "input": {"image": image, "effect": "hulk", "seed": seed}})
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+def test_identical_fixed_seed_requests_share_one_prompt(comfyui):
+    comfyui.step_delay = 0.05
+    before = len(comfyui.history)
+
+    responses = run_together(random.randrange(1, 2 ** 31))
+
+    assert all("error" not in response for response in responses)
+    assert len(comfyui.history) == before + 1
+
+def test_random_seed_requests_each_get_a_prompt(comfyui):
+    comfyui.step_delay = 0.05
+    before = len(comfyui.history)
+
+    responses = run_together(-1)
+
+    assert all("error" not in response for response in responses)
+    assert len(comfyui.history) == before + 2
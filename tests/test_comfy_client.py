@@ -0,0 +1,79 @@
+"""Replaying ComfyUI requests: connect failures vs responses lost after the request went out"""
+
+import json
+import socket
+
+import pytest
+import requests
+
+import comfy_client
+import handler
+
+WORKFLOW = {
+    "1": {"class_type": "WanVideoSampler", "inputs": {"steps": 1}},
+    "2": {"class_type": "VHS_VideoCombine", "inputs": {"filename_prefix": "tests/replay"}},
+}
+
+class DropsFirst:
+    """Reads each request, hangs up on the first one and answers the rest"""
+
+    def __init__(self):
+        self.requests = 0
+
+    def __call__(self, request):
+        request.rfile.read(int(request.headers.get("Content-Length", 0)))
+        self.requests += 1
+        if self.requests == 1:
+            request.close_connection = True
+            return
+        body = json.dumps({"prompt_id": "p"}).encode()
+        request.send_response(200)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+@pytest.fixture
+def stub(http_stub, monkeypatch):
+    server = DropsFirst()
+    monkeypatch.setattr(comfy_client, "BASE_URL", http_stub(server))
+    comfy_client.close_session()
+    yield server
+    comfy_client.close_session()
+
+def test_lost_response_is_not_replayed_blindly(stub):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        comfy_client.post("/prompt", json={})
+
+    assert stub.requests == 1
+
+def test_lost_response_is_replayed_once_confirmed_not_applied(stub):
+    response = comfy_client.post("/prompt", json={}, applied=lambda: False)
+
+    assert response.status_code == 200
+    assert stub.requests == 2
+
+def test_idempotent_requests_are_replayed(stub):
+    assert comfy_client.get("/history/p").status_code == 200
+    assert stub.requests == 2
+
+def test_connect_failures_are_replayed(monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    attempts = []
+    monkeypatch.setattr(comfy_client, "BASE_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setattr(comfy_client, "latency_hooks", [lambda *observed: attempts.append(observed)])
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        comfy_client.post("/prompt", json={}, retries=2)
+
+    assert len(attempts) == 3
+
+def test_prompt_queued_before_the_connection_dropped_is_not_resubmitted(comfyui):
+    before = len(comfyui.prompts)
+    comfyui.drop_prompt_responses = 1
+
+    prompt_id = handler.submit_workflow(WORKFLOW)
+
+    assert prompt_id in comfyui.prompts
+    assert len(comfyui.prompts) == before + 1
@@ -0,0 +1,82 @@
+"""disk: the shared LRU eviction helper and the sweep of job folders"""
+
+import os
+
+import pytest
+
+import disk
+
+def make_files(tmp_path, sizes):
+    paths = []
+    for age, size in enumerate(sizes):
+        path = tmp_path / f"f{age}.bin"
+        path.write_bytes(b"x" * size)
+        # Older files first
+        os.utime(path, (1000 + age, 1000 + age))
+        paths.append(path)
+    return paths
+
+def test_evicts_oldest_until_under_budget(tmp_path):
+    paths = make_files(tmp_path, [100, 100, 100, 100])
+
+    evicted = disk.evict_lru(tmp_path.glob("*.bin"), 250)
+
+    assert evicted == [(paths[0], 100), (paths[1], 100)]
+    assert [path.exists() for path in paths] == [False, False, True, True]
+
+def test_kept_files_are_skipped(tmp_path):
+    paths = make_files(tmp_path, [100, 100, 100])
+
+    def remove(path):
+        if path == paths[0]:
+            return False
+        path.unlink()
+        return True
+
+    evicted = disk.evict_lru(tmp_path.glob("*.bin"), 150, remove)
+
+    assert [path for path, _ in evicted] == [paths[1], paths[2]]
+    assert paths[0].exists()
+
+def test_under_budget_is_untouched(tmp_path):
+    paths = make_files(tmp_path, [10, 10])
+
+    assert disk.evict_lru(tmp_path.glob("*.bin"), 100) == []
+    assert all(path.exists() for path in paths)
+
+@pytest.fixture
+def disk_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk, "OUTPUT_DIR", str(tmp_path / "output"))
+    monkeypatch.setattr(disk, "SCRATCH_ROOT", str(tmp_path / "scratch"))
+    jobs = tmp_path / "output" / disk.JOB_OUTPUT_SUBDIR
+    jobs.mkdir(parents=True)
+    return jobs
+
+def test_sweep_removes_orphaned_job_folders(disk_dirs):
+    orphan = disk_dirs / "crashed-job"
+    orphan.mkdir()
+    files = disk.JobFiles("live-job")
+    files.output_dir.mkdir()
+
+    disk.sweep(force=True)
+
+    assert not orphan.exists()
+    assert files.output_dir.exists()
+    files.close()
+    assert not files.output_dir.exists()
+
+def test_sweep_keeps_folders_of_jobs_started_during_the_walk(disk_dirs, monkeypatch):
+    started = []
+    evict_lru = disk.evict_lru
+
+    def job_starts_mid_sweep(*args, **kwargs):
+        files = disk.JobFiles("late-job")
+        files.output_dir.mkdir()
+        started.append(files)
+        return evict_lru(*args, **kwargs)
+
+    monkeypatch.setattr(disk, "evict_lru", job_starts_mid_sweep)
+    disk.sweep(force=True)
+
+    assert started[0].output_dir.exists()
+    started[0].close()
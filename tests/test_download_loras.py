@@ -0,0 +1,95 @@
+"""Concurrent LoRA fetch against a stub drive: retries, giving up, and the per-effect report"""
+
+import json
+import re
+import threading
+import time
+
+import pytest
+
+import download_models
+import model_manifest
+
+LORA = b"lora-weights" * 200  # over the 1KB sanity floor
+
+class Drive:
+    """Serves /<file_id>; each id can first fail with a status or a stall, a given number of times"""
+
+    def __init__(self):
+        self.failures = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        file_id = request.path.lstrip("/")
+        with self.lock:
+            self.requests[file_id] = self.requests.get(file_id, 0) + 1
+            failure, times = self.failures.get(file_id, (None, 0))
+            if times:
+                self.failures[file_id] = (failure, times - 1)
+        if times and failure == "stall":
+            # Past LORA_TIMEOUT, before a single byte
+            time.sleep(1)
+        status, body = (failure, b"unavailable") if times and failure != "stall" else (200, LORA)
+        try:
+            request.send_response(status)
+            request.send_header("Content-Type", "application/octet-stream")
+            request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            request.wfile.write(body)
+        except ConnectionError:
+            # The client gave up waiting
+            request.close_connection = True
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch, http_stub):
+    drive = Drive()
+    url = http_stub(drive)
+    (tmp_path / "loras").mkdir()
+    monkeypatch.setattr(download_models, "MODELS_PATH", tmp_path)
+    monkeypatch.setattr(download_models, "GDRIVE_URL", url + "/{file_id}")
+    monkeypatch.setattr(download_models, "RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(download_models, "LORA_TIMEOUT", 0.3)
+    monkeypatch.setattr(download_models, "LORA_FILES",
+                        {filename: f"id-{filename.split('.')[0]}" for filename in download_models.LORA_FILES})
+    return drive
+
+def fetch(drive, filename):
+    destination = download_models.MODELS_PATH / "loras" / filename
+    return download_models.download_from_gdrive(download_models.LORA_FILES[filename], destination, filename)
+
+@pytest.mark.parametrize("failure", [503, "stall"])
+def test_transient_failure_is_retried(drive, failure):
+    drive.failures["id-hulk"] = (failure, 2)
+
+    assert fetch(drive, "hulk.safetensors") is None
+
+    assert (download_models.MODELS_PATH / "loras" / "hulk.safetensors").read_bytes() == LORA
+    assert drive.requests["id-hulk"] == 3
+    assert "loras/hulk.safetensors" in model_manifest.load_record(download_models.MODELS_PATH)
+
+def test_gives_up_after_the_last_retry(drive):
+    drive.failures["id-hulk"] = (503, 100)
+
+    error = fetch(drive, "hulk.safetensors")
+
+    assert re.search(r"\b503\b", error)
+    assert drive.requests["id-hulk"] == download_models.LORA_RETRIES
+    assert not (download_models.MODELS_PATH / "loras" / "hulk.safetensors").exists()
+
+def test_report_names_the_effects_that_lost_their_lora(drive):
+    drive.failures["id-westworld"] = (503, 100)
+    drive.failures["id-samurai"] = (404, 100)
+    drive.failures["id-muscles"] = ("stall", 1)
+    manifest = {f"loras/{filename}": {} for filename in download_models.LORA_FILES}
+
+    failed = download_models.download_loras(manifest, {})
+
+    assert sorted(failed) == ["samurai.safetensors", "westworld.safetensors"]
+    problems = model_manifest.verify_models(download_models.MODELS_PATH, manifest)
+    with open(download_models.EFFECTS_CONFIG) as f:
+        effects = json.load(f)["effects"]
+    assert download_models.effects_missing_lora(problems) == {
+        effect: config["lora"] for effect, config in effects.items()
+        if config["lora"] in ("samurai.safetensors", "westworld.safetensors")
+    }
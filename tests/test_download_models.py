@@ -0,0 +1,129 @@
+"""Ranged base-model downloads against a stub server: assembly, resume, fallback, mismatch"""
+
+import hashlib
+import re
+import threading
+import time
+
+import pytest
+
+import download_models
+import model_manifest
+
+SEGMENT = 64 * 1024
+BLOB = bytes(range(256)) * (10 * SEGMENT // 256 + 37)  # ten full segments and a short one
+NAME = "vae/stub.safetensors"
+
+class Origin:
+    """Serves BLOB, honouring Range unless told not to; can cut segments short"""
+
+    def __init__(self, ranges=True):
+        self.ranges = ranges
+        self.fail_from = None
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        span = match and (int(match[1]), int(match[2] or len(BLOB) - 1))
+        with self.lock:
+            self.requests.append(span)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if match and self.ranges:
+                start, end = span
+                body = BLOB[start:end + 1]
+                request.send_response(206)
+                request.send_header("Content-Range", f"bytes {start}-{end}/{len(BLOB)}")
+            else:
+                start, body = 0, BLOB
+                request.send_response(200)
+            request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            # Long enough for the segments to overlap
+            time.sleep(0.02)
+            if self.fail_from is not None and start >= self.fail_from and len(body) > 1:
+                request.wfile.write(body[:len(body) // 2])
+                request.close_connection = True
+                return
+            request.wfile.write(body)
+        except ConnectionError:
+            # The probe hangs up once it has the headers
+            request.close_connection = True
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def segment_requests(self):
+        """Ranges fetched for data, without the one-byte probe"""
+        return [r for r in self.requests if r != (0, 0)]
+
+@pytest.fixture
+def models(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_models, "MODELS_PATH", tmp_path)
+    monkeypatch.setattr(download_models, "SEGMENT_SIZE", SEGMENT)
+    monkeypatch.setattr(download_models, "DOWNLOAD_CONNECTIONS", 4)
+    monkeypatch.setattr(download_models, "SEGMENT_RETRIES", 1)
+    monkeypatch.setattr(download_models, "RETRY_BASE_DELAY", 0)
+    (tmp_path / "vae").mkdir()
+    return tmp_path
+
+def download(url, models, expected=None):
+    return download_models.download_with_progress(url + "/stub", models / NAME, NAME, expected)
+
+def test_parallel_segments_assemble_the_file(models, http_stub):
+    origin = Origin()
+    url = http_stub(origin)
+
+    assert download(url, models, {"size": len(BLOB), "sha256": hashlib.sha256(BLOB).hexdigest()})
+
+    assert (models / NAME).read_bytes() == BLOB
+    assert sorted(origin.segment_requests()) == [
+        (start, min(start + SEGMENT, len(BLOB)) - 1) for start in range(0, len(BLOB), SEGMENT)]
+    assert origin.max_in_flight > 1
+    assert model_manifest.load_record(models)[NAME]["sha256"] == hashlib.sha256(BLOB).hexdigest()
+    assert not list(models.glob("vae/*.part*"))
+
+def test_interrupted_download_resumes_missing_segments(models, http_stub):
+    origin = Origin()
+    url = http_stub(origin)
+    part_path = models / (NAME + ".part")
+    origin.fail_from = 6 * SEGMENT
+
+    with pytest.raises(Exception):
+        download_models.download_ranged(url + "/stub", part_path, len(BLOB))
+
+    assert part_path.with_name(part_path.name + ".json").exists()
+    origin.fail_from = None
+    origin.requests.clear()
+
+    assert download(url, models)
+
+    assert (models / NAME).read_bytes() == BLOB
+    assert sorted(origin.segment_requests()) == [
+        (start, min(start + SEGMENT, len(BLOB)) - 1) for start in range(6 * SEGMENT, len(BLOB), SEGMENT)]
+    # The segments kept from the first run are part of the hash too
+    assert model_manifest.load_record(models)[NAME]["sha256"] == hashlib.sha256(BLOB).hexdigest()
+
+def test_server_without_ranges_streams_one_connection(models, http_stub):
+    origin = Origin(ranges=False)
+    url = http_stub(origin)
+
+    assert download(url, models, {"sha256": hashlib.sha256(BLOB).hexdigest()})
+
+    assert (models / NAME).read_bytes() == BLOB
+    # The probe, then one full GET
+    assert len(origin.requests) == 2
+    assert not list(models.glob("vae/*.part*"))
+
+def test_size_mismatch_discards_the_download(models, http_stub):
+    url = http_stub(Origin())
+
+    assert not download(url, models, {"size": len(BLOB) + 1})
+
+    assert not (models / NAME).exists()
+    assert not list(models.glob("vae/*.part"))
+    assert NAME not in model_manifest.load_record(models)
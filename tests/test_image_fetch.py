@@ -0,0 +1,119 @@
+"""Image URL fetching against a stub origin: limits, rejections and private-address checks"""
+
+import socket
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import image_fetch
+from image_fetch import FetchError
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 2048
+answered = set()
+
+def origin(request):
+    """/image?type=...&size=...&stall=...&status=...&first=...&to=... - shaped by the query string"""
+    query = {key: values[0] for key, values in parse_qs(urlparse(request.path).query).items()}
+    status = int(query.get("status", 200))
+    if "first" in query and request.path not in answered:
+        # A misbehaving origin: this status once, then the normal answer
+        answered.add(request.path)
+        status = int(query["first"])
+    body = PNG if "size" not in query else b"\0" * int(query["size"])
+    if "stall" in query:
+        time.sleep(float(query["stall"]))
+    try:
+        request.send_response(status)
+        if "to" in query:
+            request.send_header("Location", query["to"])
+        request.send_header("Content-Type", query.get("type", "image/png"))
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+    except ConnectionError:
+        request.close_connection = True
+
+@pytest.fixture
+def url(tmp_path, monkeypatch, http_stub):
+    monkeypatch.setattr(image_fetch, "IMAGE_CACHE_DIR", str(tmp_path))
+    # The stub listens on loopback
+    monkeypatch.setattr(image_fetch, "ALLOW_PRIVATE_HOSTS", True)
+    return http_stub(origin) + "/image"
+
+def test_fetches_and_caches(url):
+    path = image_fetch.fetch_image(url + "?a=1")
+
+    assert path.read_bytes() == PNG
+    assert image_fetch.fetch_image(url + "?a=1") == path
+
+def test_follows_redirects(url):
+    assert image_fetch.fetch_image(url + "?status=302&to=/image").read_bytes() == PNG
+
+def test_not_modified_without_metadata_refetches(url):
+    # The body is cached but its metadata sidecar is gone, and the origin still answers 304
+    data_path, meta_path = image_fetch._paths(url + "?first=304")
+    data_path.write_bytes(b"stale")
+
+    assert image_fetch.fetch_image(url + "?first=304").read_bytes() == PNG
+    assert meta_path.exists()
+
+def test_not_modified_to_an_unconditional_request_fails_cleanly(url):
+    with pytest.raises(FetchError, match="HTTP 304 with nothing cached"):
+        image_fetch.fetch_image(url + "?status=304")
+
+def test_rejects_oversized_image(url, monkeypatch):
+    monkeypatch.setattr(image_fetch, "MAX_DOWNLOAD_BYTES", 1024)
+
+    with pytest.raises(FetchError, match="exceeds 1024 bytes"):
+        image_fetch.fetch_image(url + "?size=4096")
+
+def test_times_out(url, monkeypatch):
+    monkeypatch.setattr(image_fetch, "READ_TIMEOUT", 0.2)
+
+    with pytest.raises(FetchError, match="download failed"):
+        image_fetch.fetch_image(url + "?stall=1")
+
+def test_rejects_non_image_content_type(url):
+    with pytest.raises(FetchError, match="unsupported content type: text/html"):
+        image_fetch.fetch_image(url + "?type=text/html")
+
+def test_reports_http_errors(url):
+    with pytest.raises(FetchError, match="HTTP 404"):
+        image_fetch.fetch_image(url + "?status=404")
+
+@pytest.mark.parametrize("bad_url", ["file:///etc/passwd", "ftp://example.com/a.png", "http://"])
+def test_rejects_unsupported_schemes(bad_url):
+    with pytest.raises(FetchError, match="Unsupported image URL"):
+        image_fetch.fetch_image(bad_url)
+
+@pytest.mark.parametrize("host", ["127.0.0.1:8188", "localhost", "10.0.0.5", "169.254.169.254", "[::1]", "[fd00:ec2::254]"])
+def test_rejects_private_hosts(host):
+    with pytest.raises(FetchError, match="not a public address"):
+        image_fetch.fetch_image(f"http://{host}/view?filename=x.png")
+
+def test_redirect_to_private_host_is_rejected(url, monkeypatch):
+    # Treat the stub as public, so only the redirect target is refused
+    monkeypatch.setattr(image_fetch, "ALLOW_PRIVATE_HOSTS", False)
+    monkeypatch.setattr(image_fetch, "_is_public", lambda address: address == "127.0.0.1")
+
+    with pytest.raises(FetchError, match="not a public address: 169.254.169.254"):
+        image_fetch.fetch_image(url + "?status=302&to=http://169.254.169.254/latest/meta-data/")
+
+def test_rebinding_to_a_private_address_is_refused_at_connect(url, monkeypatch):
+    # First answer (the check) is public, later ones (the connect) point at the stub on loopback
+    port = urlparse(url).port
+    answers = iter(["93.184.216.34"])
+    getaddrinfo = socket.getaddrinfo
+
+    def rebinding(host, *args, **kwargs):
+        if host != "rebind.test":
+            return getaddrinfo(host, *args, **kwargs)
+        address = next(answers, "127.0.0.1")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))]
+
+    monkeypatch.setattr(image_fetch, "ALLOW_PRIVATE_HOSTS", False)
+    monkeypatch.setattr(socket, "getaddrinfo", rebinding)
+
+    with pytest.raises(FetchError, match=r"not a public address: rebind\.test \(connected to 127\.0\.0\.1\)"):
+        image_fetch.fetch_image(f"http://rebind.test:{port}/image")
@@ -0,0 +1,83 @@
+"""On-demand LoRA fetch from a stub origin, and how the handler surfaces it"""
+
+import base64
+import functools
+import http.server
+import io
+import os
+import random
+import threading
+
+import pytest
+from PIL import Image
+
+import handler
+import model_store
+import scheduler
+
+@pytest.fixture
+def origin(tmp_path, monkeypatch):
+    """Stub LoRA origin serving tmp_path; records the active GPU slots at each request"""
+    slots_during_fetch = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self):
+            slots_during_fetch.append(scheduler.snapshot()["active"])
+            super().do_GET()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(Handler, directory=str(tmp_path)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(model_store, "LORA_ORIGIN_URL", f"http://127.0.0.1:{server.server_address[1]}/{{filename}}")
+    yield tmp_path, slots_during_fetch
+    server.shutdown()
+
+@pytest.fixture(autouse=True)
+def booted():
+    assert handler.ensure_ready()
+
+def job(effect):
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 320), (10, 120, 200)).save(buffer, "JPEG")
+    image = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+    return {"id": "lora-test", "input": {"image": image, "effect": effect, "seed": random.randrange(1, 2 ** 31)}}
+
+def test_missing_lora_is_fetched_before_the_gpu_slot(origin):
+    origin_dir, slots_during_fetch = origin
+    lora = handler.effects_data["effects"]["samurai"]["lora"]
+    (model_store.COMFYUI_LORA_DIR / lora).unlink(missing_ok=True)
+    (origin_dir / lora).write_bytes(b"lora-weights")
+
+    response = handler.handler(job("samurai"))
+
+    assert "error" not in response
+    assert (model_store.COMFYUI_LORA_DIR / lora).read_bytes() == b"lora-weights"
+    assert slots_during_fetch == [0]
+
+def test_unavailable_lora_fails_the_job_with_its_reason(origin):
+    lora = handler.effects_data["effects"]["westworld"]["lora"]
+    (model_store.COMFYUI_LORA_DIR / lora).unlink(missing_ok=True)
+
+    response = handler.handler(job("westworld"))
+
+    assert response["error"].startswith("LoRA unavailable:")
+    assert "HTTP 404" in response["error"]
+
+def test_cached_lora_with_a_lost_link_is_relinked_without_a_remote_tier(tmp_path, monkeypatch):
+    cache_dir, lora_dir = tmp_path / "cache", tmp_path / "loras"
+    cache_dir.mkdir()
+    monkeypatch.setattr(model_store, "LORA_CACHE_DIR", cache_dir)
+    monkeypatch.setattr(model_store, "COMFYUI_LORA_DIR", lora_dir)
+    monkeypatch.setattr(model_store, "MODEL_VOLUME_DIR", tmp_path / "no-volume")
+    monkeypatch.setattr(model_store, "LORA_ORIGIN_URL", None)
+    cached = cache_dir / "cached_only.safetensors"
+    cached.write_bytes(b"lora-weights")
+    os.utime(cached, (1000, 1000))
+
+    path = model_store.ensure_lora("cached_only.safetensors")
+
+    assert path == lora_dir / "cached_only.safetensors"
+    assert path.is_symlink() and path.read_bytes() == b"lora-weights"
+    assert cached.stat().st_mtime > 1000
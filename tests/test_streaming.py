@@ -0,0 +1,77 @@
+"""Streaming entry points: closing or cancelling a stream interrupts the job's prompt"""
+
+import asyncio
+import base64
+import io
+import random
+import time
+
+import pytest
+from PIL import Image
+
+import handler
+
+@pytest.fixture(autouse=True)
+def booted():
+    # Like start.py: boot before the first job so stages map to workflow node classes
+    assert handler.ensure_ready()
+
+def image_job():
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (200, 40, 40)).save(buffer, "JPEG")
+    image = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+    # A fresh seed so the result cache cannot answer without a prompt
+    return {"id": "stream-test", "input": {"image": image, "effect": "hulk", "seed": random.randrange(1, 2 ** 31)}}
+
+def wait_for_status(comfyui, prompt_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        entry = comfyui.history.get(prompt_id)
+        if entry:
+            return entry["status"]["status_str"]
+        time.sleep(0.05)
+    return None
+
+def test_stream_completes(comfyui):
+    events = list(handler.stream_handler(image_job()))
+
+    assert events[0]["stage"] == "queued"
+    assert any(event["stage"] == "sampling" for event in events)
+    assert events[-1]["stage"] == "completed"
+    assert events[-1]["result"]["video"]
+
+def test_closing_sync_stream_interrupts_prompt(comfyui):
+    comfyui.step_delay = 0.2
+    stream = handler.stream_handler(image_job())
+    prompt_id = next(event for event in stream if event.get("prompt_id"))["prompt_id"]
+
+    stream.close()
+
+    assert wait_for_status(comfyui, prompt_id) == "error"
+
+def test_cancelling_async_stream_interrupts_prompt(comfyui):
+    comfyui.step_delay = 0.2
+    seen = []
+
+    async def scenario():
+        async def consume():
+            async for event in handler.async_stream_handler(image_job()):
+                seen.append(event)
+
+        task = asyncio.create_task(consume())
+        while not any(event["stage"] == "sampling" for event in seen):
+            await asyncio.sleep(0.01)
+        # Mid-step: the stream is blocked waiting for the next event
+        await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return task
+
+    task = asyncio.run(scenario())
+    prompt_id = next(event["prompt_id"] for event in seen if event.get("prompt_id"))
+
+    assert task.cancelled()
+    assert wait_for_status(comfyui, prompt_id) == "error"
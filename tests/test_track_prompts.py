@@ -0,0 +1,60 @@
+"""track_prompts against the fake ComfyUI: websocket events, /history fallback, errors"""
+
+import uuid
+
+import handler
+
+WORKFLOW = {
+    "1": {"class_type": "WanVideoSampler", "inputs": {"steps": 2}},
+    "2": {"class_type": "VHS_VideoCombine", "inputs": {"filename_prefix": "tests/track"}},
+}
+
+def run_prompts(count=1):
+    client_id = str(uuid.uuid4())
+    ws = handler.connect_event_socket(client_id)
+    assert ws is not None
+    prompt_ids = [handler.submit_workflow(WORKFLOW, client_id) for _ in range(count)]
+    return prompt_ids, handler.track_prompts(prompt_ids, ws, timeout=30)
+
+def test_completion_over_websocket(comfyui):
+    events = []
+    client_id = str(uuid.uuid4())
+    ws = handler.connect_event_socket(client_id)
+    prompt_id = handler.submit_workflow(WORKFLOW, client_id)
+
+    status = handler.track_prompts([prompt_id], ws, timeout=30,
+                                   on_event=lambda *event: events.append(event[1]))[prompt_id]
+
+    assert status["error"] is None
+    assert status["video_path"].endswith(".mp4")
+    assert "progress" in events and "preview" in events
+    assert status["outputs"]["2"]["gifs"][0]["subfolder"] == "tests"
+
+def test_several_prompts_on_one_socket(comfyui):
+    prompt_ids, statuses = run_prompts(count=3)
+
+    assert [statuses[prompt_id]["error"] for prompt_id in prompt_ids] == [None] * 3
+    assert len({statuses[prompt_id]["video_path"] for prompt_id in prompt_ids}) == 3
+
+def test_cached_outputs_fall_back_to_history(comfyui):
+    comfyui.cache_outputs = True
+    before = comfyui.request_counts.get("history", 0)
+
+    prompt_ids, statuses = run_prompts()
+    status = statuses[prompt_ids[0]]
+
+    assert status["outputs"] == {}
+    assert status["error"] is None
+    assert status["video_path"].endswith(".mp4")
+    assert comfyui.request_counts.get("history", 0) == before + 1
+
+def test_execution_error(comfyui):
+    comfyui.fail_node = "1"
+
+    prompt_ids, statuses = run_prompts()
+    status = statuses[prompt_ids[0]]
+
+    assert status["done"]
+    assert status["video_path"] is None
+    assert "node 1 (WanVideoSampler)" in status["error"]
+    assert "Fake failure" in status["error"]
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+CPU-side benchmarks for the handler hot path (no GPU needed)
+Each case runs in its own process against a fake ComfyUI, reporting latency, throughput
+and peak RSS growth; results are compared to a stored baseline with a regression threshold.
+
+    python tools/benchmark.py                     # run all cases, compare to baseline
+    python tools/benchmark.py --update-baseline   # record a new baseline
+    python tools/benchmark.py --cases ingest_jpeg_4k,encode_base64_20mb --quick
+"""
+
+import argparse
+import base64
+import gc
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = ROOT / "tools" / "benchmark_baseline.json"
+
+# A case regresses when its median latency or peak RSS grows by more than this fraction
+DEFAULT_THRESHOLD = 0.25
+# Absolute slack so tiny cases don't flap on timer and allocator noise
+MEDIAN_SLACK_MS = 0.05
+PEAK_SLACK_MB = 4.0
+
+def photo_like(size, mode="RGB"):
+    """Gradient plus noise - compresses like a photo rather than a flat fill"""
+    from PIL import Image
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 48)
+    bands = [Image.blend(gradient, noise, 0.35), Image.blend(gradient.rotate(90).resize(size), noise, 0.5), noise]
+    image = Image.merge("RGB", bands)
+    if mode == "RGBA":
+        alpha = Image.radial_gradient("L").resize(size)
+        image.putalpha(alpha)
+    return image
+
+def data_uri(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return f"data:image/{image_format.lower()};base64," + base64.b64encode(buffer.getvalue()).decode()
+
+def ingest_case(make_input):
+    def setup(context):
+        import handler
+        image_data = make_input()
+
+        def run():
+            image = handler.process_input_image(image_data)
+            if not image:
+                raise RuntimeError("ingest failed")
+            handler.cleanup_input_image(image.filename)
+        return run, len(image_data), 8
+    return setup
+
+def setup_customize(context):
+    import handler
+    handler.load_effects_config()
+    handler.compile_workflow_template()
+    handler.load_workflow()
+    params = {"image_filename": "bench.jpg", "effect": "hulk", "prompt": "a person turning into hulk",
+              "steps": 10, "cfg": 6, "frames": 85, "seed": 42}
+
+    def run():
+        if not handler.customize_workflow(params):
+            raise RuntimeError("customize failed")
+    return run, None, 2000
+
+def encode_case(megabytes):
+    def setup(context):
+        import handler
+        path = Path(context["workdir"]) / f"bench_{megabytes}mb.mp4"
+        with open(path, "wb") as f:
+            f.write(os.urandom(megabytes * 1024 * 1024))
+
+        def run():
+            if handler.encode_video_to_base64(str(path)) is None:
+                raise RuntimeError("encode failed")
+        return run, megabytes * 1024 * 1024, 6
+    return setup
+
+def setup_handler(context):
+    import handler
+    state = context["state"]
+    state.video_size = 2 * 1024 * 1024
+    if not handler.boot():
+        raise RuntimeError("boot against fake ComfyUI failed")
+    job = {"id": "bench", "input": {"image": data_uri(photo_like((1280, 1280)), "JPEG", quality=92),
+                                    "effect": "hulk", "seed": 7}}
+
+    def run():
+        response = handler.handler(job)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+    return run, None, 10
+
+CASES = {
+    "ingest_jpeg_4k": ingest_case(lambda: data_uri(photo_like((3840, 2160)), "JPEG", quality=92)),
+    "ingest_png_rgba": ingest_case(lambda: data_uri(photo_like((2048, 2048), "RGBA"), "PNG")),
+    "ingest_webp": ingest_case(lambda: data_uri(photo_like((2048, 1536)), "WEBP", quality=90)),
+    "customize_workflow": setup_customize,
+    "encode_base64_5mb": encode_case(5),
+    "encode_base64_20mb": encode_case(20),
+    "encode_base64_50mb": encode_case(50),
+    "handler_fake_comfyui": setup_handler,
+}
+
+def rss_kb(field):
+    """VmRSS / VmHWM from /proc (Linux); falls back to ru_maxrss"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_rss():
+    """Reset VmHWM so the peak reflects only the measured calls (Linux >= 4.0)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def run_case(name, iterations_scale):
+    """Child process: set up the fake server and environment, time one case"""
+    workdir = tempfile.mkdtemp(prefix="avatarka_bench_")
+    sys.path[:0] = [str(ROOT / "src"), str(ROOT / "tools")]
+    from fake_comfyui import start_server
+    server, state = start_server(workdir, step_delay=0.0)
+    os.environ.update(
+        COMFYUI_PATH=workdir,
+        COMFYUI_SERVER=f"127.0.0.1:{server.server_address[1]}",
+        EFFECTS_CONFIG=str(ROOT / "prompts" / "effects.json"),
+        WORKFLOW_PATH=str(ROOT / "workflow" / "universal_i2v.json"),
+        INPUT_RETAIN_COUNT="0",
+        MAX_RESPONSE_BYTES=str(1024 ** 3),
+        WARMUP_ENABLED="0",
+        MODEL_VERIFY="off",
+        METRICS_LOG_INTERVAL="0",
+        # Timed iterations repeat the same job: measure the full path, not cache hits
+        RESULT_CACHE="0",
+        COALESCE_REQUESTS="0",
+        PREFETCH_ENABLED="0"
+    )
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    run, unit_bytes, iterations = CASES[name]({"workdir": workdir, "state": state})
+    iterations = max(2, int(iterations * iterations_scale))
+
+    # Peak covers the first (cold) call too, measured from the post-setup RSS
+    gc.collect()
+    rss_before = rss_kb("VmRSS")
+    reset_peak_rss()
+    run()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    peak_growth = max(0, rss_kb("VmHWM") - rss_before)
+    server.shutdown()
+
+    samples.sort()
+    median = statistics.median(samples)
+    result = {
+        "iterations": iterations,
+        "median_ms": round(median * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(0.95 * len(samples)))] * 1000, 3),
+        "ops_per_s": round(1 / median, 2) if median else None,
+        "peak_mb": round(peak_growth / 1024, 1)
+    }
+    if unit_bytes:
+        result["mb_per_s"] = round(unit_bytes / median / (1024 * 1024), 1)
+    print(json.dumps(result))
+
+def compare(results, baseline, threshold):
+    """Regression messages for cases that got slower or hungrier than the baseline"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["median_ms"] > base["median_ms"] * (1 + threshold) + MEDIAN_SLACK_MS:
+            regressions.append(f"{name}: median {result['median_ms']}ms vs baseline {base['median_ms']}ms")
+        if result["peak_mb"] > base["peak_mb"] * (1 + threshold) + PEAK_SLACK_MB:
+            regressions.append(f"{name}: peak {result['peak_mb']}MB vs baseline {base['peak_mb']}MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU benchmarks for the AI-Avatarka handler")
+    parser.add_argument("--cases", help="Comma-separated case names (default: all)")
+    parser.add_argument("--quick", action="store_true", help="Quarter the iteration counts")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--scale", type=float, default=1.0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(args.run_case, args.scale)
+        return 0
+
+    names = args.cases.split(",") if args.cases else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    results = {}
+    for name in names:
+        child = subprocess.run(
+            [sys.executable, __file__, "--run-case", name, "--scale", "0.25" if args.quick else "1"],
+            capture_output=True, text=True
+        )
+        if child.returncode != 0:
+            print(f"{name:24} FAILED\n{child.stderr.strip()}")
+            return 1
+        results[name] = json.loads(child.stdout.strip().splitlines()[-1])
+        result = results[name]
+        throughput = f"{result['mb_per_s']:>8} MB/s" if "mb_per_s" in result else f"{result['ops_per_s']:>8} op/s"
+        print(f"{name:24} median {result['median_ms']:>10.3f}ms  p95 {result['p95_ms']:>10.3f}ms  "
+              f"{throughput}  peak +{result['peak_mb']}MB")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    if args.update_baseline:
+        baseline.update(results)
+        baseline_path.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline updated: {baseline_path}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    if not baseline:
+        print("No baseline recorded - run with --update-baseline")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
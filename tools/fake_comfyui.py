@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Fake ComfyUI server for local handler testing without a GPU
+Speaks the subset of the ComfyUI API the handler uses: /prompt, /history, /ws, /upload/image
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+# Custom nodes the fake reports as installed (GET /object_info/<class>)
+INSTALLED_NODES = {"AvatarkaLoadTextEmbeds", "AvatarkaSaveTextEmbeds"}
+
+WS_MAGIC = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Minimal MP4 header so the output looks like a real file
+FAKE_VIDEO_HEADER = b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom"
+
+def encode_ws_frame(payload, opcode=0x1):
+    """Encode an unmasked server->client websocket frame"""
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack(">H", length)
+    else:
+        header += bytes([127]) + struct.pack(">Q", length)
+    return header + payload
+
+def read_ws_frame(rfile):
+    """Read one masked client->server frame, returns (opcode, payload) or None"""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None
+    opcode = head[0] & 0x0F
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", rfile.read(8))[0]
+    mask = rfile.read(4) if head[1] & 0x80 else b"\x00\x00\x00\x00"
+    data = rfile.read(length)
+    return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+class FakeComfyUI:
+    """State shared by the request handlers: prompts, history and ws clients"""
+
+    def __init__(self, comfyui_path, step_delay=0.05, video_size=64 * 1024, fail_node=None, cache_outputs=False):
+        self.comfyui_path = Path(comfyui_path)
+        self.step_delay = step_delay
+        self.video_size = video_size
+        self.fail_node = fail_node
+        # Report nodes as cached (no "executed" events, outputs only in /history) like a repeated prompt
+        self.cache_outputs = cache_outputs
+        self.history = {}
+        self.prompts = {}
+        self.clients = {}
+        self.request_counts = {}
+        self.lock = threading.Lock()
+        # Prompts run one at a time, in queue order, like a single-GPU ComfyUI
+        self.queue = queue.Queue()
+        self.running = None
+        self.deleted = set()
+        # Queue this many prompts but drop the connection instead of answering, like a
+        # ComfyUI that dies (or a proxy that resets) after accepting the request
+        self.drop_prompt_responses = 0
+        self.interrupted = set()
+        threading.Thread(target=self.run_queue, daemon=True).start()
+        (self.comfyui_path / "input").mkdir(parents=True, exist_ok=True)
+        (self.comfyui_path / "output").mkdir(parents=True, exist_ok=True)
+
+    def count(self, route):
+        with self.lock:
+            self.request_counts[route] = self.request_counts.get(route, 0) + 1
+
+    def send(self, client_id, event_type, data):
+        """Send a JSON event to a connected client, ignoring dead sockets"""
+        with self.lock:
+            client = self.clients.get(client_id)
+        if not client:
+            return
+        sock, send_lock = client
+        frame = encode_ws_frame(json.dumps({"type": event_type, "data": data}).encode())
+        try:
+            with send_lock:
+                sock.sendall(frame)
+        except OSError:
+            pass
+
+    def send_binary(self, client_id, payload):
+        """Send a binary preview frame (type 1 = JPEG preview, like ComfyUI)"""
+        with self.lock:
+            client = self.clients.get(client_id)
+        if not client:
+            return
+        sock, send_lock = client
+        try:
+            with send_lock:
+                sock.sendall(encode_ws_frame(struct.pack(">II", 1, 1) + payload, opcode=0x2))
+        except OSError:
+            pass
+
+    def queue_prompt(self, workflow, client_id, prompt_id=None):
+        # Like ComfyUI, a prompt_id chosen by the client is kept
+        prompt_id = prompt_id or str(uuid.uuid4())
+        with self.lock:
+            self.prompts[prompt_id] = workflow
+        self.queue.put((prompt_id, workflow, client_id))
+        return prompt_id
+
+    def run_queue(self):
+        while True:
+            prompt_id, workflow, client_id = self.queue.get()
+            with self.lock:
+                if prompt_id in self.deleted:
+                    continue
+                self.running = (prompt_id, workflow, client_id)
+            try:
+                self.execute(prompt_id, workflow, client_id)
+            finally:
+                with self.lock:
+                    self.running = None
+
+    def queue_listing(self):
+        """GET /queue: [number, prompt_id, prompt, extra_data, outputs] entries"""
+        with self.queue.mutex:
+            pending = list(self.queue.queue)
+        with self.lock:
+            running = [self.running] if self.running else []
+            pending = [item for item in pending if item[0] not in self.deleted]
+        def entry(number, item):
+            return [number, item[0], item[1], {"client_id": item[2]}, []]
+        return {"queue_running": [entry(0, item) for item in running],
+                "queue_pending": [entry(number, item) for number, item in enumerate(pending, 1)]}
+
+    def cancel(self, payload, interrupt):
+        """POST /queue {"delete": [...]} or /interrupt {"prompt_id": ...}"""
+        with self.lock:
+            if interrupt:
+                self.interrupted.add(payload.get("prompt_id"))
+            else:
+                self.deleted.update(payload.get("delete", []))
+
+    def execute(self, prompt_id, workflow, client_id):
+        """Walk the workflow nodes emitting the same events ComfyUI would"""
+        self.send(client_id, "execution_start", {"prompt_id": prompt_id})
+        if self.cache_outputs:
+            self.send(client_id, "execution_cached", {"nodes": list(workflow), "prompt_id": prompt_id})
+        outputs = {}
+        for node_id, node in workflow.items():
+            class_type = node.get("class_type", "")
+            self.send(client_id, "executing", {"node": node_id, "display_node": node_id, "prompt_id": prompt_id})
+
+            if node_id == self.fail_node:
+                self.send(client_id, "execution_error", {
+                    "prompt_id": prompt_id, "node_id": node_id, "node_type": class_type,
+                    "exception_message": "Fake failure", "exception_type": "RuntimeError",
+                    "traceback": []
+                })
+                self.record(prompt_id, workflow, outputs, "error")
+                return
+
+            if class_type == "WanVideoSampler":
+                steps = int(node.get("inputs", {}).get("steps", 10))
+                for step in range(1, steps + 1):
+                    time.sleep(self.step_delay)
+                    with self.lock:
+                        interrupted = prompt_id in self.interrupted
+                    if interrupted:
+                        self.send(client_id, "execution_interrupted", {"prompt_id": prompt_id, "node_id": node_id})
+                        self.record(prompt_id, workflow, outputs, "error")
+                        return
+                    self.send(client_id, "progress", {
+                        "value": step, "max": steps, "prompt_id": prompt_id, "node": node_id
+                    })
+                    self.send_binary(client_id, b"\xff\xd8fake-preview\xff\xd9")
+
+            if class_type == "AvatarkaSaveTextEmbeds":
+                embeds_dir = self.comfyui_path / "models" / "text_embeds"
+                embeds_dir.mkdir(parents=True, exist_ok=True)
+                (embeds_dir / node["inputs"]["embeds_name"]).write_bytes(b"fake-embeds")
+
+            if class_type == "VHS_VideoCombine":
+                # Like VHS, a prefix with slashes writes into (and reports) a subfolder
+                subfolder, _, prefix = node.get("inputs", {}).get("filename_prefix", "ComfyUI").rpartition("/")
+                output_dir = self.comfyui_path / "output" / subfolder
+                output_dir.mkdir(parents=True, exist_ok=True)
+                filename = f"{prefix}_{len(os.listdir(output_dir)):05d}.mp4"
+                with open(output_dir / filename, "wb") as f:
+                    f.write(FAKE_VIDEO_HEADER)
+                    f.write(os.urandom(max(self.video_size - len(FAKE_VIDEO_HEADER), 0)))
+                outputs[node_id] = {"gifs": [{
+                    "filename": filename, "subfolder": subfolder, "type": "output",
+                    "format": "video/h264-mp4"
+                }]}
+                if not self.cache_outputs:
+                    self.send(client_id, "executed", {"node": node_id, "output": outputs[node_id], "prompt_id": prompt_id})
+
+        self.record(prompt_id, workflow, outputs, "success")
+        self.send(client_id, "execution_success", {"prompt_id": prompt_id})
+        self.send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+    def record(self, prompt_id, workflow, outputs, status_str):
+        with self.lock:
+            self.history[prompt_id] = {
+                "prompt": [0, prompt_id, workflow, {}, []],
+                "outputs": outputs,
+                "status": {"status_str": status_str, "completed": status_str == "success", "messages": []}
+            }
+
+def make_request_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this, Nagle plus delayed
+        # ACKs add ~40ms to every keep-alive request
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            state.count(url.path.split("/")[1] or "/")
+
+            if url.path == "/ws":
+                return self.upgrade_websocket(parse_qs(url.query).get("clientId", [str(uuid.uuid4())])[0])
+            if url.path == "/system_stats":
+                return self.send_json({"system": {"os": "fake", "python_version": "3"}, "devices": []})
+            if url.path.startswith("/object_info/"):
+                class_type = url.path.split("/", 2)[2]
+                return self.send_json({class_type: {"name": class_type}} if class_type in INSTALLED_NODES else {})
+            if url.path.startswith("/history/"):
+                prompt_id = url.path.split("/", 2)[2]
+                with state.lock:
+                    entry = state.history.get(prompt_id)
+                return self.send_json({prompt_id: entry} if entry else {})
+            if url.path == "/queue":
+                return self.send_json(state.queue_listing())
+            if url.path == "/":
+                return self.send_json({})
+            self.send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            state.count(url.path.split("/")[1])
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            if url.path == "/prompt":
+                payload = json.loads(body or b"{}")
+                prompt_id = state.queue_prompt(payload.get("prompt", {}), payload.get("client_id"),
+                                               payload.get("prompt_id"))
+                with state.lock:
+                    drop = state.drop_prompt_responses > 0
+                    state.drop_prompt_responses -= drop
+                if drop:
+                    self.close_connection = True
+                    return
+                return self.send_json({"prompt_id": prompt_id, "number": len(state.prompts), "node_errors": {}})
+            if url.path in ("/queue", "/interrupt"):
+                state.cancel(json.loads(body or b"{}"), url.path == "/interrupt")
+                return self.send_json({})
+            if url.path == "/upload/image":
+                return self.upload_image(body)
+            self.send_json({"error": "not found"}, 404)
+
+        def upload_image(self, body):
+            """Store the multipart "image" field in the input dir, like ComfyUI"""
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode() + body
+            )
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition") == "image":
+                    name = Path(part.get_filename()).name
+                    (state.comfyui_path / "input" / name).write_bytes(part.get_payload(decode=True))
+                    return self.send_json({"name": name, "subfolder": "", "type": "input"})
+            self.send_json({"error": "no image"}, 400)
+
+        def upgrade_websocket(self, client_id):
+            key = self.headers.get("Sec-WebSocket-Key", "")
+            accept = base64.b64encode(hashlib.sha1((key + WS_MAGIC).encode()).digest()).decode()
+            self.send_response(101, "Switching Protocols")
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.end_headers()
+            self.wfile.flush()
+
+            with state.lock:
+                state.clients[client_id] = (self.connection, threading.Lock())
+            state.send(client_id, "status", {"status": {"exec_info": {"queue_remaining": 0}}, "sid": client_id})
+
+            # Hold the connection open until the client closes it
+            try:
+                while True:
+                    frame = read_ws_frame(self.rfile)
+                    if frame is None or frame[0] == 0x8:
+                        break
+            except OSError:
+                pass
+            finally:
+                with state.lock:
+                    state.clients.pop(client_id, None)
+                self.close_connection = True
+
+    return Handler
+
+def start_server(comfyui_path, host="127.0.0.1", port=0, **options):
+    """Start the fake server in a background thread, returns (server, state)"""
+    state = FakeComfyUI(comfyui_path, **options)
+    server = ThreadingHTTPServer((host, port), make_request_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake ComfyUI server for handler testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--comfyui-path", default="/tmp/fake-comfyui")
+    parser.add_argument("--step-delay", type=float, default=0.05)
+    parser.add_argument("--video-size", type=int, default=64 * 1024)
+    parser.add_argument("--fail-node", default=None)
+    parser.add_argument("--cache-outputs", action="store_true")
+    args = parser.parse_args()
+
+    server, _ = start_server(
+        args.comfyui_path, args.host, args.port,
+        step_delay=args.step_delay, video_size=args.video_size, fail_node=args.fail_node,
+        cache_outputs=args.cache_outputs
+    )
+    print(f"[INFO] Fake ComfyUI listening on {args.host}:{server.server_address[1]} ({args.comfyui_path})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()